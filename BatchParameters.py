@@ -0,0 +1,344 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Iterable, Tuple
+from numba import njit, prange
+
+import numpy as np
+
+from DataCarrier import DataCarrier
+from EventChecker import pick_arrays_of_interest
+from EventOfInterest import EventOfInterest
+from Parameters import (
+    ad,
+    _template_matches,
+    _window_indexes,
+    _moments,
+    _MEAN,
+    _M2,
+    _M3,
+    _M4,
+    _D1_VAR,
+    _D2_VAR,
+    _D1_ABS_MEAN,
+    _OUTPUT,
+    _TKEO,
+    _MAX,
+    _MIN,
+)
+
+
+_n_parameters = len(Consts.parameters_names)
+
+
+@njit(cache=True, error_model="numpy")
+def _phi(counts: np.ndarray, n: int, m: int) -> float:
+    """
+    Averaged logarithm of template neighbours - same as __phi of Parameters.ApEn
+    :param counts: neighbour counts of the templates with length m
+    :param n: length of the signal
+    :param m: length of the templates
+    :return: phi as float
+    """
+    nm = n - m
+    if nm == 0:
+        nm = 1
+    return np.sum(np.log(counts / (n - m + 1.0))) / nm
+
+
+@njit(cache=True, error_model="numpy")
+def _apen(magnitude: np.ndarray, m: int, r: float) -> float:
+    """
+    Same as Parameters.ApEn with sorted templates, but callable from compiled code
+    :param magnitude: 1D array of values
+    :param m: length of compared data
+    :param r: filtering level
+    :return: entropy as float
+    """
+    n = magnitude.shape[0]
+    counts_m, counts_m1, _, _ = _template_matches(magnitude, m, r, True)
+    return np.abs(_phi(counts_m1, n, m + 1) - _phi(counts_m, n, m)) / n
+
+
+@njit(cache=True, error_model="numpy")
+def _event_parameters(
+    time_seconds: np.ndarray,
+    magnitude: np.ndarray,
+    acg_xyz: np.ndarray,
+    begin_index: int,
+    end_index: int,
+    free_fall_end_index: int,
+    result: np.ndarray,
+):
+    """
+    Fills row of the parameters for one event in order of Consts.parameters_names
+    Row stays NaN, if the change in angle cos can not be calculated or the event is empty
+    :param time_seconds: time of the recording in seconds
+    :param magnitude: magnitude of the recording
+    :param acg_xyz: raw 3D acceleration of the recording
+    :param begin_index: beginning of the event
+    :param end_index: ending of the event
+    :param free_fall_end_index: ending of the free fall, -1 if there is none
+    :param result: row of the matrix to fill
+    """
+    event = magnitude[begin_index:end_index]
+    if event.shape[0] == 0:
+        return
+
+    # free-fall part is removed, same slicing as EventOfInterest.get_from_free_fall
+    from_free_fall = event
+    if free_fall_end_index != -1:
+        from_free_fall = event[free_fall_end_index - begin_index :]
+
+    # change in angle cos - 1s before and after the event
+    bb, eb, ba, ea = _window_indexes(time_seconds, begin_index, end_index)
+    before = acg_xyz[:, bb:eb]
+    after = acg_xyz[:, ba:ea]
+    if before.shape[1] == 0 or after.shape[1] == 0:
+        return
+
+    aa = np.zeros(3)
+    ab = np.zeros(3)
+    for axis in range(3):
+        aa[axis] = np.mean(before[axis])
+        ab[axis] = np.mean(after[axis])
+    acca = np.sqrt(np.sum(aa ** 2))
+    accb = np.sqrt(np.sum(ab ** 2))
+    angle_cos = np.degrees(np.arccos(np.sum(aa * ab) / (acca * accb)))
+
+    # basic statistics of the event
+    moments = _moments(event)
+    activity = moments[_M2]
+    mobility = np.sqrt(moments[_D1_VAR] / activity)
+
+    result[0] = moments[_MEAN]
+    result[1] = np.sqrt(activity)
+    result[2] = activity
+    result[3] = mobility
+    result[4] = np.sqrt(moments[_D2_VAR] / mobility)
+    result[5] = moments[_TKEO]
+    result[6] = moments[_OUTPUT]
+    result[7] = _apen(event, 10, 3)
+    result[8] = moments[_D1_ABS_MEAN]
+    result[9] = np.abs(moments[_MAX]) / np.sqrt(moments[_OUTPUT])
+
+    # parameters specific for acceleration
+    result[10] = np.mean(np.sqrt(acg_xyz[0] ** 2 + acg_xyz[2] ** 2))
+    result[11] = angle_cos
+    result[12] = ad(acg_xyz)
+    if free_fall_end_index == -1:
+        result[13] = 10.0
+    else:
+        result[13] = np.mean(magnitude[begin_index:free_fall_end_index])
+    result[14] = moments[_MAX] - moments[_MIN]
+    result[15] = np.sum(from_free_fall > 30) / np.sum(from_free_fall < 30)
+
+    moments_free_fall = _moments(from_free_fall)
+    result[16] = moments_free_fall[_M4] / moments_free_fall[_M2] ** 2
+    result[17] = moments_free_fall[_M3] / moments_free_fall[_M2] ** 1.5
+
+    crossed = False
+    crosses = 0
+    for value in from_free_fall:
+        if crossed and value > 9.25:
+            crosses += 1
+            crossed = False
+        elif not crossed and value < 9.25:
+            crosses += 1
+            crossed = True
+    result[18] = crosses
+
+
+@njit(cache=True, parallel=True, error_model="numpy")
+def _batch_parameters(
+    time_seconds: np.ndarray,
+    magnitude: np.ndarray,
+    acg_xyz: np.ndarray,
+    offsets: np.ndarray,
+    begin_indexes: np.ndarray,
+    end_indexes: np.ndarray,
+    free_fall_end_indexes: np.ndarray,
+) -> np.ndarray:
+    """
+    Calculates parameters for all the events in parallel
+    :return: matrix events x parameters
+    """
+    n_events = offsets.shape[0] - 1
+    result = np.full((n_events, _n_parameters), np.nan)
+    for e in prange(n_events):
+        start = offsets[e]
+        stop = offsets[e + 1]
+        _event_parameters(
+            time_seconds[start:stop],
+            magnitude[start:stop],
+            acg_xyz[:, start:stop],
+            begin_indexes[e],
+            end_indexes[e],
+            free_fall_end_indexes[e],
+            result[e],
+        )
+    return result
+
+
+def calculate_acg_parameters_batch(
+    time_seconds: np.ndarray,
+    magnitude: np.ndarray,
+    acg_xyz: np.ndarray,
+    offsets: np.ndarray,
+    begin_indexes: np.ndarray,
+    end_indexes: np.ndarray,
+    free_fall_end_indexes: np.ndarray,
+) -> np.ndarray:
+    """
+    Calculates same parameters as Parameters.calculate_acg_parameters for many events at once.
+    Signals of the events are concatenated into one flat buffer, where event e occupies samples
+    offsets[e]:offsets[e + 1] - indexes of the events are relative to the beginning of the event's part.
+    Events are processed in parallel on all cores.
+    :param time_seconds: concatenated time in seconds
+    :param magnitude: concatenated magnitude of acceleration 1D
+    :param acg_xyz: concatenated raw acceleration 3D - axes x samples
+    :param offsets: beginnings of the events in buffer with total length at the end - n_events + 1
+    :param begin_indexes: beginnings of the events
+    :param end_indexes: endings of the events
+    :param free_fall_end_indexes: endings of the free falls, -1 if there is no free fall
+    :return: matrix n_events x parameters in order of Consts.parameters_names,
+    rows of events without valid parameters (None in calculate_acg_parameters) are NaN
+    """
+    return _batch_parameters(
+        np.ascontiguousarray(time_seconds, dtype=np.float64),
+        np.ascontiguousarray(magnitude, dtype=np.float64),
+        np.ascontiguousarray(acg_xyz, dtype=np.float64),
+        np.asarray(offsets, dtype=np.int64),
+        np.asarray(begin_indexes, dtype=np.int64),
+        np.asarray(end_indexes, dtype=np.int64),
+        np.asarray(free_fall_end_indexes, dtype=np.int64),
+    )
+
+
+def pack_events(
+    events: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray, EventOfInterest]]
+) -> Tuple[np.ndarray, ...]:
+    """
+    Concatenates the events into the buffers for calculate_acg_parameters_batch
+    :param events: tuples of time in seconds, magnitude, raw 3D acceleration and EventOfInterest -
+    same arguments as for Parameters.calculate_acg_parameters
+    :return: time, magnitude, acg_xyz, offsets, begin indexes, end indexes, free fall end indexes
+    """
+    times, magnitudes, acg_xyzs = [], [], []
+    begin_indexes, end_indexes, free_fall_end_indexes = [], [], []
+    offsets = [0]
+
+    for time_seconds, magnitude, acg_xyz, event_holder in events:
+        times.append(time_seconds)
+        magnitudes.append(magnitude)
+        acg_xyzs.append(acg_xyz)
+        offsets.append(offsets[-1] + magnitude.shape[0])
+
+        begin_indexes.append(event_holder.begin_index)
+        end_indexes.append(event_holder.end_index)
+        if event_holder.free_fall_end_index is None:
+            free_fall_end_indexes.append(-1)
+        else:
+            free_fall_end_indexes.append(event_holder.free_fall_end_index)
+
+    if len(offsets) == 1:
+        return (
+            np.empty(0),
+            np.empty(0),
+            np.empty((3, 0)),
+            np.zeros(1, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+        )
+
+    return (
+        np.concatenate(times),
+        np.concatenate(magnitudes),
+        np.hstack(acg_xyzs),
+        np.array(offsets, dtype=np.int64),
+        np.array(begin_indexes, dtype=np.int64),
+        np.array(end_indexes, dtype=np.int64),
+        np.array(free_fall_end_indexes, dtype=np.int64),
+    )
+
+
+def calculate_acg_parameters_data_carriers(data: Iterable[DataCarrier]) -> np.ndarray:
+    """
+    Batch version of Parameters.calculate_acg_parameters_data_carrier
+    :param data: DataCarriers with ACG data, magnitude, time in seconds and picked event
+    :return: matrix n_carriers x parameters, NaN rows for carriers without valid parameters
+    """
+    return calculate_acg_parameters_batch(
+        *pack_events(
+            (
+                carrier.sensor_data[Consts.ACG].modified[Consts.TIME_SECONDS],
+                carrier.sensor_data[Consts.ACG].modified[Consts.MAGNITUDE],
+                carrier.sensor_data[Consts.ACG].data,
+                carrier.event_holder,
+            )
+            for carrier in data
+        )
+    )
+
+
+def pack_recordings(data: Iterable[DataCarrier]) -> Tuple[np.ndarray, ...]:
+    """
+    Concatenates the whole recordings into the buffers for EventChecker.pick_arrays_of_interest
+    and calculate_acg_parameters_batch
+    :param data: DataCarriers with ACG data
+    :return: time, magnitude, acg_xyz, offsets
+    """
+    times, magnitudes, acg_xyzs = [], [], []
+    offsets = [0]
+    for carrier in data:
+        acceleration = carrier.sensor_data[Consts.ACG]
+        times.append(acceleration.time_seconds)
+        magnitudes.append(acceleration.magnitude)
+        acg_xyzs.append(acceleration.data)
+        offsets.append(offsets[-1] + acceleration.magnitude.shape[0])
+
+    if len(offsets) == 1:
+        return np.empty(0), np.empty(0), np.empty((3, 0)), np.zeros(1, dtype=np.int64)
+
+    return (
+        np.concatenate(times),
+        np.concatenate(magnitudes),
+        np.hstack(acg_xyzs),
+        np.array(offsets, dtype=np.int64),
+    )
+
+
+def calculate_acg_parameters_recordings(data: Iterable[DataCarrier]) -> Tuple[np.ndarray, Tuple[np.ndarray, ...]]:
+    """
+    Events and their parameters of many recordings without Python call per recording - both boundaries
+    and parameters are computed on all cores from one flat buffer
+    :param data: DataCarriers with ACG data
+    :return: matrix n_carriers x parameters with NaN rows for carriers without valid parameters,
+    begin, end, max_peak_index and free_fall_end of every recording (-1 as in pick_arrays_of_interest)
+    """
+    time_seconds, magnitude, acg_xyz, offsets = pack_recordings(data)
+    begin, end, max_peak_index, free_fall_end = pick_arrays_of_interest(time_seconds, magnitude, offsets)
+    return (
+        calculate_acg_parameters_batch(
+            time_seconds, magnitude, acg_xyz, offsets, begin, end, free_fall_end
+        ),
+        (begin, end, max_peak_index, free_fall_end),
+    )
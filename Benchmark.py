@@ -0,0 +1,305 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Callable, Iterable, List, Optional
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import tempfile
+import timeit
+import warnings
+
+import numba
+import numpy as np
+import pandas as pd
+
+import Parameters
+from DataCarrier import DataCarrier, SensorData
+from EventChecker import (
+    calculate_time_magnitude,
+    get_event_of_interest,
+    pick_array_of_interest,
+)
+from IQRCleaning import iqr_rule, iqr_rule_outliers
+from SyntheticData import generate_acceleration, write_measurement
+
+
+def measure_function(function: Callable, repeat=5) -> dict:
+    """
+    Times the function like timeit - number of calls in one repetition is picked automatically to last at least 0.2 s.
+    The first call is done before the measurement, so compilation of numba functions is not included.
+    :param function: function without arguments
+    :param repeat: number of repetitions
+    :return: dictionary with best / mean / worst time of one call in seconds, number of calls per repetition
+    """
+    function()
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = np.array(timer.repeat(repeat=repeat, number=number)) / number
+    return {
+        "best_s": float(np.min(times)),
+        "mean_s": float(np.mean(times)),
+        "worst_s": float(np.max(times)),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def _load_sensors(path: str) -> DataCarrier:
+    """
+    DataCarrier parses the sensors at the first access - all of them are touched, so the parsing is measured.
+    The binary cache is skipped, the csv files are parsed every time.
+    :param path: path to folder with the measurement
+    :return: DataCarrier with parsed sensors
+    """
+    data_carrier = DataCarrier(path, use_cache=False)
+    for sensor_type in data_carrier.sensor_data.available:
+        data_carrier.sensor_data[sensor_type]
+    return data_carrier
+
+
+def _parameters_cases(
+    time_seconds: np.ndarray,
+    magnitude: np.ndarray,
+    acg_xyz: np.ndarray,
+    data_carrier: DataCarrier,
+) -> dict:
+    """
+    :return: name -> function without arguments for every public function of Parameters.py
+    """
+    event = get_event_of_interest(time_seconds, magnitude)
+    event_magnitude = event.event_magnitude
+    from_free_fall = event.get_from_free_fall
+    begin, end = event.begin_index, event.end_index
+
+    return {
+        "Parameters.basic_stats": lambda: Parameters.basic_stats(event_magnitude),
+        "Parameters.calculate_acg_parameters": lambda: Parameters.calculate_acg_parameters(
+            time_seconds, magnitude, acg_xyz, event
+        ),
+        "Parameters.calculate_acg_parameters_data_carrier": lambda: Parameters.calculate_acg_parameters_data_carrier(
+            data_carrier
+        ),
+        "Parameters.change_in_angle": lambda: Parameters.change_in_angle(acg_xyz),
+        "Parameters.ad": lambda: Parameters.ad(acg_xyz),
+        "Parameters.before_and_after_fall": lambda: Parameters.before_and_after_fall(
+            time_seconds, acg_xyz, begin, end
+        ),
+        "Parameters.change_in_angle_cos": lambda: Parameters.change_in_angle_cos(
+            time_seconds, acg_xyz, begin, end
+        ),
+        "Parameters.free_fall_index": lambda: Parameters.free_fall_index(
+            magnitude, event
+        ),
+        "Parameters.minmax": lambda: Parameters.minmax(event_magnitude),
+        "Parameters.ratio_3g": lambda: Parameters.ratio_3g(from_free_fall),
+        "Parameters.kurtosis": lambda: Parameters.kurtosis(from_free_fall),
+        "Parameters.skewness": lambda: Parameters.skewness(from_free_fall),
+        "Parameters.momentum": lambda: Parameters.momentum(event_magnitude, 4),
+        "Parameters.hjorth_params": lambda: Parameters.hjorth_params(event_magnitude),
+        "Parameters.avg_tkeo": lambda: Parameters.avg_tkeo(event_magnitude),
+        "Parameters.avg_output": lambda: Parameters.avg_output(event_magnitude),
+        "Parameters.ApEn": lambda: Parameters.ApEn(event_magnitude, 10, 3),
+        "Parameters.ApEn_sorted": lambda: Parameters.ApEn(
+            event_magnitude, 10, 3, sort_templates=True
+        ),
+        "Parameters.SampEn": lambda: Parameters.SampEn(event_magnitude, 10, 3),
+        "Parameters.waveform_length": lambda: Parameters.waveform_length(
+            event_magnitude
+        ),
+        "Parameters.crest_factor": lambda: Parameters.crest_factor(event_magnitude),
+        "Parameters.g_cross_rate": lambda: Parameters.g_cross_rate(from_free_fall),
+        "Parameters.moving_average": lambda: Parameters.moving_average(magnitude),
+    }
+
+
+def run_benchmarks(
+    sample_rates: Iterable[int] = (50, 100, 200),
+    seconds: Iterable[float] = (12, 60),
+    repeat=5,
+    names: Optional[List[str]] = None,
+    seed=0,
+) -> dict:
+    """
+    Benchmarks the public functions on synthetic recordings with a fall
+    :param sample_rates: sample rates of the recordings
+    :param seconds: lengths of the recordings
+    :param repeat: number of repetitions of every measurement
+    :param names: run only benchmarks, which contain one of the names - None for all
+    :param seed: seed of the synthetic data
+    :return: dictionary with information about machine and list of results
+    """
+    results = []
+
+    def __run(name: str, function: Callable, **case):
+        if names is not None and not any(n in name for n in names):
+            return
+        record = {"name": name, **case}
+        record.update(measure_function(function, repeat))
+        results.append(record)
+
+    temporary = tempfile.mkdtemp(prefix="besafebox_benchmark_")
+    try:
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=RuntimeWarning)
+            warnings.filterwarnings("ignore", category=numba.NumbaPerformanceWarning)
+
+            for sample_rate in sample_rates:
+                for length in seconds:
+                    case = {"sample_rate": sample_rate, "seconds": float(length)}
+                    time, acg_xyz = generate_acceleration(sample_rate, length, seed=seed)
+
+                    folder = os.path.join(
+                        temporary, "FALL_{}_{}".format(sample_rate, length)
+                    )
+                    write_measurement(folder, time, acg_xyz)
+                    __run("DataCarrier", lambda: _load_sensors(folder), **case)
+
+                    # older versions of SensorBox split the sensor into multiple files
+                    split_folder = folder + "_split"
+                    write_measurement(split_folder, time, acg_xyz, split=4)
+                    __run(
+                        "DataCarrier_split", lambda: _load_sensors(split_folder), **case
+                    )
+
+                    accuracy = np.full(time.shape[0], 3)
+                    # SensorData keeps the computed channels - new one for every call
+                    __run(
+                        "EventChecker.calculate_time_magnitude",
+                        lambda: calculate_time_magnitude(
+                            SensorData(time, acg_xyz, accuracy)
+                        ),
+                        **case
+                    )
+                    sensor_data = SensorData(time, acg_xyz, accuracy)
+                    calculate_time_magnitude(sensor_data)
+                    time_seconds = sensor_data.modified[Consts.TIME_SECONDS]
+                    magnitude = sensor_data.modified[Consts.MAGNITUDE]
+                    __run(
+                        "EventChecker.pick_array_of_interest",
+                        lambda: pick_array_of_interest(time_seconds, magnitude),
+                        **case
+                    )
+
+                    data_carrier = DataCarrier(folder)
+                    calculate_time_magnitude(data_carrier.sensor_data[Consts.ACG])
+                    data_carrier.event_holder = get_event_of_interest(
+                        time_seconds, magnitude
+                    )
+                    for name, function in _parameters_cases(
+                        time_seconds, magnitude, acg_xyz, data_carrier
+                    ).items():
+                        __run(name, function, **case)
+
+            # IQR rule on parameters of the synthetic events
+            rng = np.random.default_rng(seed)
+            for rows in (500, 3000):
+                case = {"rows": rows}
+                df = pd.DataFrame(
+                    rng.standard_t(3, (rows, len(Consts.parameters_names))),
+                    columns=Consts.parameters_names,
+                )
+                categories = rng.integers(0, len(Consts.activity_valid), rows)
+                __run("IQRCleaning.iqr_rule", lambda: iqr_rule(df), **case)
+                __run(
+                    "IQRCleaning.iqr_rule_outliers",
+                    lambda: iqr_rule_outliers(df, categories),
+                    **case
+                )
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+    return {
+        "created": datetime.datetime.now().isoformat(),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "numba": numba.__version__,
+            "pandas": pd.__version__,
+        },
+        "results": results,
+    }
+
+
+def _key(record: dict) -> tuple:
+    """
+    :param record: one result
+    :return: identification of the benchmark case
+    """
+    return tuple(
+        (key, value)
+        for key, value in sorted(record.items())
+        if key not in {"best_s", "mean_s", "worst_s", "number", "repeat"}
+    )
+
+
+def compare(baseline: dict, current: dict) -> pd.DataFrame:
+    """
+    Compares 2 runs of benchmarks by the best times
+    :param baseline: output of run_benchmarks - e.g. loaded from json
+    :param current: output of run_benchmarks
+    :return: table of cases in both runs with ratio current / baseline - higher than 1 is slower
+    """
+    baseline_results = {_key(r): r for r in baseline["results"]}
+    rows = []
+    for record in current["results"]:
+        key = _key(record)
+        if key not in baseline_results:
+            continue
+        row = dict(key)
+        row["baseline_s"] = baseline_results[key]["best_s"]
+        row["current_s"] = record["best_s"]
+        row["ratio"] = row["current_s"] / row["baseline_s"]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of BeSafeBox research")
+    parser.add_argument("--output", help="path to json file for results")
+    parser.add_argument("--compare", help="path to json file with baseline results")
+    parser.add_argument("--sample-rates", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--seconds", type=float, nargs="+", default=[12, 60])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--names", nargs="+", help="run only matching benchmarks")
+    arguments = parser.parse_args()
+
+    report = run_benchmarks(
+        arguments.sample_rates, arguments.seconds, arguments.repeat, arguments.names
+    )
+
+    with pd.option_context(
+        "display.max_rows", None, "display.max_columns", None, "display.width", 200
+    ):
+        print(pd.DataFrame(report["results"]))
+        if arguments.compare:
+            with open(arguments.compare, "r", encoding="utf-8") as baseline_file:
+                print(compare(json.load(baseline_file), report))
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
@@ -0,0 +1,258 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Iterable, Optional
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numba
+import pandas as pd
+from numba import types
+
+import BatchParameters
+import DataCarrier
+import EventChecker
+import OnlineDetector
+import Parameters
+import SensorCsv
+
+# all the kernels are compiled with cache=True - compiled code is stored next to the module in __pycache__
+# (or in NUMBA_CACHE_DIR) and the next process loads it instead of compiling
+_modules = [DataCarrier, Parameters, BatchParameters, EventChecker, OnlineDetector, SensorCsv]
+
+_array_1d = types.float64[::1]  # contiguous - magnitude, time in seconds, slices of them
+_array_2d = types.float64[:, ::1]  # contiguous - raw data from DataCarrier
+_array_2d_any = types.float64[:, :]  # slices of the raw data - e.g. before and after the event
+_indexes = types.int64[::1]
+
+# explicit signatures of the kernels called from Python - the same types as produced by DataCarrier and
+# calculate_time_magnitude. Kernels called only from other kernels are compiled within their callers.
+# Kernels stay lazy, so other types (e.g. integer thresholds, float32) are still compiled on demand.
+SIGNATURES = {
+    "_parse_rows": (
+        SensorCsv._parse_rows,
+        [
+            (types.uint8[::1], types.int64, types.boolean, _indexes, _array_1d, _indexes, _array_2d,
+             types.int8[::1], types.int64),
+        ],
+    ),
+    "_count_complete_rows": (
+        SensorCsv._count_complete_rows,
+        [(types.uint8[::1], types.int64, types.boolean, types.int64)],
+    ),
+    "_magnitude": (
+        DataCarrier._magnitude,
+        [(_array_2d, _array_1d), (_array_2d_any, _array_1d)],
+    ),
+    "pick_array_of_interest": (
+        EventChecker.pick_array_of_interest,
+        [
+            (_array_1d, _array_1d, types.int64, types.float64, types.float64),
+            (_array_1d, _array_1d, types.float64, types.float64, types.float64),
+        ],
+    ),
+    "scan_triggers": (
+        EventChecker.scan_triggers,
+        [(_array_1d, _array_1d) + (types.float64,) * 4],
+    ),
+    "_scan_chunk": (
+        EventChecker._scan_chunk,
+        [
+            (_array_1d, _array_1d, types.int64, types.int64, _array_1d)
+            + (types.float64,) * 4
+        ],
+    ),
+    "_gate_events": (
+        EventChecker._gate_events,
+        [(_array_1d, _array_1d, types.int64[:, ::1]) + (types.float64,) * 5],
+    ),
+    "_batch_boundaries": (
+        EventChecker._batch_boundaries,
+        [(_array_1d, _array_1d, _indexes, _indexes) + (types.float64,) * 3],
+    ),
+    "_scan_stream": (
+        OnlineDetector._scan_stream,
+        [(_array_1d, _array_1d, _array_1d) + (types.float64,) * 4],
+    ),
+    "ad": (Parameters.ad, [(_array_2d,), (_array_2d_any,)]),
+    "_window_indexes": (
+        Parameters._window_indexes,
+        [(_array_1d, types.int64, types.int64)],
+    ),
+    "_moments": (Parameters._moments, [(_array_1d,)]),
+    "_template_matches": (
+        Parameters._template_matches,
+        [(_array_1d, types.int64, types.int64, types.boolean)],
+    ),
+    "_batch_parameters": (
+        BatchParameters._batch_parameters,
+        [(_array_1d, _array_1d, _array_2d, _indexes, _indexes, _indexes, _indexes)],
+    ),
+}
+
+
+def warm_up(kernels: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Compiles the kernels for SIGNATURES ahead of the first call - loads them from the cache, if they were
+    compiled by any previous process, otherwise compiles them and stores them into the cache.
+    Run it once after installation / change of the code, or at the start of the worker before the first task.
+    :param kernels: names from SIGNATURES - None for all
+    :return: table with kernel, signature and time in seconds
+    """
+    rows = []
+    for name in SIGNATURES if kernels is None else kernels:
+        dispatcher, signatures = SIGNATURES[name]
+        for signature in signatures:
+            start = time.perf_counter()
+            dispatcher.compile(signature)
+            rows.append([name, str(signature), time.perf_counter() - start])
+    return pd.DataFrame(rows, columns=["kernel", "signature", "seconds"])
+
+
+def cache_files() -> list:
+    """
+    :return: paths to cached compiled kernels of the project
+    """
+    files = []
+    for module in _modules:
+        folder = numba.config.CACHE_DIR or os.path.join(
+            os.path.dirname(os.path.abspath(module.__file__)), "__pycache__"
+        )
+        # with NUMBA_CACHE_DIR, numba mirrors the full path of the module inside the folder
+        pattern = "{}.*.nb[ic]".format(module.__name__)
+        files += glob.glob(os.path.join(folder, "**", pattern), recursive=True)
+    return files
+
+
+def clear_cache():
+    """
+    Removes the compiled kernels from the cache. Numba checks only the modification of the file with the kernel,
+    so clear the cache after the change of kernel in other module - e.g. BatchParameters after change of Parameters.
+    """
+    for file in cache_files():
+        os.remove(file)
+
+
+# executed in a new process by measure_start - prints times of the phases as json
+_start_script = """
+import time
+start = time.perf_counter()
+import json
+from DataCarrier import SensorData
+from EventChecker import calculate_time_magnitude, get_event_of_interest
+from Parameters import calculate_acg_parameters
+from BatchParameters import calculate_acg_parameters_batch, pack_events
+from SyntheticData import generate_acceleration
+import Compilation
+imported = time.perf_counter()
+
+if {warm_up}:
+    Compilation.warm_up()
+warmed = time.perf_counter()
+
+def run():
+    t, xyz = generate_acceleration(100, 12)
+    data = SensorData(t, xyz, None)
+    calculate_time_magnitude(data)
+    time_seconds, magnitude = data.modified["TIME_SECONDS"], data.modified["MAGNITUDE"]
+    event = get_event_of_interest(time_seconds, magnitude)
+    calculate_acg_parameters(time_seconds, magnitude, xyz, event)
+    calculate_acg_parameters_batch(*pack_events([(time_seconds, magnitude, xyz, event)]))
+
+run()
+first = time.perf_counter()
+run()
+second = time.perf_counter()
+print(json.dumps({{
+    "import_s": imported - start,
+    "warm_up_s": warmed - imported,
+    "first_call_s": first - warmed,
+    "second_call_s": second - first,
+    "total_s": first - start,
+}}))
+"""
+
+
+def _run_process(cache_dir: str, warm_up_kernels: bool) -> dict:
+    """
+    :param cache_dir: NUMBA_CACHE_DIR of the process
+    :param warm_up_kernels: call warm_up before the first call
+    :return: times of the phases of the process
+    """
+    environment = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__))]
+        + [p for p in environment.get("PYTHONPATH", "").split(os.pathsep) if p]
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", _start_script.format(warm_up=warm_up_kernels)],
+        env=environment,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_start(repeat=3, warm_up_kernels=False) -> pd.DataFrame:
+    """
+    Measures the start of a new process with the feature extraction pipeline - cold start compiles all the kernels
+    with empty cache, warm start loads them from the cache filled by the cold start.
+    :param repeat: number of cold / warm pairs
+    :param warm_up_kernels: call warm_up in the process before the first call
+    :return: table with start type and times of import, warm up, first and second call, total time to first result
+    """
+    rows = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="besafebox_numba_") as cache_dir:
+            for start_type in ["cold", "warm"]:
+                rows.append(
+                    {"start": start_type, **_run_process(cache_dir, warm_up_kernels)}
+                )
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compilation of numba kernels")
+    parser.add_argument("--clear", action="store_true", help="remove cached kernels")
+    parser.add_argument(
+        "--measure", action="store_true", help="measure cold and warm start"
+    )
+    parser.add_argument(
+        "--warm-up", action="store_true", help="call warm_up before the first call"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+
+    if arguments.clear:
+        clear_cache()
+
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        if arguments.measure:
+            result = measure_start(arguments.repeat, arguments.warm_up)
+            print(result)
+            print(result.groupby("start").mean(numeric_only=True))
+        else:
+            print(warm_up())
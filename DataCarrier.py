@@ -16,62 +16,118 @@
  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from Consts import determine_activity_type, determine_sensor_type
+from Consts import Consts, determine_activity_type, determine_sensor_type
 from CustomPaths import test_folder
+from MeasurementCache import CACHE_FOLDER, METADATA, read_cache, write_cache
+from Precision import precision
+from Profiling import profiled
+from SegmentedArray import SegmentedArray, SegmentedSensor, read_segments
+from SensorArchive import TEMPORARY_EXTENSION, is_archive, read_archive
+from SensorCsv import read_sensor_files
+
+from collections.abc import MutableMapping
+from functools import partial
+from typing import Callable, Optional
 
 import os
+import sys
+
 import pandas as pd
 import numpy as np
+from numba import njit
+
+
+def sort_split_files(paths: list) -> list:
+    """
+    In the older version of the app, the measurements tended to be split into the multiple files for one sensor
+    named ACG_1.csv, ACG_2.csv, ...
+    :param paths: files of the same sensor
+    :return: files in chronological order
+    """
+    if len(paths) <= 1:
+        return list(paths)
+    return sorted(
+        paths,
+        key=lambda i: int(os.path.splitext(os.path.basename(i))[0].split("_")[1]),
+    )
 
 
 class DataCarrier:
-    def __init__(self, path: str, read_only=None):
+    @profiled(argument=1)
+    def __init__(self, path: str, read_only=None, use_cache=True, dtype=None):
         """
         The basic data object for SensorBox a folder with measurements.
         It the processes all the csv files and an extra.txt (not compatible with a new .json file in SensorBox) files.
+        Only the names of the files are scanned here - every sensor is parsed at the first access to sensor_data,
+        extra.txt / changes.txt at the first access to the metadata, GPS and confidence at the first access too.
+        If the folder was converted by save_cache / MeasurementCache.py and the files did not change since then,
+        sensors and metadata are memory mapped from the binary cache instead - arrays are read-only then.
         :param path: path to folder with the measurements
         :param read_only: list of names of files, which should be read only - None = read all
+        :param use_cache: open the binary cache, if it is valid
+        :param dtype: floating type of the sensor data and magnitude - np.float64 / np.float32, None for global
+        Precision, which is taken at the creation of the object
         """
+        self.path = path
+        self.read_only = read_only
+        self.dtype = precision.resolve(dtype)
         self.activity_type = determine_activity_type(
             path
         )  # determines measured activity in folder
 
-        self.annotations_description = {}  # from the extra, mapping for annotations
-        self.changes_description = {}  # mapping for the changes.txt file
-        self.changes = []  # actual changes
-        self.max_values = {}  # max values of the sensor from extra.text
-        self.annotations = []  # actual annotations from the extra.txt
-
-        self.sensor_data = {}  # dict for SensorData objects for every sensor
-        self.gps_data = None
+        # metadata - annotations_description, changes_description, changes, max_values, annotations, millis, nanos,
+        # environment, holding_position are parsed on demand by __process_metadata
 
-        self.millis = None
-        self.nanos = None
-        self.environment = None
-        self.holding_position = None
+        self.sensor_data = SensorMapping()  # SensorData objects for every sensor - parsed on demand
+        self.sensor_files = {}  # names of the files of every sensor
 
         self.event_holder = None  # place for extracted signal period of interest
 
+        # attribute name -> function, which sets it at the first access
+        self.__lazy_attributes = {}
+        metadata_files, gps_files, confidence_files = [], [], []
+
+        cached = read_cache(path, read_only) if use_cache else None
+        if cached is not None and any(
+            arrays["data"].dtype.itemsize < self.dtype.itemsize
+            for arrays in cached["sensors"].values()
+        ):
+            cached = None  # float32 cache can not serve float64 data
+        if cached is not None:
+            self.__process_cache(cached)
+
         # In the older version of the app, the measurements tented to be split into the multiple files for one sensor.
         # The files of the same type are aggregated into the same list
         file_aggregation = {}
 
         # iterating through all the files and using specific methods to process them in a correct manner
-        for file in [os.path.join(path, f) for f in os.listdir(path)]:
-
-            if "extra" in file:
-                self.__process_extra_txt(file)
-            elif "confidence" in file:
-                self.__process_confidence(file)
-            elif "changes" in file:
-                self.__process_changes(file)
+        for file in [
+            os.path.join(path, f)
+            for f in os.listdir(path)
+            # cache, its temporary folder and archives left by interrupted writing
+            if not f.startswith(CACHE_FOLDER) and not f.endswith(TEMPORARY_EXTENSION)
+        ]:
+
+            if "confidence" in file:
+                confidence_files.append(file)
             elif "GPS" in file:
-                self.__process_gps(file)
-            elif "csv" in file:
+                gps_files.append(file)
+            elif "extra" in file or "changes" in file:
+                if cached is None:
+                    metadata_files.append(file)
+            elif "csv" in file or is_archive(file):
                 sensor_type = determine_sensor_type(file)
                 if sensor_type is None:
                     continue
 
+                if sensor_type in self.sensor_files:
+                    self.sensor_files[sensor_type].append(os.path.basename(file))
+                else:
+                    self.sensor_files[sensor_type] = [os.path.basename(file)]
+
+                if cached is not None:
+                    continue  # sensors are in the cache, only their files are kept
+
                 # read only selected files
                 if read_only is not None:
                     jump_over = True
@@ -89,18 +145,153 @@ class DataCarrier:
             else:
                 print("Unknown file {}".format(file))
 
-        # sorts the files of the same sensor and pass them to load them into one dataframe
+        # sorts the files of the same sensor, they are loaded into one matrix at the first access
         for key in file_aggregation.keys():
-            paths = file_aggregation[key]
-            if len(paths) > 1:
-                paths = sorted(
-                    paths,
-                    key=lambda i: int(
-                        os.path.splitext(os.path.basename(i))[0].split("_")[1]
-                    ),
-                )
-            self.__process_sensor_data(paths)
+            paths = sort_split_files(file_aggregation[key])
+            self.sensor_data.add_loader(key, partial(self.__process_sensor_data, paths))
+
+        if cached is None:
+            self.__add_lazy(METADATA, partial(self.__process_metadata, metadata_files))
+        self.__add_lazy(["gps_data"], partial(self.__process_gps, gps_files))
+        if confidence_files:
+            self.__add_lazy(
+                ["confidence"], partial(self.__process_confidence, confidence_files[-1])
+            )
+
+    def __add_lazy(self, names: list, loader: Callable):
+        """
+        :param names: attributes set by the loader
+        :param loader: function without arguments called at the first access to any of the attributes
+        """
+        for name in names:
+            self.__lazy_attributes[name] = loader
+
+    def __getattr__(self, name: str):
+        """
+        Called only for attributes, which are not set yet - loads the lazy ones
+        :param name: name of the attribute
+        :return: value of the attribute
+        """
+        lazy_attributes = self.__dict__.get("_DataCarrier__lazy_attributes", {})
+        if name not in lazy_attributes:
+            raise AttributeError(
+                "'{}' object has no attribute '{}'".format(type(self).__name__, name)
+            )
+
+        loader = lazy_attributes[name]
+        for key in [key for key, value in lazy_attributes.items() if value is loader]:
+            del lazy_attributes[key]
+        loader()
+        return self.__dict__[name]
+
+    def __getstate__(self) -> dict:
+        """
+        Loaders of the lazy parts can not be pickled - everything is parsed before pickling
+        :return: state of the object
+        """
+        for name in list(self.__lazy_attributes):
+            if name in self.__lazy_attributes:
+                getattr(self, name)
+        len(self.sensor_data)
+        return self.__dict__.copy()
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+
+    def __process_metadata(self, files: list):
+        """
+        Sets all the metadata - defaults and parsed extra.txt and changes.txt
+        :param files: paths to extra.txt and changes.txt
+        """
+        self.annotations_description = {}  # from the extra, mapping for annotations
+        self.changes_description = {}  # mapping for the changes.txt file
+        self.changes = []  # actual changes
+        self.max_values = {}  # max values of the sensor from extra.text
+        self.annotations = []  # actual annotations from the extra.txt
+
+        self.millis = None
+        self.nanos = None
+        self.environment = None
+        self.holding_position = None
+
+        for file in files:
+            if "extra" in file:
+                self.__process_extra_txt(file)
+            else:
+                self.__process_changes(file)
 
+    def __process_cache(self, cached: dict):
+        """
+        Metadata and sensors from the binary cache of MeasurementCache
+        :param cached: output of MeasurementCache.read_cache
+        """
+        for name, value in cached["metadata"].items():
+            setattr(self, name, value)
+
+        for sensor_type, arrays in cached["sensors"].items():
+            input_data = arrays["data"]
+            derived = [Consts.MAGNITUDE, Consts.TIME_SECONDS]
+            if input_data.dtype != self.dtype:
+                # magnitude is computed again from the converted data
+                input_data = input_data.astype(self.dtype)
+                derived = [Consts.TIME_SECONDS]
+
+            sensor = SensorData(
+                time=arrays["time"], input_data=input_data, acc=arrays.get("acc")
+            )
+            for name in derived:
+                if name in arrays:
+                    sensor.modified[name] = arrays[name]
+            self.sensor_data[sensor_type] = sensor
+
+    def sensor_paths(self, sensor_type: str) -> list:
+        """
+        :param sensor_type: type of the sensor from Consts
+        :return: paths to csv files / archive of the sensor in chronological order - empty list for missing sensor
+        """
+        return sort_split_files(
+            [os.path.join(self.path, name) for name in self.sensor_files.get(sensor_type, [])]
+        )
+
+    def sensor_segments(self, sensor_type: str) -> Optional[SegmentedSensor]:
+        """
+        Sensor as one time series of its split files without joining them - for slicing of long recordings,
+        the loaded / cached sensor is returned as one segment without copy
+        :param sensor_type: type of the sensor from Consts
+        :return: SegmentedSensor, None for missing or empty sensor
+        """
+        if sensor_type in self.sensor_data.loaded:
+            sensor = self.sensor_data[sensor_type]
+            return SegmentedSensor(
+                SegmentedArray([sensor.time]),
+                SegmentedArray([sensor.data]),
+                SegmentedArray([sensor.acc]) if sensor.acc is not None else None,
+            )
+        return read_segments(self.sensor_paths(sensor_type), self.dtype)
+
+    def memory_usage(self) -> pd.DataFrame:
+        """
+        Memory of the sensors - only the loaded ones are counted, nothing is parsed
+        :return: table sensor type x arrays from SensorData.memory_usage in bytes
+        """
+        return pd.DataFrame(
+            {
+                sensor_type: self.sensor_data[sensor_type].memory_usage()
+                for sensor_type in self.sensor_data.loaded
+            }
+        ).T.fillna(0).astype(np.int64)
+
+    def save_cache(self, derived=True, with_hash=False):
+        """
+        Converts the folder into the binary cache, which is opened by the next DataCarrier of the folder
+        :param derived: store also magnitude and time in seconds of every sensor
+        :param with_hash: validate the cache by sha1 of the source files, not only by size and modification time
+        """
+        if self.read_only is not None:
+            raise ValueError("Cache can be created only from DataCarrier with all sensors")
+        write_cache(self, self.path, derived, with_hash)
+
+    @profiled(argument=1)
     def __process_extra_txt(self, file_path: str):
         """
         extra.txt has similar formatting as a .fasta format, where keys are stated by ">" and information is below
@@ -148,6 +339,7 @@ class DataCarrier:
 
                 row = extra.readline()
 
+    @profiled(argument=1)
     def __process_confidence(self, file_path: str):
         """
         Records of Android activity recognition API
@@ -158,6 +350,7 @@ class DataCarrier:
         """
         self.confidence = pd.read_csv(file_path, header=0, delimiter=";")
 
+    @profiled(argument=1)
     def __process_changes(self, file_path: str):
         """
         Uses also Android activity recognition API
@@ -186,53 +379,138 @@ class DataCarrier:
                     self.changes.append(((int(c[0])), int(c[1])))
                 row = changes.readline()
 
-    def __process_sensor_data(self, files: list):
+    @profiled(argument=1)
+    def __process_sensor_data(self, files: list) -> Optional["SensorData"]:
         """
         Specific sensor data are stored in the SensorData object
         accessible with t for time, data for numpy array with sensor data and a for accuracy of sample
-        t is in nanoseconds (Android system time)
-        a is accuracy from 0 to 3 - the lowest accuracy to highest
+        t is in nanoseconds (Android system time) - int64
+        a is accuracy from 0 to 3 - the lowest accuracy to highest - int8
+        All the files are parsed into one preallocated matrix by SensorCsv.read_sensor_files,
+        archives of SensorArchive are decoded by read_archive
         :param files: list of files for specific sensor - must be in chronological order (from the oldest to newest)
+        :return: SensorData, None for the empty file
         """
-
-        sensor_type: str = determine_sensor_type(files[0])
-        sensor_data: pd.DataFrame = pd.concat(
-            [pd.read_csv(file, delimiter=";") for file in files], ignore_index=True
-        )
-
-        time = sensor_data.t.values
-        try:
-            acc = (
-                sensor_data.a.values
-            )  # not every sensor has accuracy - e.g. step counter
-        except AttributeError:
-            acc = None
-
-        temp_data = []
-        for column in ["x", "y", "z", "0"]:
-            try:
-                temp_data.append(
-                    sensor_data[column].values
-                )  # rotation has 4 axis, pressure only one
-            except KeyError:
-                break
+        if is_archive(files[0]):
+            loaded = read_archive(files, dtype=self.dtype)
+        else:
+            loaded = read_sensor_files(files, self.dtype)
 
         # file can be empty, do not store it then
-        # sensor data are stacked to one matrix
-        if temp_data:
-            self.sensor_data[sensor_type] = SensorData(
-                time=time, input_data=np.vstack(temp_data), acc=acc
-            )
-
-    def __process_gps(self, files: str):
+        # sensor data are stored in one matrix axes x samples
+        if loaded is None:
+            return None
+        time, input_data, acc = loaded  # not every sensor has accuracy - e.g. step counter
+        return SensorData(time=time, input_data=input_data, acc=acc)
+
+    @profiled(argument=1)
+    def __process_gps(self, files: list):
         """
         GPS is stored in one file usually with all coordinates, speed, bearing and accuracy
         :param files: list of files with GPS in it
         """
-        self.gps_data = pd.concat([self.gps_data, pd.read_csv(files, delimiter=";")])
+        self.gps_data = None
+        if files:
+            # one concatenation of all the files in chronological order
+            self.gps_data = pd.concat(
+                [pd.read_csv(file, delimiter=";") for file in sort_split_files(files)]
+            )
+
+
+class SensorMapping(MutableMapping):
+    def __init__(self):
+        """
+        Dictionary of SensorData by sensor type, which parses the sensor at the first access.
+        Iteration parses all the sensors - use available to list them without parsing.
+        Sensors with empty files are left out after the parsing, same as in the eager DataCarrier.
+        """
+        self.__sensors = {}
+        self.__loaders = {}
+
+    def add_loader(self, sensor_type: str, loader: Callable):
+        """
+        :param sensor_type: key of the sensor
+        :param loader: function without arguments, which returns SensorData or None for empty sensor
+        """
+        self.__sensors.pop(sensor_type, None)
+        self.__loaders[sensor_type] = loader
+
+    def __load(self, sensor_type: str) -> bool:
+        """
+        :param sensor_type: key of the sensor
+        :return: if the sensor is available
+        """
+        if sensor_type in self.__sensors:
+            return True
+        loader = self.__loaders.pop(sensor_type, None)
+        if loader is None:
+            return False
+        sensor = loader()
+        if sensor is None:
+            return False
+        self.__sensors[sensor_type] = sensor
+        return True
+
+    @property
+    def available(self) -> list:
+        """
+        :return: types of the sensors in folder - parsed and not parsed yet
+        """
+        return list(self.__sensors) + list(self.__loaders)
+
+    @property
+    def loaded(self) -> list:
+        """
+        :return: types of the parsed sensors
+        """
+        return list(self.__sensors)
+
+    def __getitem__(self, sensor_type: str) -> "SensorData":
+        if not self.__load(sensor_type):
+            raise KeyError(sensor_type)
+        return self.__sensors[sensor_type]
+
+    def __setitem__(self, sensor_type: str, sensor: "SensorData"):
+        self.__loaders.pop(sensor_type, None)
+        self.__sensors[sensor_type] = sensor
+
+    def __delitem__(self, sensor_type: str):
+        if sensor_type not in self.__sensors and sensor_type not in self.__loaders:
+            raise KeyError(sensor_type)
+        self.__sensors.pop(sensor_type, None)
+        self.__loaders.pop(sensor_type, None)
+
+    def __contains__(self, sensor_type) -> bool:
+        return self.__load(sensor_type)
+
+    def __iter__(self):
+        for sensor_type in list(self.__loaders):
+            self.__load(sensor_type)
+        return iter(list(self.__sensors))
+
+    def __len__(self) -> int:
+        for sensor_type in list(self.__loaders):
+            self.__load(sensor_type)
+        return len(self.__sensors)
+
+
+@njit(cache=True)
+def _magnitude(data, out):
+    """
+    Euclidean norm of the columns into the buffer - same order of operations as np.linalg.norm(data, axis=0)
+    :param data: matrix axes x samples
+    :param out: 1D buffer for the magnitude
+    """
+    for j in range(data.shape[1]):
+        total = data[0, j] * data[0, j]
+        for i in range(1, data.shape[0]):
+            total += data[i, j] * data[i, j]
+        out[j] = np.sqrt(total)
 
 
 class SensorData:
+    __slots__ = ("time", "data", "acc", "modified", "_time_seconds", "_magnitude")
+
     def __init__(self, time: np.ndarray, input_data: np.ndarray, acc: np.ndarray):
         """
         Simple object to store data
@@ -243,10 +521,121 @@ class SensorData:
         self.time = time
         self.data = input_data
         self.acc = acc
+        self._time_seconds = None
+        self._magnitude = None
 
         # here can be stored modified versions of the data
-        # most used Consts.TIME_SECONDS - time converted to seconds, Consts.MAGNITUDE - magnitude of the signal
-        self.modified = {}
+        # most used Consts.TIME_SECONDS - time converted to seconds, Consts.MAGNITUDE - magnitude of the signal,
+        # both of them are computed at the first access and kept in the SensorData
+        self.modified = ModifiedData(self)
+
+    @property
+    def time_seconds(self) -> np.ndarray:
+        """
+        :return: time in seconds from the first sample - computed once from the nanoseconds
+        """
+        if self._time_seconds is None:
+            self._time_seconds = (self.time - self.time.item(0)) * (10 ** -9)
+        return self._time_seconds
+
+    @property
+    def magnitude(self) -> np.ndarray:
+        """
+        :return: magnitude of the samples - computed once
+        """
+        if self._magnitude is None:
+            self._magnitude = np.empty(self.data.shape[1], dtype=self.data.dtype)
+            _magnitude(self.data, self._magnitude)
+        return self._magnitude
+
+    def refresh(self):
+        """
+        Recomputes the derived channels after the change of time or data - magnitude reuses its buffer
+        """
+        self._time_seconds = None
+        if (
+            self._magnitude is not None
+            and self._magnitude.flags.writeable
+            and self._magnitude.shape[0] == self.data.shape[1]
+            and self._magnitude.dtype == self.data.dtype
+        ):
+            _magnitude(self.data, self._magnitude)
+        else:
+            self._magnitude = None
+
+    def memory_usage(self) -> dict:
+        """
+        Memory-mapped arrays from the binary cache are counted too, but they are held by the page cache
+        :return: bytes of every array - time, data, acc, derived channels, other modified entries, object and total
+        """
+        usage = {
+            "time": self.time.nbytes,
+            "data": self.data.nbytes,
+            "acc": self.acc.nbytes if self.acc is not None else 0,
+            Consts.TIME_SECONDS: self._time_seconds.nbytes if self._time_seconds is not None else 0,
+            Consts.MAGNITUDE: self._magnitude.nbytes if self._magnitude is not None else 0,
+        }
+        for name, value in self.modified.extra.items():
+            usage[name] = getattr(value, "nbytes", sys.getsizeof(value))
+        usage["object"] = sys.getsizeof(self) + sys.getsizeof(self.modified.extra)
+        usage["total"] = sum(usage.values())
+        return usage
+
+
+class ModifiedData(MutableMapping):
+    __slots__ = ("sensor", "extra")
+
+    def __init__(self, sensor: SensorData):
+        """
+        SensorData.modified - Consts.TIME_SECONDS and Consts.MAGNITUDE are the cached channels of the SensorData,
+        other modified versions of the data are stored as they are
+        :param sensor: owner of the channels
+        """
+        self.sensor = sensor
+        self.extra = {}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name == Consts.TIME_SECONDS:
+            return self.sensor.time_seconds
+        if name == Consts.MAGNITUDE:
+            return self.sensor.magnitude
+        return self.extra[name]
+
+    def __setitem__(self, name: str, value: np.ndarray):
+        # e.g. channels loaded from the binary cache
+        if name == Consts.TIME_SECONDS:
+            self.sensor._time_seconds = value
+        elif name == Consts.MAGNITUDE:
+            self.sensor._magnitude = value
+        else:
+            self.extra[name] = value
+
+    def __delitem__(self, name: str):
+        if name == Consts.TIME_SECONDS:
+            self.sensor._time_seconds = None
+        elif name == Consts.MAGNITUDE:
+            self.sensor._magnitude = None
+        else:
+            del self.extra[name]
+
+    def __contains__(self, name) -> bool:
+        """
+        :return: True for channels, which are computed or stored
+        """
+        if name == Consts.TIME_SECONDS:
+            return self.sensor._time_seconds is not None
+        if name == Consts.MAGNITUDE:
+            return self.sensor._magnitude is not None
+        return name in self.extra
+
+    def __iter__(self):
+        for name in [Consts.TIME_SECONDS, Consts.MAGNITUDE]:
+            if name in self:
+                yield name
+        yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts, string_activity_to_number
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, Optional, Tuple
+
+import multiprocessing
+import os
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from Compilation import SIGNATURES, warm_up
+from DataCarrier import DataCarrier
+from EventChecker import check_data_integrity_fall_detection
+from Parameters import calculate_acg_parameters_data_carrier
+from Precision import precision
+
+# status of the folder
+STATUS_OK = "ok"
+STATUS_INVALID = "invalid"  # measurement does not pass the checks - detail says which one
+STATUS_ERROR = "error"  # exception - detail holds the traceback
+
+# details of invalid measurements
+INVALID_INTEGRITY = "integrity"  # check_data_integrity_fall_detection failed
+INVALID_PARAMETERS = "parameters"  # calculate_acg_parameters_data_carrier returned None
+INVALID_ACTIVITY = "activity"  # activity is not in Consts.activity_valid
+
+STATUS_COLUMNS = ["path", "activity", "status", "detail", "row"]
+
+
+def extract_folder(
+    path: str, dtype=None
+) -> Tuple[str, Optional[str], str, Optional[str], Optional[np.ndarray], Optional[int]]:
+    """
+    Same chain as in Research.ipynb for one measurement - DataCarrier, check_data_integrity_fall_detection,
+    calculate_acg_parameters_data_carrier and string_activity_to_number. Exceptions are caught and returned.
+    :param path: path to folder with the measurements
+    :param dtype: floating type of the sensor data - see DataCarrier
+    :return: path, activity, status, detail, parameters and label - parameters and label only for STATUS_OK
+    """
+    activity = None
+    try:
+        data_carrier = DataCarrier(path, dtype=dtype)
+        activity = data_carrier.activity_type
+
+        if not check_data_integrity_fall_detection(data_carrier, pick_event=True):
+            return path, activity, STATUS_INVALID, INVALID_INTEGRITY, None, None
+
+        parameters = calculate_acg_parameters_data_carrier(data_carrier)
+        if parameters is None:
+            return path, activity, STATUS_INVALID, INVALID_PARAMETERS, None, None
+
+        label = string_activity_to_number(activity)
+        if label is None:
+            return path, activity, STATUS_INVALID, INVALID_ACTIVITY, None, None
+
+        return path, activity, STATUS_OK, None, parameters, label
+    except Exception:
+        return path, activity, STATUS_ERROR, traceback.format_exc(), None, None
+
+
+def extract_dataset(
+    paths: Iterable[str], processes: Optional[int] = None, chunksize=4, dtype=None
+) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """
+    Extracts parameters of all the measurements in parallel - results are in order of the paths,
+    regardless of the order in which the processes finish them.
+    Kernels are compiled into the numba cache once before the pool starts, so the workers only load them.
+    Workers are spawned, not forked - fork of a process with running numba threads can deadlock.
+    :param paths: paths to folders with the measurements, e.g. get_paths_control_environment()
+    :param processes: number of worker processes - None for all cores, 1 runs in this process without pool
+    :param chunksize: number of folders sent to the worker at once - higher lowers the overhead of the pool,
+    lower balances the load better
+    :param dtype: floating type of the sensor data - None for Precision of this process, spawned workers
+    do not share it
+    :return: matrix of parameters (valid measurements x Consts.parameters_names), labels of the rows and status of
+    every folder with columns STATUS_COLUMNS - row is the index into the matrix, -1 for invalid / error
+    """
+    paths = list(paths)
+    extract = partial(extract_folder, dtype=precision.resolve(dtype))
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes == 1 or len(paths) <= 1:
+        results = map(extract, paths)
+        return _collect(results)
+
+    # only kernels of the sequential pipeline - parallel ones (_batch_parameters, _batch_boundaries)
+    # would start the numba threads in this process
+    warm_up(
+        name
+        for name, (dispatcher, _) in SIGNATURES.items()
+        if not dispatcher.targetoptions.get("parallel")
+    )
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return _collect(executor.map(extract, paths, chunksize=chunksize))
+
+
+def _collect(results: Iterable[tuple]) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """
+    :param results: outputs of extract_folder in order of the paths
+    :return: matrix of parameters, labels, status table
+    """
+    parameters, labels, status = [], [], []
+    for path, activity, state, detail, row_parameters, label in results:
+        row = -1
+        if state == STATUS_OK:
+            row = len(parameters)
+            parameters.append(row_parameters)
+            labels.append(label)
+        status.append([path, activity, state, detail, row])
+
+    matrix = (
+        np.vstack(parameters)
+        if parameters
+        else np.empty((0, len(Consts.parameters_names)))
+    )
+    return (
+        matrix,
+        np.array(labels, dtype=np.int64),
+        pd.DataFrame(status, columns=STATUS_COLUMNS),
+    )
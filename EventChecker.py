@@ -17,31 +17,39 @@
 """
 
 import numpy as np
-from numba import njit
+from numba import njit, prange
 
 from Consts import Consts
 from DataCarrier import DataCarrier, SensorData
 from EventOfInterest import EventOfInterest
+from Profiling import profiled, measure
 
+from typing import Tuple
 
-@njit()
-def pick_array_of_interest(
+# columns of the output of find_events - indexes into the whole recording, window is [window_begin, window_end)
+# free_fall_end is -1, if the event has no free fall
+BOUNDARY_COLUMNS = ["window_begin", "window_end", "begin", "end", "max", "free_fall_end"]
+
+
+@njit(cache=True)
+def _event_boundaries(
     time_seconds, magnitude_vector, threshold_ending=15, begin_max=0.3, end_max=0.7
 ):
     """
+    Indexes of pick_array_of_interest without slices and None - callable from parallel kernels
     :param time_seconds: 1D vector
     :param magnitude_vector: 1D vector
     :param threshold_ending: at end, minimal value of ending
     :param begin_max: max time to middle
     :param end_max: max end time of event
-    :return: time interval of interesting event (seconds) with magnitude,
-    indexes begin, end, max_peak_index, free_fall_end
+    :return: indexes begin, end, max_peak_index, free_fall_end - free_fall_end is -1 without free fall,
+    all are -1 if the event can not be picked
     """
     max_peak_index = np.int64(np.argmax(magnitude_vector))
     max_peak_time = time_seconds[max_peak_index]
     begin = 0
     end = time_seconds.shape[0]
-    free_fall_end = None
+    free_fall_end = -1
 
     for i in range(max_peak_index, 0, -1):
 
@@ -107,19 +115,111 @@ def pick_array_of_interest(
 
     # checking for wrong implementation
     if begin > end:
-        return None
+        return -1, -1, -1, -1
 
     if begin < 0:
         begin = 0
 
+    return begin, end, max_peak_index, free_fall_end
+
+
+@njit(cache=True)
+def pick_array_of_interest(
+    time_seconds, magnitude_vector, threshold_ending=15, begin_max=0.3, end_max=0.7
+):
+    """
+    :param time_seconds: 1D vector
+    :param magnitude_vector: 1D vector
+    :param threshold_ending: at end, minimal value of ending
+    :param begin_max: max time to middle
+    :param end_max: max end time of event
+    :return: time interval of interesting event (seconds) with magnitude,
+    indexes begin, end, max_peak_index, free_fall_end
+    """
+    begin, end, max_peak_index, free_fall_end = _event_boundaries(
+        time_seconds, magnitude_vector, threshold_ending, begin_max, end_max
+    )
+    if begin < 0:
+        return None
+
     return (
         time_seconds[begin:end],
         magnitude_vector[begin:end],
         begin,
         end,
         max_peak_index,
-        free_fall_end,
+        free_fall_end if free_fall_end >= 0 else None,
+    )
+
+
+@njit(cache=True, parallel=True)
+def _batch_boundaries(
+    time_seconds, magnitude_vector, starts, stops, threshold_ending, begin_max, end_max
+):
+    """
+    _event_boundaries of many parts of one buffer in parallel - parts can overlap
+    :param time_seconds: 1D vector
+    :param magnitude_vector: 1D vector
+    :param starts: indexes of the first samples of the parts
+    :param stops: indexes after the last samples of the parts
+    :param threshold_ending: at end, minimal value of ending
+    :param begin_max: max time to middle
+    :param end_max: max end time of event
+    :return: matrix parts x (begin, end, max_peak_index, free_fall_end) relative to the parts, -1 as in
+    _event_boundaries, all -1 for empty parts
+    """
+    result = np.full((starts.shape[0], 4), -1, dtype=np.int64)
+    for part in prange(starts.shape[0]):
+        start = starts[part]
+        stop = stops[part]
+        if stop <= start:
+            continue
+        begin, end, max_peak_index, free_fall_end = _event_boundaries(
+            time_seconds[start:stop],
+            magnitude_vector[start:stop],
+            threshold_ending,
+            begin_max,
+            end_max,
+        )
+        result[part, 0] = begin
+        result[part, 1] = end
+        result[part, 2] = max_peak_index
+        result[part, 3] = free_fall_end
+    return result
+
+
+@profiled()
+def pick_arrays_of_interest(
+    time_seconds,
+    magnitude_vector,
+    offsets,
+    threshold_ending=15,
+    begin_max=0.3,
+    end_max=0.7,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    pick_array_of_interest of many recordings at once on all cores - recordings are concatenated into one buffer,
+    where recording r occupies samples offsets[r]:offsets[r + 1], e.g. BatchParameters.pack_recordings
+    :param time_seconds: concatenated time in seconds
+    :param magnitude_vector: concatenated magnitude
+    :param offsets: beginnings of the recordings in buffer with total length at the end - n_recordings + 1
+    :param threshold_ending: at end, minimal value of ending
+    :param begin_max: max time to middle
+    :param end_max: max end time of event
+    :return: int64 arrays of begin, end, max_peak_index and free_fall_end relative to the recordings,
+    free_fall_end is -1 without free fall, all are -1 if the event can not be picked (None of pick_array_of_interest)
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    boundaries = _batch_boundaries(
+        np.ascontiguousarray(time_seconds, dtype=np.float64),
+        np.ascontiguousarray(magnitude_vector),
+        offsets[:-1],
+        offsets[1:],
+        float(threshold_ending),
+        float(begin_max),
+        float(end_max),
     )
+    return tuple(np.ascontiguousarray(column) for column in boundaries.T)
 
 
 def get_event_of_interest(
@@ -134,25 +234,27 @@ def get_event_of_interest(
     :param end_max: max end time of event
     :return: EventOfInterest object
     """
-    (
-        time_seconds,
-        magnitude_vector,
-        begin,
-        end,
-        max_peak_index,
-        free_fall_end,
-    ) = pick_array_of_interest(
-        time_seconds=time_seconds,
-        magnitude_vector=magnitude_vector,
-        threshold_ending=threshold_ending,
-        begin_max=begin_max,
-        end_max=end_max,
-    )
+    with measure("pick_array_of_interest", magnitude_vector):
+        (
+            time_seconds,
+            magnitude_vector,
+            begin,
+            end,
+            max_peak_index,
+            free_fall_end,
+        ) = pick_array_of_interest(
+            time_seconds=time_seconds,
+            magnitude_vector=magnitude_vector,
+            threshold_ending=threshold_ending,
+            begin_max=begin_max,
+            end_max=end_max,
+        )
     return EventOfInterest(
         time_seconds, magnitude_vector, begin, end, max_peak_index, free_fall_end
     )
 
 
+@profiled()
 def check_data_integrity_fall_detection(
     data_to_validate: DataCarrier,
     time_threshold=0.2,
@@ -190,6 +292,324 @@ def check_data_integrity_fall_detection(
     return True
 
 
+@njit(cache=True)
+def _scan_chunk(
+    time_seconds, magnitude_vector, begin, end, state, threshold, refractory, delay, window
+):
+    """
+    scan_triggers over the samples begin:end, which continues the scan of the previous samples - for the chunks
+    of StreamReader. The window is searched in all the samples before the firing sample, including the history
+    of the chunk before begin.
+    :param time_seconds: 1D vector - monotonic
+    :param magnitude_vector: 1D vector
+    :param begin: index of the first scanned sample
+    :param end: index after the last scanned sample
+    :param state: detection flag and time of the last indication - updated for the next call
+    :param threshold: magnitude, which starts the indication
+    :param refractory: seconds after the indication, when the fall proceeds
+    :param delay: seconds after the last indication, when the window is cut
+    :param window: length of the window in seconds
+    :return: indexes of the beginnings of the windows and indexes of the firing samples (ends of the windows)
+    """
+    n = max(end - begin, 0)
+    window_begins = np.empty(n // 2 + 1, dtype=np.int64)
+    window_ends = np.empty(n // 2 + 1, dtype=np.int64)
+    found = 0
+
+    detection = state[0] != 0.0
+    last_detection = state[1]
+    for index in range(begin, end):
+        t = time_seconds[index]
+        value = magnitude_vector[index]
+        if not detection:
+            if value > threshold:
+                detection = True
+                last_detection = t
+            continue
+
+        elapsed = abs(t - last_detection)
+        if elapsed <= refractory:
+            continue
+        if value > threshold:
+            last_detection = t
+            continue
+        if elapsed >= delay:
+            window_begin = 0
+            for i in range(index, 0, -1):
+                if abs(t - time_seconds[i]) > window:
+                    window_begin = i
+                    break
+            window_begins[found] = window_begin
+            window_ends[found] = index
+            found += 1
+            detection = False
+
+    state[0] = 1.0 if detection else 0.0
+    state[1] = last_detection
+    return window_begins[:found].copy(), window_ends[:found].copy()
+
+
+@njit(cache=True)
+def scan_triggers(
+    time_seconds, magnitude_vector, threshold=30.0, refractory=0.75, delay=5.0, window=10.0
+):
+    """
+    Finds all the indications of the fall in one pass - same rules as the loop over real life measurements in
+    Research.ipynb. The sample above the threshold starts the indication, samples within the refractory period
+    after it are skipped, next sample above the threshold after the refractory period restarts the indication.
+    The indication fires at the first sample, which is delay seconds after the last restart, and the window
+    of window seconds before the firing sample is cut for the event.
+    :param time_seconds: 1D vector - monotonic
+    :param magnitude_vector: 1D vector
+    :param threshold: magnitude, which starts the indication
+    :param refractory: seconds after the indication, when the fall proceeds
+    :param delay: seconds after the last indication, when the window is cut
+    :param window: length of the window in seconds
+    :return: indexes of the beginnings of the windows and indexes of the firing samples (ends of the windows)
+    """
+    return _scan_chunk(
+        time_seconds,
+        magnitude_vector,
+        0,
+        time_seconds.shape[0],
+        np.zeros(2),
+        threshold,
+        refractory,
+        delay,
+        window,
+    )
+
+
+def pick_windows(
+    time_seconds,
+    magnitude_vector,
+    window_begins: np.ndarray,
+    window_ends: np.ndarray,
+    threshold_ending=15,
+    begin_max=0.3,
+    end_max=0.7,
+) -> np.ndarray:
+    """
+    Events of the windows of scan_triggers, windows are processed in parallel
+    :param time_seconds: 1D vector
+    :param magnitude_vector: 1D vector
+    :param window_begins: indexes of the beginnings of the windows
+    :param window_ends: indexes of the firing samples
+    :param threshold_ending: at end, minimal value of ending
+    :param begin_max: max time to middle
+    :param end_max: max end time of event
+    :return: int64 matrix events x BOUNDARY_COLUMNS, windows without event are left out
+    """
+    with measure("pick_array_of_interest", magnitude_vector):
+        picked = _batch_boundaries(
+            np.ascontiguousarray(time_seconds, dtype=np.float64),
+            np.ascontiguousarray(magnitude_vector),
+            window_begins,
+            window_ends,
+            float(threshold_ending),
+            float(begin_max),
+            float(end_max),
+        )
+
+    valid = picked[:, 0] >= 0
+    picked = picked[valid]
+    window_begins = window_begins[valid]
+    boundaries = np.empty((picked.shape[0], len(BOUNDARY_COLUMNS)), dtype=np.int64)
+    boundaries[:, 0] = window_begins
+    boundaries[:, 1] = window_ends[valid]
+    boundaries[:, 2:] = picked + window_begins[:, None]
+    boundaries[:, -1] = np.where(picked[:, -1] >= 0, boundaries[:, -1], -1)
+    return boundaries
+
+
+@profiled()
+def find_events(
+    time_seconds,
+    magnitude_vector,
+    threshold=30.0,
+    refractory=0.75,
+    delay=5.0,
+    window=10.0,
+    threshold_ending=15,
+    begin_max=0.3,
+    end_max=0.7,
+) -> np.ndarray:
+    """
+    All the events of long recording - scan_triggers finds the windows, pick_array_of_interest picks the event
+    in every window, windows are processed in parallel
+    :param time_seconds: 1D vector
+    :param magnitude_vector: 1D vector
+    :param threshold: magnitude, which starts the indication
+    :param refractory: seconds after the indication, when the fall proceeds
+    :param delay: seconds after the last indication, when the window is cut
+    :param window: length of the window in seconds
+    :param threshold_ending: at end, minimal value of ending
+    :param begin_max: max time to middle
+    :param end_max: max end time of event
+    :return: int64 matrix events x BOUNDARY_COLUMNS
+    """
+    with measure("scan_triggers", magnitude_vector):
+        window_begins, window_ends = scan_triggers(
+            time_seconds, magnitude_vector, threshold, refractory, delay, window
+        )
+
+    return pick_windows(
+        time_seconds,
+        magnitude_vector,
+        window_begins,
+        window_ends,
+        threshold_ending,
+        begin_max,
+        end_max,
+    )
+
+
+def window_event(
+    time_seconds, magnitude_vector, boundaries: np.ndarray
+) -> Tuple[slice, EventOfInterest]:
+    """
+    EventOfInterest of one row of find_events - same as get_event_of_interest of the window
+    :param time_seconds: 1D vector of the whole recording
+    :param magnitude_vector: 1D vector of the whole recording
+    :param boundaries: row of the output of find_events
+    :return: window in the recording and EventOfInterest with indexes relative to the window
+    """
+    window_begin, window_end, begin, end, max_peak_index, free_fall_end = (
+        int(value) for value in boundaries
+    )
+    part = slice(window_begin, window_end)
+    return part, EventOfInterest(
+        time_seconds[part][begin - window_begin : end - window_begin],
+        magnitude_vector[part][begin - window_begin : end - window_begin],
+        begin - window_begin,
+        end - window_begin,
+        max_peak_index - window_begin,
+        free_fall_end - window_begin if free_fall_end >= 0 else None,
+    )
+
+
+# gates of gate_events in order of evaluation - the cheapest first, the first failed gate rejects the event
+GATES = ["free_fall", "activity_before", "activity", "gap"]
+
+
+@njit(cache=True)
+def _gate_events(
+    time_seconds,
+    magnitude_vector,
+    boundaries,
+    free_fall_threshold,
+    free_fall_duration,
+    activity_before_threshold,
+    activity_threshold,
+    time_threshold,
+):
+    """
+    :param time_seconds: 1D vector of the whole recording
+    :param magnitude_vector: 1D vector of the whole recording
+    :param boundaries: output of find_events
+    :param free_fall_threshold: magnitude of the free fall of the phone
+    :param free_fall_duration: minimal duration of the free fall of the phone in seconds
+    :param activity_before_threshold: maximal mean magnitude in the window before the event
+    :param activity_threshold: maximal mean magnitude after the event
+    :param time_threshold: maximal delay between 2 samples
+    :return: index of the failed gate in GATES for every event, -1 for passed events
+    """
+    rejected = np.full(boundaries.shape[0], -1, dtype=np.int64)
+    for event in range(boundaries.shape[0]):
+        window_begin, window_end, begin, end, max_peak_index, _ = boundaries[event]
+
+        # free fall of the phone - runs of samples below the threshold from the beginning to the peak,
+        # samples of one run are at most 3 samples apart (is_fall_of_phone in Research.ipynb)
+        below = 0
+        previous = -1
+        duration = 0.0
+        longest = 0.0
+        for i in range(begin, max_peak_index):
+            if not magnitude_vector[i] < free_fall_threshold:
+                continue
+            below += 1
+            if previous >= 0 and i - previous <= 3:
+                duration += time_seconds[i] - time_seconds[previous]
+            else:
+                duration = 0.0
+            previous = i
+            longest = max(longest, duration)
+        if below > 2 and longest > free_fall_duration:
+            rejected[event] = 0
+            continue
+
+        # sustained activity of the person before the trigger - running, jumping, exercise
+        if begin > window_begin:
+            total = 0.0
+            for i in range(window_begin, begin):
+                total += magnitude_vector[i]
+            if not total / (begin - window_begin) < activity_before_threshold:
+                rejected[event] = 1
+                continue
+
+        # activity of the person after the event - events without samples after the end are rejected too
+        if end >= window_end:
+            rejected[event] = 2
+            continue
+        total = 0.0
+        for i in range(end, window_end):
+            total += magnitude_vector[i]
+        if not total / (window_end - end) < activity_threshold:
+            rejected[event] = 2
+            continue
+
+        # sampling gaps in the window
+        for i in range(window_begin + 1, window_end):
+            if time_seconds[i] - time_seconds[i - 1] > time_threshold:
+                rejected[event] = 3
+                break
+    return rejected
+
+
+@profiled()
+def gate_events(
+    time_seconds,
+    magnitude_vector,
+    boundaries: np.ndarray,
+    free_fall_threshold=0.5,
+    free_fall_duration=0.05,
+    activity_before_threshold=12.0,
+    activity_threshold=11.0,
+    time_threshold=0.2,
+) -> Tuple[np.ndarray, dict]:
+    """
+    Cheap filters of the events from find_events before the parameters are calculated - free fall of the phone
+    itself (near 0g longer than 50 ms), sustained high activity before the trigger (mean magnitude of the window
+    before the event - walking is around 10 m/s^2, running and jumping above 12), high activity of the person after
+    the event (mean magnitude of the rest of the window, as in Research.ipynb) and gaps in sampling (same threshold
+    as check_data_integrity_fall_detection)
+    :param time_seconds: 1D vector of the whole recording
+    :param magnitude_vector: 1D vector of the whole recording
+    :param boundaries: output of find_events
+    :param free_fall_threshold: magnitude of the free fall of the phone
+    :param free_fall_duration: minimal duration of the free fall of the phone in seconds
+    :param activity_before_threshold: maximal mean magnitude in the window before the event
+    :param activity_threshold: maximal mean magnitude after the event
+    :param time_threshold: maximal delay between 2 samples
+    :return: mask of the passed events, number of all events, events rejected by every gate in GATES and passed events
+    """
+    rejected = _gate_events(
+        time_seconds,
+        magnitude_vector,
+        np.ascontiguousarray(boundaries, dtype=np.int64).reshape(-1, len(BOUNDARY_COLUMNS)),
+        free_fall_threshold,
+        free_fall_duration,
+        activity_before_threshold,
+        activity_threshold,
+        time_threshold,
+    )
+    counters = {"total": int(rejected.shape[0])}
+    for index, gate in enumerate(GATES):
+        counters[gate] = int(np.count_nonzero(rejected == index))
+    counters["passed"] = int(np.count_nonzero(rejected < 0))
+    return rejected < 0, counters
+
+
 def normalize_time(t, conversion_rate=-9) -> np.ndarray:
     """
     converts nanoseconds to seconds
@@ -202,10 +622,12 @@ def normalize_time(t, conversion_rate=-9) -> np.ndarray:
     return (t - t.item(0)) * (10 ** conversion_rate)
 
 
+@profiled()
 def calculate_time_magnitude(data: SensorData):
     """
     Adds magnitude and time converted to seconds for SensorData object
+    Both are computed only once and kept by the SensorData - channels loaded from the binary cache are kept too
     :param data: SensorData object
     """
-    data.modified[Consts.MAGNITUDE] = np.linalg.norm(data.data, axis=0)
-    data.modified[Consts.TIME_SECONDS] = normalize_time(data.time)
+    data.magnitude
+    data.time_seconds
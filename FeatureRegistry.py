@@ -0,0 +1,241 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+import warnings
+
+from DataCarrier import DataCarrier
+from EventOfInterest import EventOfInterest
+from Parameters import (
+    ApEn,
+    ad,
+    before_and_after_fall,
+    change_in_angle,
+    free_fall_index,
+    g_cross_rate,
+    ratio_3g,
+    _crest_from_moments,
+    _hjorth_from_moments,
+    _moments,
+    _MEAN,
+    _M2,
+    _M3,
+    _M4,
+    _D1_ABS_MEAN,
+    _OUTPUT,
+    _TKEO,
+    _MAX,
+    _MIN,
+)
+
+# inputs of the calculation - same as arguments of Parameters.calculate_acg_parameters
+TIME_SECONDS = "time_seconds"
+MAGNITUDE = "magnitude"
+ACG_XYZ = "acg_xyz"
+EVENT_HOLDER = "event_holder"
+
+# intermediates shared by multiple parameters
+EVENT_MAGNITUDE = "event_magnitude"
+FROM_FREE_FALL = "from_free_fall"
+MOMENTS = "moments"
+MOMENTS_FREE_FALL = "moments_free_fall"
+HJORTH = "hjorth"
+BEFORE_AND_AFTER = "before_and_after"
+CHANGE_IN_ANGLE_COS = "change_in_angle_cos_value"
+
+
+def _angle_cos_from_windows(windows: Tuple[np.ndarray, np.ndarray]) -> Optional[float]:
+    """
+    Same as Parameters.change_in_angle_cos, but from already picked windows before and after the event
+    :param windows: acceleration 1s before and after the event
+    :return: float in degrees, None if one of the windows is empty
+    """
+    values_xyz_before, values_xyz_after = windows
+    if len(values_xyz_before[0]) == 0 or len(values_xyz_after[0]) == 0:
+        return None
+
+    aa: np.ndarray = np.average(values_xyz_before, axis=1)
+    ab: np.ndarray = np.average(values_xyz_after, axis=1)
+    return np.degrees(
+        np.arccos((aa.dot(ab)) / (np.linalg.norm(aa) * np.linalg.norm(ab)))
+    )
+
+
+def _angle_deviation(acg_xyz: np.ndarray) -> float:
+    """
+    Parameters.ad with the warnings ignored the same way as in calculate_acg_parameters
+    :param acg_xyz: acceleration data 3D
+    :return: angle deviation - float
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=RuntimeWarning)
+        return ad(acg_xyz)
+
+
+# name of intermediate -> (function, names of values passed to the function)
+intermediate_registry = {
+    EVENT_MAGNITUDE: (lambda e: e.event_magnitude, (EVENT_HOLDER,)),
+    FROM_FREE_FALL: (lambda e: e.get_from_free_fall, (EVENT_HOLDER,)),
+    MOMENTS: (_moments, (EVENT_MAGNITUDE,)),
+    MOMENTS_FREE_FALL: (_moments, (FROM_FREE_FALL,)),
+    HJORTH: (_hjorth_from_moments, (MOMENTS,)),
+    BEFORE_AND_AFTER: (
+        lambda t, xyz, e: before_and_after_fall(t, xyz, e.begin_index, e.end_index),
+        (TIME_SECONDS, ACG_XYZ, EVENT_HOLDER),
+    ),
+    CHANGE_IN_ANGLE_COS: (_angle_cos_from_windows, (BEFORE_AND_AFTER,)),
+}
+
+# name of parameter from Consts.parameters_names -> (function, names of values passed to the function)
+feature_registry = {
+    "average": (lambda m: m[_MEAN], (MOMENTS,)),
+    "deviation": (lambda m: np.sqrt(m[_M2]), (MOMENTS,)),
+    "variance": (lambda h: h[0], (HJORTH,)),
+    "mobility": (lambda h: h[1], (HJORTH,)),
+    "complexity": (lambda h: h[2], (HJORTH,)),
+    "average_tkeo": (lambda m: m[_TKEO], (MOMENTS,)),
+    "output": (lambda m: m[_OUTPUT], (MOMENTS,)),
+    "entropy": (
+        lambda event: ApEn(event, 10, 3, sort_templates=True),
+        (EVENT_MAGNITUDE,),
+    ),
+    "waveform_length": (lambda m: m[_D1_ABS_MEAN], (MOMENTS,)),
+    "crest_factor": (_crest_from_moments, (MOMENTS,)),
+    "change_in_angle": (change_in_angle, (ACG_XYZ,)),
+    "change_in_angle_cos": (lambda angle: angle, (CHANGE_IN_ANGLE_COS,)),
+    "angle_deviation": (_angle_deviation, (ACG_XYZ,)),
+    "free fall index": (free_fall_index, (MAGNITUDE, EVENT_HOLDER)),
+    "min_max": (lambda m: m[_MAX] - m[_MIN], (MOMENTS,)),
+    "ratio_3g": (ratio_3g, (FROM_FREE_FALL,)),
+    "kurtosis": (lambda m: m[_M4] / np.power(m[_M2], 2), (MOMENTS_FREE_FALL,)),
+    "skewness": (lambda m: m[_M3] / np.power(m[_M2], 1.5), (MOMENTS_FREE_FALL,)),
+    "1g_crosses": (lambda f: g_cross_rate(f, threshold=9.25), (FROM_FREE_FALL,)),
+}
+
+
+def register_feature(name: str, function: Callable, dependencies: Iterable[str]):
+    """
+    Adds new parameter to the registry or replaces the existing one
+    :param name: name of the parameter
+    :param function: function, which gets values of dependencies as positional arguments
+    :param dependencies: names of inputs / intermediates / other parameters needed by the function
+    """
+    feature_registry[name] = (function, tuple(dependencies))
+
+
+def feature_dependencies(features: Iterable[str]) -> List[str]:
+    """
+    Resolves all the intermediates needed by the parameters in order of calculation - ValueError for unknown
+    names and cyclic dependencies
+    :param features: names of the parameters
+    :return: names of intermediates and parameters - every name is after its dependencies
+    """
+    ordered = []
+    visiting = []  # path of names, which wait for their dependencies
+
+    def __visit(name: str):
+        if name in ordered or name in {TIME_SECONDS, MAGNITUDE, ACG_XYZ, EVENT_HOLDER}:
+            return
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise ValueError("Cyclic dependency {}".format(" -> ".join(cycle)))
+        if name in feature_registry:
+            _, dependencies = feature_registry[name]
+        elif name in intermediate_registry:
+            _, dependencies = intermediate_registry[name]
+        else:
+            raise ValueError("Unknown parameter {}".format(name))
+        visiting.append(name)
+        for dependency in dependencies:
+            __visit(dependency)
+        visiting.pop()
+        ordered.append(name)
+
+    for feature in features:
+        __visit(feature)
+    return ordered
+
+
+def calculate_selected_parameters(
+    features: Iterable[str],
+    time_seconds: np.ndarray,
+    magnitude: np.ndarray,
+    acg_xyz: np.ndarray,
+    event_holder: EventOfInterest,
+    check_validity=True,
+) -> Optional[np.ndarray]:
+    """
+    Calculates only selected parameters and intermediates they depend on - e.g. the final model needs only 5 of them
+    :param features: names of the parameters from Consts.parameters_names (or registered ones)
+    :param time_seconds: array of time in seconds
+    :param magnitude: magnitude of acceleration 1D
+    :param acg_xyz: magnitude raw 3D
+    :param event_holder: EventHolder object with all the indexes
+    :param check_validity: returns None for the same events as calculate_acg_parameters -
+    change in angle cos can not be calculated
+    :return: selected parameters in numpy array in order of features
+    """
+    features = list(features)
+    values = {
+        TIME_SECONDS: time_seconds,
+        MAGNITUDE: magnitude,
+        ACG_XYZ: acg_xyz,
+        EVENT_HOLDER: event_holder,
+    }
+
+    names = feature_dependencies(features)
+    if check_validity:
+        names = feature_dependencies([CHANGE_IN_ANGLE_COS]) + names
+
+    for name in names:
+        if name in values:
+            continue
+        if name in feature_registry:
+            function, dependencies = feature_registry[name]
+        else:
+            function, dependencies = intermediate_registry[name]
+        values[name] = function(*[values[d] for d in dependencies])
+
+        if check_validity and name == CHANGE_IN_ANGLE_COS and values[name] is None:
+            return None
+
+    return np.array([values[feature] for feature in features], dtype=np.float64)
+
+
+def calculate_selected_parameters_data_carrier(
+    features: Iterable[str], data: DataCarrier, check_validity=True
+) -> Optional[np.ndarray]:
+    """
+    Calculates same parameters as "calculate_selected_parameters", but uses DataCarrier to export all data
+    :param features: names of the parameters from Consts.parameters_names (or registered ones)
+    :param data: DataCarrier with ACG data and with magnitude and time in seconds
+    :param check_validity: returns None for the same events as calculate_acg_parameters_data_carrier
+    :return: selected parameters in numpy array in order of features
+    """
+    return calculate_selected_parameters(
+        features,
+        data.sensor_data[Consts.ACG].modified[Consts.TIME_SECONDS],
+        data.sensor_data[Consts.ACG].modified[Consts.MAGNITUDE],
+        data.sensor_data[Consts.ACG].data,
+        data.event_holder,
+        check_validity=check_validity,
+    )
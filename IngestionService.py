@@ -0,0 +1,499 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import struct
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from Compilation import warm_up
+from DataCarrier import DataCarrier
+from OnlineDetector import Detection, OnlineDetector, REPLAY_BATCH, _percentiles
+
+# header of every frame - kind, id of the stream within the connection, number of samples / values
+FRAME = struct.Struct("<BIH")
+
+# kinds of the frames
+SAMPLES = 1  # client -> server, int64 time in nanoseconds of the samples and float32 matrix 3 x samples
+CLOSE = 2  # client -> server, end of the stream without payload
+ALERT = 3  # server -> client, ALERT_VALUES and float64 Consts.parameters_names of the event
+STATS = 4  # client -> server without payload, server -> client with STATS_VALUES
+
+# time of the firing sample in nanoseconds, seconds from the peak to the firing sample
+ALERT_VALUES = struct.Struct("<qd")
+# open streams, received samples, evaluated events, alerts, cpu seconds and busy seconds of the detectors
+STATS_VALUES = struct.Struct("<qqqqdd")
+
+# bytes of one sample in SAMPLES frame
+SAMPLE_BYTES = 8 + 3 * 4
+
+# samples of the ring buffer of one stream - 20 s at 100 Hz keeps thousands of streams in memory
+SERVICE_CAPACITY = 1 << 11
+
+# batches of every virtual device remembered for the latency of the alerts - 16 s at 100 Hz
+SENT_BATCHES = 64
+
+
+def encode_samples(stream: int, time_ns: np.ndarray, data: np.ndarray) -> bytes:
+    """
+    :param stream: id of the stream
+    :param time_ns: time of the samples in nanoseconds
+    :param data: matrix 3 x samples
+    :return: SAMPLES frame
+    """
+    return (
+        FRAME.pack(SAMPLES, stream, time_ns.shape[0])
+        + np.ascontiguousarray(time_ns, dtype="<i8").tobytes()
+        + np.ascontiguousarray(data, dtype="<f4").tobytes()
+    )
+
+
+def decode_samples(payload: bytes, count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param payload: payload of SAMPLES frame
+    :param count: number of samples from the header
+    :return: time in nanoseconds and matrix 3 x samples - views of the payload
+    """
+    time_ns = np.frombuffer(payload, dtype="<i8", count=count)
+    data = np.frombuffer(payload, dtype="<f4", count=3 * count, offset=8 * count)
+    return time_ns, data.reshape(3, count)
+
+
+def encode_alert(stream: int, detection: Detection) -> bytes:
+    """
+    :param stream: id of the stream
+    :param detection: event with the parameters
+    :return: ALERT frame
+    """
+    parameters = np.asarray(detection.parameters, dtype="<f8")
+    return (
+        FRAME.pack(ALERT, stream, parameters.shape[0])
+        + ALERT_VALUES.pack(detection.time_ns, detection.delay)
+        + parameters.tobytes()
+    )
+
+
+def payload_size(kind: int, count: int) -> int:
+    """
+    :param kind: kind of the frame
+    :param count: number of samples / values from the header
+    :return: bytes of the payload after the header
+    """
+    if kind == SAMPLES:
+        return count * SAMPLE_BYTES
+    if kind == ALERT:
+        return ALERT_VALUES.size + 8 * count
+    return 0
+
+
+async def read_frame(reader: asyncio.StreamReader, reply=False) -> Optional[Tuple[int, int, int, bytes]]:
+    """
+    :param reader: stream of the connection
+    :param reply: if the frame is sent by the server - STATS frame has payload only from the server
+    :return: kind, stream, count and payload, None at the end of the connection
+    """
+    try:
+        kind, stream, count = FRAME.unpack(await reader.readexactly(FRAME.size))
+        size = STATS_VALUES.size if reply and kind == STATS else payload_size(kind, count)
+        return kind, stream, count, await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class IngestionService:
+    def __init__(
+        self,
+        output: Optional[Callable[[int, Detection], None]] = None,
+        **detector,
+    ):
+        """
+        Accelerometer streams of many phones - every connection can carry many streams identified by the id
+        in the header of the frame, every stream has its own OnlineDetector. The events, which pass gate_events
+        and have the parameters, are sent back on the connection of the stream as ALERT frames.
+        :param output: called with id of the stream and Detection for every alert - e.g. notification of the carer
+        :param detector: arguments of OnlineDetector, capacity is SERVICE_CAPACITY by default
+        """
+        self.output = output
+        self.detector = dict(capacity=SERVICE_CAPACITY)
+        self.detector.update(detector)
+        self.streams = 0
+        self.samples = 0
+        self.events = 0
+        self.alerts = 0
+        self.busy = 0.0
+        self.started = time.process_time()
+
+    def stats(self) -> bytes:
+        """
+        :return: STATS frame with the counters of the service
+        """
+        return FRAME.pack(STATS, 0, 0) + STATS_VALUES.pack(
+            self.streams,
+            self.samples,
+            self.events,
+            self.alerts,
+            time.process_time() - self.started,
+            self.busy,
+        )
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves one connection until it is closed by the client or it sends invalid frame
+        """
+        detectors: Dict[int, OnlineDetector] = {}
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                kind, stream, count, payload = frame
+
+                if kind == SAMPLES:
+                    detector = detectors.get(stream)
+                    if detector is None:
+                        detector = detectors[stream] = OnlineDetector(**self.detector)
+                        self.streams += 1
+                    started = time.perf_counter()
+                    detections = detector.push(*decode_samples(payload, count))
+                    self.busy += time.perf_counter() - started
+                    self.samples += count
+                    self.events += len(detections)
+
+                    alerts = [
+                        detection
+                        for detection in detections
+                        if detection.gate is None and detection.parameters is not None
+                    ]
+                    for detection in alerts:
+                        self.alerts += 1
+                        writer.write(encode_alert(stream, detection))
+                        if self.output is not None:
+                            self.output(stream, detection)
+                    if alerts:
+                        await writer.drain()
+                elif kind == CLOSE:
+                    if detectors.pop(stream, None) is not None:
+                        self.streams -= 1
+                elif kind == STATS:
+                    writer.write(self.stats())
+                    await writer.drain()
+                else:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.streams -= len(detectors)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None, path: Optional[str] = None):
+        """
+        :param host: address of TCP socket
+        :param port: port of TCP socket
+        :param path: path of Unix socket - used instead of TCP
+        :return: listening asyncio.Server
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path=path)
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def print_alert(stream: int, detection: Detection):
+    """
+    Output of the service - one json line per alert
+    """
+    print(
+        json.dumps(
+            {
+                "stream": stream,
+                "time": detection.time_ns,
+                "delay": detection.delay,
+                "parameters": dict(zip(Consts.parameters_names, detection.parameters.tolist())),
+            }
+        ),
+        flush=True,
+    )
+
+
+def serve(host: Optional[str] = None, port: Optional[int] = None, path: Optional[str] = None, quiet=False):
+    """
+    Runs the service until it is interrupted - kernels are compiled before the first connection
+    :param quiet: without print_alert
+    """
+    warm_up()
+
+    async def __serve():
+        service = IngestionService(None if quiet else print_alert)
+        server = await service.start(host, port, path)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(__serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def _device_batches(time_ns: np.ndarray, data: np.ndarray, batch: int, start: int):
+    """
+    Endless replay of the recording from the start sample - time continues over the repetitions
+    :return: generator of time and data of the batches
+    """
+    period = int(time_ns[-1] - time_ns[0]) + int(np.median(np.diff(time_ns)))
+    repetition = 0
+    begin = start
+    while True:
+        end = min(begin + batch, time_ns.shape[0])
+        yield time_ns[begin:end] + repetition * period, data[:, begin:end]
+        begin = end
+        if begin == time_ns.shape[0]:
+            begin = 0
+            repetition += 1
+
+
+async def simulate(
+    recordings: List[Tuple[np.ndarray, np.ndarray]],
+    devices: int,
+    duration: float,
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    path: Optional[str] = None,
+    connections=1,
+    speed=1.0,
+    batch=REPLAY_BATCH,
+    seed=0,
+) -> dict:
+    """
+    Virtual devices replaying the recordings to the service - device i replays recording i % len(recordings)
+    from random sample, devices are spread over the connections
+    :param recordings: time in nanoseconds and matrix 3 x samples of the accelerometer
+    :param devices: number of virtual devices
+    :param duration: seconds of the simulation
+    :param host: address of TCP socket
+    :param port: port of TCP socket
+    :param path: path of Unix socket - used instead of TCP
+    :param connections: number of connections
+    :param speed: times of the real time
+    :param batch: samples of one frame
+    :param seed: seed of the starting samples
+    :return: report - sent samples and their rate, alerts, percentiles of the latency (from sending the batch with
+    the firing sample to receiving the alert), maximal lag of the devices behind their schedule and counters of
+    the service with the users per core (received samples per cpu second of the service / sampling rate)
+    """
+    loop = asyncio.get_running_loop()
+    random = np.random.default_rng(seed)
+    rate = 1e9 / np.median(np.concatenate([np.diff(time_ns) for time_ns, _ in recordings]))
+    sent: List[deque] = [deque(maxlen=SENT_BATCHES) for _ in range(devices)]
+    latencies: List[float] = []
+    counters = {"samples": 0, "lag": 0.0}
+
+    async def __device(stream: int, writer: asyncio.StreamWriter, began: float, deadline: float):
+        time_ns, data = recordings[stream % len(recordings)]
+        origin = None
+        # devices do not send at the same moment
+        first = began + random.uniform(0, batch / rate / speed)
+        for batch_time, batch_data in _device_batches(
+            time_ns, data, batch, int(random.integers(time_ns.shape[0]))
+        ):
+            if origin is None:
+                origin = batch_time[0]
+            due = first + (batch_time[-1] - origin) * (10 ** -9) / speed
+            if due > deadline:
+                break
+            remaining = due - loop.time()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            else:
+                counters["lag"] = max(counters["lag"], -remaining)
+            writer.write(encode_samples(stream, batch_time, batch_data))
+            sent[stream].append((int(batch_time[-1]), time.perf_counter()))
+            counters["samples"] += batch_time.shape[0]
+            await writer.drain()
+        writer.write(FRAME.pack(CLOSE, stream, 0))
+
+    async def __receive(reader: asyncio.StreamReader, replies: asyncio.Queue):
+        while True:
+            frame = await read_frame(reader, reply=True)
+            if frame is None:
+                return
+            kind, stream, _, payload = frame
+            if kind == ALERT:
+                received = time.perf_counter()
+                time_ns, _ = ALERT_VALUES.unpack_from(payload)
+                # batch, which contains the firing sample
+                for last_time, sent_at in sent[stream]:
+                    if last_time >= time_ns:
+                        latencies.append(received - sent_at)
+                        break
+            elif kind == STATS:
+                replies.put_nowait(STATS_VALUES.unpack(payload))
+
+    async def __stats(writers: List[asyncio.StreamWriter], replies: asyncio.Queue) -> tuple:
+        for writer in writers:
+            writer.write(FRAME.pack(STATS, 0, 0))
+            await writer.drain()
+        # frames of one connection are processed in order - the last reply follows all the sent samples
+        return max([await replies.get() for _ in writers], key=lambda values: values[1])
+
+    opened = []
+    for _ in range(connections):
+        if path is not None:
+            opened.append(await asyncio.open_unix_connection(path))
+        else:
+            opened.append(await asyncio.open_connection(host, port))
+    replies = asyncio.Queue()
+    receivers = [asyncio.ensure_future(__receive(reader, replies)) for reader, _ in opened]
+
+    # counters of the service only during the simulation
+    before = await __stats([opened[0][1]], replies)
+    began = loop.time()
+    started = time.perf_counter()
+    await asyncio.gather(
+        *[
+            __device(stream, opened[stream % connections][1], began, began + duration)
+            for stream in range(devices)
+        ]
+    )
+    elapsed = time.perf_counter() - started
+    after = await __stats([writer for _, writer in opened], replies)
+    _, samples, events, alerts, cpu, busy = np.subtract(after, before).tolist()
+
+    for _, writer in opened:
+        writer.close()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    report = {
+        "devices": devices,
+        "connections": connections,
+        "seconds": elapsed,
+        "samples": counters["samples"],
+        "samples_per_second": counters["samples"] / elapsed,
+        "alerts": len(latencies),
+        "lag_max": counters["lag"],
+        "service_samples": int(samples),
+        "service_events": int(events),
+        "service_alerts": int(alerts),
+        "service_cpu": cpu,
+        "service_busy": busy,
+        "users_per_core": samples / cpu / rate if cpu else np.nan,
+    }
+    report.update(_percentiles(latencies, "latency"))
+    return report
+
+
+def load_recordings(paths: List[str]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    :param paths: measurement folders
+    :return: time in nanoseconds and matrix 3 x samples of the accelerometer of every measurement
+    """
+    recordings = []
+    for path in paths:
+        acceleration = DataCarrier(path).sensor_data[Consts.ACG]
+        recordings.append((acceleration.time, acceleration.data))
+    return recordings
+
+
+async def _wait_for_service(host: Optional[str], port: Optional[int], path: Optional[str], timeout=30.0):
+    """
+    Waits until the spawned service accepts connections
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            if path is not None:
+                _, writer = await asyncio.open_unix_connection(path)
+            else:
+                _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fall detection service for many accelerometer streams and its device simulator"
+    )
+    parser.add_argument("command", choices=["serve", "simulate"])
+    parser.add_argument("paths", nargs="*", help="measurement folders replayed by the simulator")
+    parser.add_argument("--host", default="127.0.0.1", help="address of TCP socket")
+    parser.add_argument("--port", type=int, default=7878, help="port of TCP socket")
+    parser.add_argument("--unix", help="path of Unix socket used instead of TCP")
+    parser.add_argument("--quiet", action="store_true", help="service does not print the alerts")
+    parser.add_argument(
+        "--devices", type=int, nargs="+", default=[100], help="virtual devices - one simulation per number"
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of one simulation")
+    parser.add_argument("--connections", type=int, default=1, help="connections of the simulator")
+    parser.add_argument("--speed", type=float, default=1.0, help="times of the real time")
+    parser.add_argument("--batch", type=int, default=REPLAY_BATCH, help="samples of one frame")
+    parser.add_argument(
+        "--spawn", action="store_true", help="simulator starts the service in its own process"
+    )
+    arguments = parser.parse_args()
+
+    if arguments.command == "serve":
+        serve(arguments.host, arguments.port, arguments.unix, arguments.quiet)
+        sys.exit()
+
+    address = dict(host=arguments.host, port=arguments.port, path=arguments.unix)
+    service = None
+    if arguments.spawn:
+        service = multiprocessing.get_context("spawn").Process(
+            target=serve, kwargs=dict(address, quiet=True)
+        )
+        service.start()
+    try:
+        asyncio.run(_wait_for_service(**address))
+        replayed = load_recordings(arguments.paths)
+        reports = [
+            asyncio.run(
+                simulate(
+                    replayed,
+                    devices,
+                    arguments.duration,
+                    connections=arguments.connections,
+                    speed=arguments.speed,
+                    batch=arguments.batch,
+                    **address,
+                )
+            )
+            for devices in arguments.devices
+        ]
+    finally:
+        if service is not None:
+            service.terminate()
+            service.join()
+    pd.set_option("display.width", 250)
+    print(pd.DataFrame(reports).to_string(index=False))
@@ -0,0 +1,329 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Iterable, List, Optional
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from SensorArchive import ARCHIVE_EXTENSION, TEMPORARY_EXTENSION
+
+# binary copy of the measurement is stored in the subfolder of the measurement folder
+CACHE_FOLDER = ".cache"
+# the cache is written into this folder first - folder left by interrupted conversion is replaced by the next one,
+# folders starting with CACHE_FOLDER are not part of the measurement
+TEMPORARY_FOLDER = CACHE_FOLDER + ".tmp"
+MANIFEST = "manifest.json"
+CACHE_VERSION = 1
+
+# attributes of DataCarrier parsed from extra.txt and changes.txt, which are stored in the manifest
+METADATA = [
+    "annotations_description",
+    "changes_description",
+    "changes",
+    "max_values",
+    "annotations",
+    "millis",
+    "nanos",
+    "environment",
+    "holding_position",
+]
+
+
+def cache_path(path: str) -> str:
+    """
+    :param path: path to folder with the measurements
+    :return: path to the binary cache of the folder
+    """
+    return os.path.join(path, CACHE_FOLDER)
+
+
+def _file_hash(file_path: str, block_size=1 << 22) -> str:
+    """
+    :param file_path: path to file
+    :return: sha1 of the content
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        block = file.read(block_size)
+        while block:
+            digest.update(block)
+            block = file.read(block_size)
+    return digest.hexdigest()
+
+
+def source_signature(path: str, with_hash=False) -> dict:
+    """
+    Identification of the source files - any change of size or modification time invalidates the cache
+    :param path: path to folder with the measurements
+    :param with_hash: add sha1 of the content - detects also changes, which keep the size and modification time
+    :return: file name -> [size, modification time in ns(, sha1)]
+    """
+    signature = {}
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        if (
+            name.startswith(CACHE_FOLDER)
+            or name.endswith(TEMPORARY_EXTENSION)
+            or not os.path.isfile(file_path)
+        ):
+            continue
+        stat = os.stat(file_path)
+        signature[name] = [stat.st_size, stat.st_mtime_ns]
+        if with_hash:
+            signature[name].append(_file_hash(file_path))
+    return signature
+
+
+def _encode_metadata(data_carrier) -> dict:
+    """
+    :param data_carrier: DataCarrier
+    :return: metadata convertible to json
+    """
+    metadata = {name: getattr(data_carrier, name) for name in METADATA}
+    # json has only string keys
+    metadata["annotations_description"] = [
+        [key, value] for key, value in data_carrier.annotations_description.items()
+    ]
+    metadata["changes"] = [list(change) for change in data_carrier.changes]
+    return metadata
+
+
+def _decode_metadata(metadata: dict) -> dict:
+    """
+    :param metadata: metadata from manifest
+    :return: attributes of DataCarrier in original types
+    """
+    metadata = dict(metadata)
+    metadata["annotations_description"] = {
+        key: value for key, value in metadata["annotations_description"]
+    }
+    metadata["changes"] = [tuple(change) for change in metadata["changes"]]
+    return metadata
+
+
+def write_cache(data_carrier, path: str, derived=True, with_hash=False):
+    """
+    Stores the sensors of the DataCarrier as .npy files with parsed metadata into the cache folder.
+    The cache is written into temporary folder first and replaces the old one at the end,
+    so the interrupted conversion does not leave a broken cache.
+    :param data_carrier: DataCarrier loaded from csv files with all the sensors
+    :param path: path to folder with the measurements
+    :param derived: store also magnitude and time in seconds of every sensor
+    :param with_hash: validate the cache by sha1 of the source files, not only by size and modification time
+    """
+    sensors = {}
+    temporary = os.path.join(path, TEMPORARY_FOLDER)
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.mkdir(temporary)
+    try:
+        for sensor_type, sensor in data_carrier.sensor_data.items():
+            arrays = {"time": sensor.time, "data": sensor.data}
+            if sensor.acc is not None:
+                arrays["acc"] = sensor.acc
+            if derived and sensor.time.shape[0]:
+                # same as EventChecker.calculate_time_magnitude
+                arrays[Consts.MAGNITUDE] = sensor.magnitude
+                arrays[Consts.TIME_SECONDS] = sensor.time_seconds
+
+            for name, array in arrays.items():
+                np.save(
+                    os.path.join(temporary, "{}_{}.npy".format(sensor_type, name)),
+                    np.ascontiguousarray(array),
+                )
+            sensors[sensor_type] = {
+                "arrays": list(arrays.keys()),
+                "files": data_carrier.sensor_files.get(sensor_type, []),
+            }
+
+        manifest = {
+            "version": CACHE_VERSION,
+            "sources": source_signature(path, with_hash),
+            "with_hash": with_hash,
+            "metadata": _encode_metadata(data_carrier),
+            "sensors": sensors,
+        }
+        with open(os.path.join(temporary, MANIFEST), "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+
+        shutil.rmtree(cache_path(path), ignore_errors=True)
+        os.replace(temporary, cache_path(path))
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+
+
+def read_manifest(path: str) -> Optional[dict]:
+    """
+    :param path: path to folder with the measurements
+    :return: manifest of the cache, if the cache exists and matches the source files, None otherwise
+    """
+    manifest_path = os.path.join(cache_path(path), MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("version") != CACHE_VERSION:
+        return None
+    if manifest["sources"] != source_signature(path, manifest["with_hash"]):
+        return None
+    return manifest
+
+
+def read_cache(path: str, read_only: Optional[List[str]] = None) -> Optional[dict]:
+    """
+    Opens the cache of the folder - arrays are memory mapped, so only touched pages are read from the disk
+    :param path: path to folder with the measurements
+    :param read_only: list of names of files, which should be read only - None = read all, same as in DataCarrier
+    :return: None, if the cache is missing or outdated, otherwise dictionary with metadata (attributes of DataCarrier)
+    and sensors (sensor type -> dictionary of read-only arrays time, data, acc and derived channels)
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+
+    folder = cache_path(path)
+    sensors = {}
+    for sensor_type, description in manifest["sensors"].items():
+        if read_only is not None and not any(
+            specific_file in file
+            for file in description["files"]
+            for specific_file in read_only
+        ):
+            continue
+        sensors[sensor_type] = {
+            name: np.asarray(
+                np.load(
+                    os.path.join(folder, "{}_{}.npy".format(sensor_type, name)),
+                    mmap_mode="r",
+                )
+            )
+            for name in description["arrays"]
+        }
+
+    return {"metadata": _decode_metadata(manifest["metadata"]), "sensors": sensors}
+
+
+def remove_cache(path: str):
+    """
+    :param path: path to folder with the measurements
+    """
+    shutil.rmtree(cache_path(path), ignore_errors=True)
+
+
+def verify_cache(path: str) -> pd.DataFrame:
+    """
+    Round-trip check - the cache is written again from the cached DataCarrier and every sensor is read back
+    by DataCarrier with read_only of the sensor and compared with the original csv files
+    :param path: folder with the measurements and valid cache
+    :return: table with sensor, samples, files in the manifest, equal time, data and accuracy and result
+    """
+    from DataCarrier import DataCarrier
+
+    original = DataCarrier(path, use_cache=False)
+    DataCarrier(path).save_cache()
+    manifest = read_manifest(path)
+
+    rows = []
+    for sensor_type in sorted(original.sensor_data.available):
+        source = original.sensor_data[sensor_type]
+        copy = DataCarrier(path, read_only=[sensor_type]).sensor_data.get(sensor_type)
+        files = manifest["sensors"].get(sensor_type, {}).get("files", []) if manifest else []
+        if copy is None:
+            rows.append([sensor_type, source.time.shape[0], len(files), False, False, False, False])
+            continue
+        time_equal = np.array_equal(source.time, copy.time)
+        data_equal = np.array_equal(source.data, copy.data)
+        acc_equal = (source.acc is None and copy.acc is None) or np.array_equal(source.acc, copy.acc)
+        rows.append(
+            [
+                sensor_type,
+                source.time.shape[0],
+                len(files),
+                time_equal,
+                data_equal,
+                acc_equal,
+                bool(files) and time_equal and data_equal and acc_equal,
+            ]
+        )
+    return pd.DataFrame(
+        rows, columns=["sensor", "samples", "files", "time", "data", "accuracy", "ok"]
+    )
+
+
+def measurement_folders(paths: Iterable[str]) -> List[str]:
+    """
+    :param paths: measurement folders or folders with measurement folders in any depth
+    :return: all folders, which contain csv files or archives of SensorArchive
+    """
+    folders = []
+    for path in paths:
+        for root, directories, files in os.walk(path):
+            directories[:] = sorted(
+                d for d in directories if not d.startswith(CACHE_FOLDER)
+            )
+            if any(file.endswith((".csv", ARCHIVE_EXTENSION)) for file in files):
+                folders.append(root)
+    return folders
+
+
+if __name__ == "__main__":
+    from DataCarrier import DataCarrier
+
+    parser = argparse.ArgumentParser(
+        description="Converts SensorBox measurement folders into binary cache"
+    )
+    parser.add_argument("paths", nargs="+", help="measurement folders or their roots")
+    parser.add_argument("--hash", action="store_true", help="validate by sha1 of files")
+    parser.add_argument(
+        "--no-derived", action="store_true", help="do not store magnitude and time"
+    )
+    parser.add_argument("--force", action="store_true", help="rewrite valid caches")
+    parser.add_argument(
+        "--verify", action="store_true", help="round-trip check of the converted caches"
+    )
+    arguments = parser.parse_args()
+
+    for measurement in measurement_folders(arguments.paths):
+        if arguments.verify:
+            if read_manifest(measurement) is None:
+                print("Missing cache {}".format(measurement))
+                continue
+            report = verify_cache(measurement)
+            print("{} {}".format(measurement, "ok" if report["ok"].all() else "FAILED"))
+            if not report["ok"].all():
+                print(report.to_string(index=False))
+            continue
+        if not arguments.force and read_manifest(measurement) is not None:
+            continue
+        DataCarrier(measurement, use_cache=False).save_cache(
+            derived=not arguments.no_derived, with_hash=arguments.hash
+        )
+        print("Converted {}".format(measurement))
@@ -0,0 +1,324 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Iterable, List, Optional
+
+import argparse
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+from DataCarrier import DataCarrier
+from MeasurementCache import measurement_folders, source_signature
+from SensorArchive import archive_time_range, is_archive, read_index
+from SensorCsv import count_samples, read_time_range
+
+_schema = """
+CREATE TABLE IF NOT EXISTS measurements (
+    path TEXT PRIMARY KEY,
+    activity TEXT,
+    hold TEXT,
+    environment TEXT,
+    sensors TEXT,
+    bytes INTEGER,
+    samples INTEGER,
+    duration REAL,
+    sample_rate REAL,
+    mtime INTEGER,
+    signature TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT,
+    name TEXT,
+    sensor TEXT,
+    bytes INTEGER,
+    samples INTEGER,
+    mtime INTEGER,
+    PRIMARY KEY (path, name)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    path TEXT PRIMARY KEY,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS measurements_activity ON measurements (activity);
+CREATE INDEX IF NOT EXISTS files_sensor ON files (sensor);
+"""
+
+# columns of the measurements table
+# samples, duration (s) and sample_rate (Hz) are of the accelerometer (Consts.ACG) - samples are complete rows,
+# duration is between the first and the last complete row
+INDEX_COLUMNS = [
+    "path",
+    "activity",
+    "hold",
+    "environment",
+    "sensors",
+    "bytes",
+    "samples",
+    "duration",
+    "sample_rate",
+    "mtime",
+]
+
+
+def normalize_choice(value: Optional[str], choices: List[List[str]]) -> Optional[str]:
+    """
+    Maps the placement / environment from extra.txt in any language to the English name
+    :param value: value from extra.txt
+    :param choices: Consts.hold or Consts.environment
+    :return: English name, stripped value if it is not known, None for missing value
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    for names in choices:
+        if value in names:
+            return names[0]
+    return value
+
+
+class MeasurementIndex:
+    def __init__(self, database_path: str):
+        """
+        Persistent SQLite index of measurement folders - one row per folder with activity, placement, environment,
+        sensors, sizes, sample counts, duration and sample rate of the accelerometer. Folders are described from
+        the file names, extra.txt and the first / last row of the files, sensors are not parsed.
+        :param database_path: path to SQLite file - created, if it does not exist
+        """
+        self.connection = sqlite3.connect(database_path)
+        self.connection.executescript(_schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __describe(self, path: str, signature: dict) -> tuple:
+        """
+        :param path: measurement folder
+        :param signature: sizes and modification times of the files
+        :return: row of measurements table and rows of files table
+        """
+        data_carrier = DataCarrier(path, use_cache=False)
+
+        files = []
+        samples = duration = sample_rate = None
+        for sensor_type in data_carrier.sensor_files:
+            sensor_paths = data_carrier.sensor_paths(sensor_type)
+            sensor_samples = 0
+            for file_path in sensor_paths:
+                name = os.path.basename(file_path)
+                if is_archive(file_path):
+                    rows = read_index(file_path)["samples"]
+                else:
+                    rows = count_samples(file_path)
+                sensor_samples += rows
+                size, mtime = signature[name][:2]
+                files.append((path, name, sensor_type, size, rows, mtime))
+
+            if sensor_type == Consts.ACG:
+                samples = sensor_samples
+                if sensor_paths and is_archive(sensor_paths[0]):
+                    time_range = archive_time_range(sensor_paths)
+                else:
+                    time_range = read_time_range(sensor_paths)
+                if time_range is not None:
+                    duration = (time_range[1] - time_range[0]) * 10 ** -9
+                    if duration > 0:
+                        sample_rate = (samples - 1) / duration
+
+        measurement = (
+            path,
+            data_carrier.activity_type,
+            normalize_choice(data_carrier.holding_position, Consts.hold),
+            normalize_choice(data_carrier.environment, Consts.environment),
+            ",".join(sorted(data_carrier.sensor_files)),
+            sum(size for size, *_ in signature.values()),
+            samples,
+            duration,
+            sample_rate,
+            max((mtime for _, mtime, *_ in signature.values()), default=None),
+            json.dumps(signature),
+        )
+        return measurement, files
+
+    def update(self, roots: Iterable[str], remove_missing=True) -> dict:
+        """
+        Adds new folders and describes again only the folders, which files changed (size or modification time)
+        :param roots: measurement folders or folders with measurement folders in any depth
+        :param remove_missing: remove folders under the roots, which do not exist anymore
+        :return: number of added, updated, unchanged, failed and removed folders - errors of the failed folders
+        are in failures
+        """
+        roots = [os.path.abspath(root) for root in roots]
+        stored = dict(self.connection.execute("SELECT path, signature FROM measurements"))
+        stored.update(
+            (path, None) for (path,) in self.connection.execute("SELECT path FROM failures")
+        )
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "failed": 0, "removed": 0}
+
+        found = set()
+        with self.connection:
+            for path in measurement_folders(roots):
+                found.add(path)
+                signature = source_signature(path)
+                if stored.get(path) is not None and json.loads(stored[path]) == signature:
+                    counts["unchanged"] += 1
+                    continue
+
+                try:
+                    measurement, files = self.__describe(path, signature)
+                except Exception as error:
+                    # broken folder does not stop the update - it is described again at the next update
+                    counts["failed"] += 1
+                    for table in ["measurements", "files"]:
+                        self.connection.execute(
+                            "DELETE FROM {} WHERE path = ?".format(table), (path,)
+                        )
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO failures VALUES (?, ?)",
+                        (path, "{}: {}".format(type(error).__name__, error)),
+                    )
+                    continue
+
+                counts["updated" if path in stored else "added"] += 1
+                self.connection.execute("DELETE FROM failures WHERE path = ?", (path,))
+                self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO measurements VALUES ({})".format(
+                        ",".join("?" * len(measurement))
+                    ),
+                    measurement,
+                )
+                self.connection.executemany(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", files
+                )
+
+            if remove_missing:
+                for path in stored:
+                    under_root = any(
+                        path == root or path.startswith(root + os.sep) for root in roots
+                    )
+                    if under_root and path not in found:
+                        counts["removed"] += 1
+                        for table in ["measurements", "files", "failures"]:
+                            self.connection.execute(
+                                "DELETE FROM {} WHERE path = ?".format(table), (path,)
+                            )
+        return counts
+
+    def query(
+        self,
+        activity: Optional[Iterable[str]] = None,
+        hold: Optional[Iterable[str]] = None,
+        environment: Optional[Iterable[str]] = None,
+        sensors: Optional[Iterable[str]] = None,
+        min_duration: Optional[float] = None,
+        max_duration: Optional[float] = None,
+        min_sample_rate: Optional[float] = None,
+    ) -> List[str]:
+        """
+        Paths of the folders, which match all the given conditions - None means no condition
+        query(activity=Consts.activity_valid, hold=["Pocket"], sensors=[Consts.ACG], min_duration=10)
+        :param activity: allowed activities - e.g. Consts.activity_valid
+        :param hold: allowed placements of the phone in English - first names from Consts.hold
+        :param environment: allowed environments in English - first names from Consts.environment
+        :param sensors: sensors, which must be in the folder
+        :param min_duration: minimal duration of the accelerometer in seconds
+        :param max_duration: maximal duration of the accelerometer in seconds
+        :param min_sample_rate: minimal sample rate of the accelerometer in Hz
+        :return: sorted paths
+        """
+        conditions, parameters = [], []
+        for column, values in [
+            ("activity", activity),
+            ("hold", hold),
+            ("environment", environment),
+        ]:
+            if values is not None:
+                values = list(values)
+                conditions.append(
+                    "{} IN ({})".format(column, ",".join("?" * len(values)))
+                )
+                parameters += values
+
+        for sensor in sensors or []:
+            conditions.append(
+                "path IN (SELECT path FROM files WHERE sensor = ?)"
+            )
+            parameters.append(sensor)
+
+        for condition, value in [
+            ("duration >= ?", min_duration),
+            ("duration <= ?", max_duration),
+            ("sample_rate >= ?", min_sample_rate),
+        ]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        sql = "SELECT path FROM measurements"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path"
+        return [row[0] for row in self.connection.execute(sql, parameters)]
+
+    def measurements(self) -> pd.DataFrame:
+        """
+        :return: whole index as a table with INDEX_COLUMNS
+        """
+        return pd.read_sql_query(
+            "SELECT {} FROM measurements ORDER BY path".format(",".join(INDEX_COLUMNS)),
+            self.connection,
+        )
+
+    def failures(self) -> pd.DataFrame:
+        """
+        :return: folders, which could not be described by the last update, with the error
+        """
+        return pd.read_sql_query(
+            "SELECT * FROM failures ORDER BY path", self.connection
+        )
+
+    def files(self) -> pd.DataFrame:
+        """
+        :return: all indexed sensor files with folder, name, sensor type, size, number of samples and modification time
+        """
+        return pd.read_sql_query(
+            "SELECT * FROM files ORDER BY path, name", self.connection
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index of SensorBox measurements")
+    parser.add_argument("database", help="path to SQLite file")
+    parser.add_argument("roots", nargs="+", help="folders with measurements")
+    arguments = parser.parse_args()
+
+    with MeasurementIndex(arguments.database) as index:
+        print(index.update(arguments.roots))
+        print(index.measurements())
@@ -0,0 +1,469 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import List, Optional, Union
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from numba import njit
+
+from DataCarrier import DataCarrier, _magnitude
+from EventChecker import (
+    BOUNDARY_COLUMNS,
+    GATES,
+    gate_events,
+    pick_array_of_interest,
+    window_event,
+)
+from Parameters import calculate_acg_parameters
+from Precision import precision
+from StreamReader import HISTORY_SECONDS
+
+# samples of the ring buffer - 10 s of history at 400 Hz, longer history is cut to the buffer
+DETECTOR_CAPACITY = 1 << 12
+
+# seconds after the end of the event needed by change_in_angle_cos
+POST_IMPACT_SECONDS = 1.0
+
+# samples pushed to the detector at once by replay - about 0.25 s of accelerometer at 100 Hz
+REPLAY_BATCH = 25
+
+# fields of the state of _scan_stream
+_DETECTION, _LAST_DETECTION, _PEAK_VALUE, _PEAK_TIME = range(4)
+
+
+@njit(cache=True)
+def _scan_stream(
+    time_seconds, magnitude_vector, state, threshold, refractory, delay, post_impact
+):
+    """
+    Continues the indication of scan_triggers over the next samples of the stream - the state is kept between calls
+    :param time_seconds: 1D vector of the new samples
+    :param magnitude_vector: 1D vector of the new samples
+    :param state: detection flag, time of the last indication, value and time of the peak of the indication
+    :param threshold: magnitude, which starts the indication
+    :param refractory: seconds after the indication, when the fall proceeds
+    :param delay: seconds after the last indication, when the window is cut at the earliest
+    :param post_impact: seconds after the peak, which are needed for the event
+    :return: index of the firing sample, -1 if no sample fires
+    """
+    for index in range(time_seconds.shape[0]):
+        t = time_seconds[index]
+        value = magnitude_vector[index]
+        if state[_DETECTION] == 0.0:
+            if value > threshold:
+                state[_DETECTION] = 1.0
+                state[_LAST_DETECTION] = t
+                state[_PEAK_VALUE] = value
+                state[_PEAK_TIME] = t
+            continue
+
+        if value > state[_PEAK_VALUE]:
+            state[_PEAK_VALUE] = value
+            state[_PEAK_TIME] = t
+
+        elapsed = abs(t - state[_LAST_DETECTION])
+        if elapsed <= refractory:
+            continue
+        if value > threshold:
+            state[_LAST_DETECTION] = t
+            continue
+        if elapsed >= delay and t - state[_PEAK_TIME] >= post_impact:
+            state[_DETECTION] = 0.0
+            return index
+    return -1
+
+
+class Detection:
+    def __init__(
+        self,
+        index: int,
+        time_ns: int,
+        boundaries: np.ndarray,
+        delay: float,
+        gate: Optional[str],
+        parameters: Optional[np.ndarray],
+        received: float,
+        detected: float,
+    ):
+        """
+        Event found by OnlineDetector
+        :param index: index of the firing sample in the stream
+        :param time_ns: time of the firing sample in nanoseconds
+        :param boundaries: row of BOUNDARY_COLUMNS with indexes into the stream - same as the row of find_events
+        :param delay: seconds of the stream from the peak of the event to the firing sample
+        :param gate: name of the failed gate from GATES, None for the events, which passed
+        :param parameters: Consts.parameters_names of the event, None for rejected events or without the parameters
+        :param received: time.perf_counter, when the batch with the firing sample was pushed
+        :param detected: time.perf_counter, when the event was evaluated
+        """
+        self.index = index
+        self.time_ns = time_ns
+        self.boundaries = boundaries
+        self.delay = delay
+        self.gate = gate
+        self.parameters = parameters
+        self.received = received
+        self.detected = detected
+
+    @property
+    def latency(self) -> float:
+        """
+        :return: seconds of processing from the push of the firing sample to the evaluated event
+        """
+        return self.detected - self.received
+
+    def __repr__(self):
+        return "Detection(index={}, delay={:.3f}, gate={})".format(
+            self.index, self.delay, self.gate
+        )
+
+
+class OnlineDetector:
+    def __init__(
+        self,
+        capacity=DETECTOR_CAPACITY,
+        history=HISTORY_SECONDS,
+        threshold=30.0,
+        refractory=0.75,
+        delay=0.0,
+        threshold_ending=15,
+        begin_max=0.3,
+        end_max=0.7,
+        post_impact=POST_IMPACT_SECONDS,
+        gate=True,
+        overlap=False,
+        dtype=None,
+    ):
+        """
+        Fall detection of the stream of accelerometer samples pushed in small batches - same rules as find_events,
+        gate_events and calculate_acg_parameters over whole recording. The last samples are kept in the ring buffer,
+        which is written twice, so every window of the history is one contiguous view.
+        The event is evaluated as soon as end_max + post_impact seconds after its peak are in the buffer,
+        delay=5 with overlap fires at the same samples as scan_triggers and gives the same boundaries and parameters
+        as offline.
+        :param capacity: samples of the history
+        :param history: seconds of the window before the firing sample
+        :param threshold: magnitude, which starts the indication
+        :param refractory: seconds after the indication, when the fall proceeds
+        :param delay: minimal seconds after the last indication, when the window is cut
+        :param threshold_ending: at end, minimal value of ending
+        :param begin_max: max time to middle
+        :param end_max: max end time of event
+        :param post_impact: seconds after end_max needed by the parameters - change_in_angle_cos takes 1 s
+        :param gate: if the events are filtered by gate_events before the parameters
+        :param overlap: if the window can reach before the previous firing sample, as in find_events - without
+        the overlap, the movement after the fall, which starts new indication, does not report the same peak again
+        :param dtype: floating type of the data - None for Precision
+        """
+        self.capacity = capacity
+        self.history = history
+        self.threshold = threshold
+        self.refractory = refractory
+        self.delay = delay
+        self.threshold_ending = threshold_ending
+        self.begin_max = begin_max
+        self.end_max = end_max
+        self.post_impact = post_impact
+        self.gate = gate
+        self.overlap = overlap
+        self.dtype = precision.resolve(dtype)
+
+        self.time_buffer = np.empty(2 * capacity, dtype=np.float64)
+        self.data_buffer = np.empty((3, 2 * capacity), dtype=self.dtype)
+        self.magnitude_buffer = np.empty(2 * capacity, dtype=self.dtype)
+        self.state = np.zeros(4, dtype=np.float64)
+        self.origin = None
+        self.written = 0  # samples in the buffer from the beginning of the stream
+        self.scanned = 0  # samples evaluated by _scan_stream
+        self.fired = 0  # index of the last firing sample in the stream
+
+    def reset(self):
+        """
+        Forgets the stream - next pushed sample is the first sample of new stream
+        """
+        self.state[:] = 0
+        self.origin = None
+        self.written = 0
+        self.scanned = 0
+        self.fired = 0
+
+    def __write(self, time_seconds: np.ndarray, data: np.ndarray, magnitude: np.ndarray):
+        """
+        Appends the samples to the ring buffer - only the last capacity samples are kept
+        """
+        count = time_seconds.shape[0]
+        skipped = max(count - self.capacity, 0)
+        positions = (self.written + np.arange(skipped, count)) % self.capacity
+        for offset in (0, self.capacity):
+            self.time_buffer[positions + offset] = time_seconds[skipped:]
+            self.data_buffer[:, positions + offset] = data[:, skipped:]
+            self.magnitude_buffer[positions + offset] = magnitude[skipped:]
+        self.written += count
+
+    def __window(self, fire_time: float) -> tuple:
+        """
+        :param fire_time: time of the firing sample in seconds
+        :return: index of the first sample of the window in the stream, time, magnitude and data of the window
+        """
+        available = min(self.written, self.capacity)
+        start = (self.written - available) % self.capacity
+        part = slice(start, start + available)
+        time_seconds = self.time_buffer[part]
+
+        # last sample older than the history, as in scan_triggers
+        older = np.flatnonzero(np.abs(fire_time - time_seconds) > self.history)
+        begin = int(older[-1]) if older.shape[0] else 0
+        if not self.overlap:
+            begin = max(begin, self.fired - (self.written - available))
+        return (
+            self.written - available + begin,
+            time_seconds[begin:],
+            self.magnitude_buffer[part][begin:],
+            self.data_buffer[:, part][:, begin:],
+        )
+
+    def __evaluate(self, index: int, time_ns: int, fire_time: float, received: float) -> Optional[Detection]:
+        """
+        Boundaries, gates and parameters of the window before the firing sample
+        :return: Detection, None if pick_array_of_interest finds no event
+        """
+        window_begin, time_seconds, magnitude, data = self.__window(fire_time)
+        picked = pick_array_of_interest(
+            time_seconds, magnitude, self.threshold_ending, self.begin_max, self.end_max
+        )
+        if picked is None:
+            return None
+        _, _, begin, end, max_peak_index, free_fall_end = picked
+        row = np.array(
+            [
+                [
+                    0,
+                    time_seconds.shape[0],
+                    begin,
+                    end,
+                    max_peak_index,
+                    free_fall_end if free_fall_end is not None else -1,
+                ]
+            ],
+            dtype=np.int64,
+        )
+
+        gate = None
+        if self.gate:
+            _, counters = gate_events(time_seconds, magnitude, row)
+            gate = next((name for name in GATES if counters[name]), None)
+
+        parameters = None
+        if gate is None:
+            _, event = window_event(time_seconds, magnitude, row[0])
+            parameters = calculate_acg_parameters(time_seconds, magnitude, data, event)
+
+        boundaries = row[0] + window_begin
+        if free_fall_end is None:
+            boundaries[-1] = -1
+        return Detection(
+            index,
+            time_ns,
+            boundaries,
+            fire_time - time_seconds[max_peak_index],
+            gate,
+            parameters,
+            received,
+            time.perf_counter(),
+        )
+
+    def push(self, time_ns: np.ndarray, data: np.ndarray) -> List[Detection]:
+        """
+        :param time_ns: time of the new samples in nanoseconds
+        :param data: matrix axes x samples of the new samples
+        :return: events fired by the new samples
+        """
+        received = time.perf_counter()
+        time_ns = np.asarray(time_ns, dtype=np.int64)
+        data = np.asarray(data, dtype=self.dtype)
+        if not time_ns.shape[0]:
+            return []
+        if self.origin is None:
+            self.origin = int(time_ns[0])
+
+        time_seconds = (time_ns - self.origin) * (10 ** -9)
+        magnitude = np.empty(data.shape[1], dtype=self.dtype)
+        _magnitude(data, magnitude)
+
+        detections = []
+        written = scanned = 0
+        count = time_ns.shape[0]
+        while scanned < count:
+            fired = _scan_stream(
+                time_seconds[scanned:],
+                magnitude[scanned:],
+                self.state,
+                self.threshold,
+                self.refractory,
+                self.delay,
+                self.end_max + self.post_impact,
+            )
+            if fired < 0:
+                break
+            fired += scanned
+            # the window ends before the firing sample
+            self.__write(time_seconds[written:fired], data[:, written:fired], magnitude[written:fired])
+            written = fired
+            detection = self.__evaluate(
+                self.scanned + fired, int(time_ns[fired]), time_seconds[fired], received
+            )
+            self.fired = self.scanned + fired
+            if detection is not None:
+                detections.append(detection)
+            scanned = fired + 1
+
+        self.__write(time_seconds[written:], data[:, written:], magnitude[written:])
+        self.scanned += count
+        return detections
+
+
+def _percentiles(values: List[float], name: str) -> dict:
+    """
+    :return: 50th, 90th, 99th percentile and maximum of the values
+    """
+    if not values:
+        return {"{}_{}".format(name, key): np.nan for key in ("p50", "p90", "p99", "max")}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "{}_p50".format(name): p50,
+        "{}_p90".format(name): p90,
+        "{}_p99".format(name): p99,
+        "{}_max".format(name): np.max(values),
+    }
+
+
+def replay(
+    measurement: Union[str, DataCarrier],
+    speed: Optional[float] = None,
+    batch=REPLAY_BATCH,
+    detector: Optional[OnlineDetector] = None,
+) -> dict:
+    """
+    Feeds the accelerometer of the recording to the detector in batches as it would come from the phone
+    :param measurement: path to the folder with the measurement or loaded DataCarrier
+    :param speed: times of the real time, None to push the batches without waiting
+    :param batch: samples of one push
+    :param detector: detector of the stream, None for OnlineDetector with default settings
+    :return: dictionary with
+    detections - list of Detection,
+    report - samples, events, passed events, samples per second of the processing and wall time,
+    percentiles of the latency (seconds from the planned arrival of the firing sample to the evaluated event)
+    and of the delay (seconds of the stream from the peak to the firing sample)
+    The first event compiles the kernels, which are not in the cache - Compilation.warm_up before the replay
+    """
+    if isinstance(measurement, str):
+        measurement = DataCarrier(measurement)
+    acceleration = measurement.sensor_data[Consts.ACG]
+    detector = detector or OnlineDetector(dtype=acceleration.data.dtype)
+    time_ns, data = acceleration.time, acceleration.data
+
+    detections, latencies = [], []
+    processing = 0.0
+    started = time.perf_counter()
+    for begin in range(0, time_ns.shape[0], batch):
+        end = min(begin + batch, time_ns.shape[0])
+        # the batch is complete, when its last sample is measured
+        arrival = started
+        if speed is not None:
+            arrival += (time_ns[end - 1] - time_ns[0]) * (10 ** -9) / speed
+            remaining = arrival - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+        else:
+            arrival = time.perf_counter()
+
+        pushed = time.perf_counter()
+        fired = detector.push(time_ns[begin:end], data[:, begin:end])
+        processing += time.perf_counter() - pushed
+        for detection in fired:
+            latencies.append(detection.detected - arrival)
+        detections += fired
+    wall = time.perf_counter() - started
+
+    report = {
+        "samples": int(time_ns.shape[0]),
+        "events": len(detections),
+        "passed": sum(detection.gate is None for detection in detections),
+        "samples_per_second": time_ns.shape[0] / processing if processing else np.nan,
+        "wall_samples_per_second": time_ns.shape[0] / wall if wall else np.nan,
+    }
+    report.update(_percentiles(latencies, "latency"))
+    report.update(_percentiles([detection.delay for detection in detections], "delay"))
+    return {"detections": detections, "report": report}
+
+
+def detections_frame(detections: List[Detection]) -> pd.DataFrame:
+    """
+    :param detections: output of OnlineDetector.push / replay
+    :return: table with index, time, BOUNDARY_COLUMNS, delay, gate and latency of every detection
+    """
+    return pd.DataFrame(
+        [
+            [detection.index, detection.time_ns]
+            + detection.boundaries.tolist()
+            + [detection.delay, detection.gate, detection.latency]
+            for detection in detections
+        ],
+        columns=["index", "time"] + BOUNDARY_COLUMNS + ["delay", "gate", "latency"],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replays the recordings through the online fall detector"
+    )
+    parser.add_argument("paths", nargs="+", help="measurement folders")
+    parser.add_argument(
+        "--speed", type=float, help="times of the real time, without waiting if missing"
+    )
+    parser.add_argument("--batch", type=int, default=REPLAY_BATCH, help="samples of one push")
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="minimal seconds after the last indication"
+    )
+    parser.add_argument(
+        "--overlap", action="store_true", help="windows reach before the previous event as in find_events"
+    )
+    arguments = parser.parse_args()
+
+    # Compilation imports this module
+    from Compilation import warm_up
+
+    warm_up()
+    reports = []
+    for path in arguments.paths:
+        result = replay(
+            path,
+            arguments.speed,
+            arguments.batch,
+            OnlineDetector(delay=arguments.delay, overlap=arguments.overlap),
+        )
+        reports.append(dict(path=path, **result["report"]))
+        print(detections_frame(result["detections"]).to_string(index=False))
+    pd.set_option("display.width", 200)
+    print(pd.DataFrame(reports).to_string(index=False))
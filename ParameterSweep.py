@@ -0,0 +1,157 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from itertools import product
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from DataCarrier import DataCarrier
+from EventChecker import check_data_integrity_fall_detection, pick_array_of_interest
+from EventOfInterest import EventOfInterest
+from FeatureRegistry import calculate_selected_parameters
+
+# columns of the sweep table, which describe the recording and the picked event
+SWEEP_COLUMNS = [
+    "path",
+    "activity",
+    "threshold_ending",
+    "begin_max",
+    "end_max",
+    "begin_index",
+    "end_index",
+    "max_index",
+    "free_fall_end_index",
+    "valid",
+]
+
+
+def sweep_recording(
+    time_seconds: np.ndarray,
+    magnitude: np.ndarray,
+    acg_xyz: np.ndarray,
+    threshold_ending: Iterable[float] = (15,),
+    begin_max: Iterable[float] = (0.3,),
+    end_max: Iterable[float] = (0.7,),
+    features: Optional[List[str]] = None,
+) -> List[list]:
+    """
+    Evaluates the grid of thresholds for pick_array_of_interest on one recording.
+    Parameters are calculated only once for every unique event - combinations, which lead to the same
+    begin, end and free fall end, share the values.
+    :param time_seconds: time of the recording in seconds
+    :param magnitude: magnitude of acceleration 1D
+    :param acg_xyz: raw acceleration 3D
+    :param threshold_ending: values of threshold_ending to try
+    :param begin_max: values of begin_max to try
+    :param end_max: values of end_max to try
+    :param features: names of the parameters to calculate - None for all Consts.parameters_names
+    :return: rows with threshold_ending, begin_max, end_max, begin, end, max index, free fall end (-1 if None),
+    validity and parameters
+    """
+    if features is None:
+        features = Consts.parameters_names
+
+    rows = []
+    calculated = {}  # (begin, end, free fall end) -> parameters
+    for combination in product(threshold_ending, begin_max, end_max):
+        picked = pick_array_of_interest(time_seconds, magnitude, *combination)
+        if picked is None:
+            rows.append(
+                [*combination, -1, -1, -1, -1, False]
+                + [np.nan] * len(features)
+            )
+            continue
+
+        event_time, event_magnitude, begin, end, max_index, free_fall_end = picked
+        key = (begin, end, free_fall_end)
+        if key not in calculated:
+            calculated[key] = calculate_selected_parameters(
+                features,
+                time_seconds,
+                magnitude,
+                acg_xyz,
+                EventOfInterest(
+                    event_time, event_magnitude, begin, end, max_index, free_fall_end
+                ),
+            )
+
+        parameters = calculated[key]
+        rows.append(
+            [
+                *combination,
+                begin,
+                end,
+                max_index,
+                -1 if free_fall_end is None else free_fall_end,
+                parameters is not None,
+            ]
+            + (list(parameters) if parameters is not None else [np.nan] * len(features))
+        )
+    return rows
+
+
+def sweep_event_boundaries(
+    paths: Iterable[str],
+    threshold_ending: Iterable[float] = (15,),
+    begin_max: Iterable[float] = (0.3,),
+    end_max: Iterable[float] = (0.7,),
+    features: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Grid search over the boundaries of the event - every recording is loaded, validated and
+    converted to magnitude / time in seconds only once, then all the combinations of thresholds are evaluated.
+    Recordings, which do not pass check_data_integrity_fall_detection, are left out.
+    :param paths: paths to folders with measurements
+    :param threshold_ending: values of threshold_ending to try
+    :param begin_max: values of begin_max to try
+    :param end_max: values of end_max to try
+    :param features: names of the parameters to calculate - None for all Consts.parameters_names
+    :return: tidy table - one row per (recording, combination of thresholds) with SWEEP_COLUMNS and parameters
+    """
+    if features is None:
+        features = Consts.parameters_names
+
+    threshold_ending, begin_max, end_max = (
+        list(threshold_ending),
+        list(begin_max),
+        list(end_max),
+    )
+
+    rows = []
+    for path in paths:
+        data_carrier = DataCarrier(path, read_only=[Consts.ACG])
+        if not check_data_integrity_fall_detection(data_carrier, pick_event=False):
+            continue
+
+        acceleration = data_carrier.sensor_data[Consts.ACG]
+        for row in sweep_recording(
+            acceleration.modified[Consts.TIME_SECONDS],
+            acceleration.modified[Consts.MAGNITUDE],
+            acceleration.data,
+            threshold_ending,
+            begin_max,
+            end_max,
+            features,
+        ):
+            rows.append([path, data_carrier.activity_type] + row)
+
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS + list(features))
@@ -19,16 +19,33 @@
 
 from Consts import Consts
 
-from typing import Optional
+from typing import Optional, Tuple
 from numba import njit
 
 import numpy as np
 import warnings
 
 from DataCarrier import DataCarrier
+from EventChecker import find_events, gate_events, window_event
 from EventOfInterest import EventOfInterest
-
-
+from Profiling import profiled, measure
+
+# positions of the statistics in the output of _moments
+_MEAN = 0
+_M2 = 1
+_M3 = 2
+_M4 = 3
+_D1_VAR = 4
+_D2_VAR = 5
+_D1_ABS_MEAN = 6
+_OUTPUT = 7
+_TKEO = 8
+_MAX = 9
+_MIN = 10
+_N_MOMENTS = 11
+
+
+@profiled()
 def basic_stats(event_magnitude: np.ndarray) -> np.ndarray:
     """
     Calculates all the basic statistics from magnitude of the event
@@ -36,14 +53,16 @@ def basic_stats(event_magnitude: np.ndarray) -> np.ndarray:
     :return: average, standard deviation, variance / activity, mobility, complexity,average tkeo, average output,
     entropy, wavelet length, crest factor
     """
-    avg = np.mean(event_magnitude)
-    deviation = np.std(event_magnitude)
-    variance, mobility, complexity = hjorth_params(event_magnitude)
-    tkeo = avg_tkeo(event_magnitude)
-    output = avg_output(event_magnitude)
-    entropy = ApEn(event_magnitude, 10, 3)
-    wave = waveform_length(event_magnitude)
-    crest = crest_factor(event_magnitude)
+    with measure("moments", event_magnitude):
+        moments = _moments(event_magnitude)
+    avg = moments[_MEAN]
+    deviation = np.sqrt(moments[_M2])
+    variance, mobility, complexity = _hjorth_from_moments(moments)
+    tkeo = moments[_TKEO]
+    output = moments[_OUTPUT]
+    entropy = ApEn(event_magnitude, 10, 3, sort_templates=True)
+    wave = moments[_D1_ABS_MEAN]
+    crest = _crest_from_moments(moments)
     return np.array(
         [
             avg,
@@ -60,6 +79,7 @@ def basic_stats(event_magnitude: np.ndarray) -> np.ndarray:
     )
 
 
+@profiled()
 def calculate_acg_parameters(
     time_seconds: np.ndarray,
     magnitude: np.ndarray,
@@ -84,14 +104,16 @@ def calculate_acg_parameters(
     if change_in_angle_cos_value is None:
         return None
 
-    with warnings.catch_warnings():
+    with warnings.catch_warnings(), measure("ad", acg_xyz):
         warnings.filterwarnings("ignore", category=RuntimeWarning)
         angle_deviation = ad(acg_xyz)
     ffi = free_fall_index(magnitude, event_holder)
     mm = minmax(event_holder.event_magnitude)
     ratio = ratio_3g(event_holder.get_from_free_fall)
-    kurt = kurtosis(event_holder.get_from_free_fall)
-    skew = skewness(event_holder.get_from_free_fall)
+    with measure("kurtosis_skewness", event_holder.get_from_free_fall):
+        moments_free_fall = _moments(event_holder.get_from_free_fall)
+        kurt = moments_free_fall[_M4] / np.power(moments_free_fall[_M2], 2)
+        skew = moments_free_fall[_M3] / np.power(moments_free_fall[_M2], 1.5)
     one_g_crosses = g_cross_rate(event_holder.get_from_free_fall, threshold=9.25)
 
     return np.append(
@@ -127,6 +149,40 @@ def calculate_acg_parameters_data_carrier(data: DataCarrier) -> Optional[np.ndar
     )
 
 
+def calculate_acg_parameters_recording(
+    data: DataCarrier, **gates
+) -> Tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Parameters of all the events of long recording, e.g. from real life - find_events picks the events,
+    gate_events drops the ones, which do not need the parameters, calculate_acg_parameters runs only for the rest
+    :param data: DataCarrier with ACG data
+    :param gates: thresholds of gate_events
+    :return: matrix events x Consts.parameters_names, boundaries of the rows (BOUNDARY_COLUMNS) and counters of
+    gate_events with events without parameters under "parameters"
+    """
+    acceleration = data.sensor_data[Consts.ACG]
+    time_seconds, magnitude = acceleration.time_seconds, acceleration.magnitude
+
+    boundaries = find_events(time_seconds, magnitude)
+    passed, counters = gate_events(time_seconds, magnitude, boundaries, **gates)
+
+    rows, kept = [], []
+    for row in boundaries[passed]:
+        window, event = window_event(time_seconds, magnitude, row)
+        parameters = calculate_acg_parameters(
+            time_seconds[window], magnitude[window], acceleration.data[:, window], event
+        )
+        if parameters is not None:
+            rows.append(parameters)
+            kept.append(row)
+    counters["parameters"] = counters["passed"] - len(rows)
+    counters["passed"] = len(rows)
+
+    matrix = np.vstack(rows) if rows else np.empty((0, len(Consts.parameters_names)))
+    return matrix, np.array(kept, dtype=np.int64).reshape(-1, boundaries.shape[1]), counters
+
+
+@profiled()
 def change_in_angle(sensor_values: np.ndarray) -> float:
     """
     authors: SANTOYO-RAMÓN, José Antonio, Eduardo CASILARI and José Manue CANO-GARCÍA
@@ -140,7 +196,7 @@ def change_in_angle(sensor_values: np.ndarray) -> float:
     return np.mean(np.linalg.norm(sensor_values[[0, 2], :], axis=0))
 
 
-@njit()
+@njit(cache=True)
 def ad(values: np.ndarray) -> float:
     """
     authors: FIGUEIREDO, Isabel N., Carlos LEAL, Luís PINTO, Jason BOLITO a André LEMOS.
@@ -153,6 +209,7 @@ def ad(values: np.ndarray) -> float:
     summation: float = 0
     passed: int = 0
 
+    # np.linalg.norm and dot are kept - their rounding decides, which samples give nan and are skipped
     previous_norm = np.linalg.norm(values[:, 0])
     for v in range(values.shape[1] - 1):
         new_norm = np.linalg.norm(values[:, v + 1])
@@ -171,6 +228,7 @@ def ad(values: np.ndarray) -> float:
     return summation / (float(values.shape[1] - 1 - passed))
 
 
+@profiled()
 def before_and_after_fall(
     time_seconds: np.ndarray,
     acg_xyz: np.ndarray,
@@ -185,38 +243,81 @@ def before_and_after_fall(
     :param end_index: ending of the event
     :return: 2 arrays with acg samples
     """
-    time_begin_before_index = None
-    time_end_before_index = begin_index - 1
+    (
+        time_begin_before_index,
+        time_end_before_index,
+        time_begin_after_index,
+        time_end_after_index,
+    ) = _window_indexes(time_seconds, begin_index, end_index)
 
-    time_begin_after_index = end_index + 1
-    time_end_after_index = None
+    return (
+        acg_xyz[:, time_begin_before_index:time_end_before_index],
+        acg_xyz[:, time_begin_after_index:time_end_after_index],
+    )
 
-    # searching for the beginning
-    for i in range(time_end_before_index, 0, -1):
-        if np.abs(time_seconds[time_end_before_index] - time_seconds[i]) >= 1:
-            time_begin_before_index = i
-            break
 
-    if time_begin_before_index is None:
-        time_begin_before_index = 0
+@njit(cache=True)
+def _window_indexes(
+    time_seconds: np.ndarray, begin_index: int, end_index: int
+) -> Tuple[int, int, int, int]:
+    """
+    Indexes of 1s windows before and after the event found by binary search on monotonic time.
+    Position from np.searchsorted is corrected by the original condition |t[a] - t[b]| >= 1,
+    so the rounding of the time does not move the borders.
+    :param time_seconds: 1D time series in seconds - monotonic
+    :param begin_index: beginning of the event
+    :param end_index: ending of the event
+    :return: begin and end of the window before the event, begin and end of the window after the event
+    """
+    n = time_seconds.shape[0]
 
-    # searching for the end
-    for i in range(time_begin_after_index, len(time_seconds)):
-        if np.abs(time_seconds[time_begin_after_index] - time_seconds[i]) >= 1:
-            time_end_after_index = i
-            break
+    # the closest sample at least 1s before the sample preceding the event, index 0 is never picked
+    time_begin_before_index = 0
+    time_end_before_index = begin_index - 1
+    if 1 <= time_end_before_index < n:
+        reference = time_seconds[time_end_before_index]
+        i = (
+            np.searchsorted(
+                time_seconds[: time_end_before_index + 1], reference - 1, side="right"
+            )
+            - 1
+        )
+        while (
+            i < time_end_before_index
+            and np.abs(reference - time_seconds[i + 1]) >= 1
+        ):
+            i += 1
+        while i >= 1 and not np.abs(reference - time_seconds[i]) >= 1:
+            i -= 1
+        if i >= 1:
+            time_begin_before_index = i
 
-    if time_begin_before_index is None:
-        time_begin_before_index = 0
-    if time_end_after_index is None:
-        time_end_after_index = len(time_seconds)
+    # the first sample at least 1s after the sample following the event
+    time_begin_after_index = end_index + 1
+    time_end_after_index = n
+    if time_begin_after_index < n:
+        reference = time_seconds[time_begin_after_index]
+        i = time_begin_after_index + np.searchsorted(
+            time_seconds[time_begin_after_index:], reference + 1, side="left"
+        )
+        while (
+            i > time_begin_after_index
+            and np.abs(reference - time_seconds[i - 1]) >= 1
+        ):
+            i -= 1
+        while i < n and not np.abs(reference - time_seconds[i]) >= 1:
+            i += 1
+        time_end_after_index = i
 
     return (
-        acg_xyz[:, time_begin_before_index:time_end_before_index],
-        acg_xyz[:, time_begin_after_index:time_end_after_index],
+        time_begin_before_index,
+        time_end_before_index,
+        time_begin_after_index,
+        time_end_after_index,
     )
 
 
+@profiled()
 def change_in_angle_cos(
     time_seconds: np.ndarray,
     acg_xyz: np.ndarray,
@@ -252,6 +353,7 @@ def change_in_angle_cos(
     return np.degrees(np.arccos((aa.dot(ab)) / (acca * accb)))
 
 
+@profiled()
 def free_fall_index(values_acg: np.array, event_of_interest: EventOfInterest) -> float:
     """
     authors: ABBATE, Stefano, Marco AVVENUTI, Guglielmo COLA, Paolo CORSINI, Janet LIGHT a Alessio VECCHIO.
@@ -272,15 +374,18 @@ def free_fall_index(values_acg: np.array, event_of_interest: EventOfInterest) ->
     )
 
 
+@profiled()
 def minmax(magnitude: np.ndarray) -> float:
     """
     difference minimum between maximum value
     :param magnitude: 1D array of magnitude
     :return: float
     """
-    return np.max(magnitude) - np.min(magnitude)
+    moments = _moments(magnitude)
+    return moments[_MAX] - moments[_MIN]
 
 
+@profiled()
 def ratio_3g(magnitude: np.ndarray, threshold=30) -> float:
     """
     Ratio of samples above 3g and below
@@ -291,6 +396,7 @@ def ratio_3g(magnitude: np.ndarray, threshold=30) -> float:
     return np.sum(magnitude > threshold) / np.sum(magnitude < threshold)
 
 
+@profiled()
 def kurtosis(magnitude: np.ndarray) -> float:
     """
     Kurtosis of the magnitude - 4. standardized moment
@@ -300,9 +406,11 @@ def kurtosis(magnitude: np.ndarray) -> float:
     :param magnitude: 1D magnitude of acceleration
     :return: kurtosis float
     """
-    return momentum(magnitude, 4) / np.power(momentum(magnitude, 2), 2)
+    moments = _moments(magnitude)
+    return moments[_M4] / np.power(moments[_M2], 2)
 
 
+@profiled()
 def skewness(magnitude: np.ndarray) -> float:
     """
     Skewness of the magnitude - 3. standardized moment
@@ -312,9 +420,11 @@ def skewness(magnitude: np.ndarray) -> float:
     :param magnitude: 1D magnitude of acceleration
     :return: kurtosis float
     """
-    return momentum(magnitude, 3) / np.power(momentum(magnitude, 2), 1.5)
+    moments = _moments(magnitude)
+    return moments[_M3] / np.power(moments[_M2], 1.5)
 
 
+@profiled()
 def momentum(magnitude: np.ndarray, moment=2) -> float:
     """
     Moment calculation for skewness and kurtosis
@@ -325,10 +435,125 @@ def momentum(magnitude: np.ndarray, moment=2) -> float:
     :param moment: degree of moment 2,3,4,...
     :return: moment as float
     """
-    avg = np.mean(magnitude)
-    return np.mean([np.power(m - avg, moment) for m in magnitude])
+    if moment in (2, 3, 4):
+        return _moments(magnitude)[_M2 + moment - 2]
+    return np.mean(np.power(magnitude - np.mean(magnitude), moment))
+
+
+@njit(cache=True, error_model="numpy")
+def _moments(magnitude: np.ndarray) -> np.ndarray:
+    """
+    Fused kernel for all moment and derivative based statistics - one pass through the signal without
+    temporary arrays. Central moments are updated online (Welford / Terriberry) for the signal, its first and
+    second differential.
+    resource:
+    https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Higher-order_statistics
+    :param magnitude: 1D array of acceleration
+    :return: array indexed by _MEAN, _M2, _M3, _M4 (central moments), _D1_VAR, _D2_VAR (variance of differentials),
+    _D1_ABS_MEAN (waveform length), _OUTPUT (average output), _TKEO (average TKEO), _MAX, _MIN
+    """
+    n = magnitude.shape[0]
+    result = np.full(_N_MOMENTS, np.nan)
+    if n == 0:
+        return result
+
+    mean = 0.0
+    m2 = 0.0
+    m3 = 0.0
+    m4 = 0.0
+
+    d1_mean = 0.0
+    d1_m2 = 0.0
+    d1_abs = 0.0
+    d2_mean = 0.0
+    d2_m2 = 0.0
+
+    squares = 0.0
+    tkeo = 0.0
+    maximum = magnitude[0]
+    minimum = magnitude[0]
+
+    previous = 0.0
+    previous_2 = 0.0
+    previous_d1 = 0.0
+
+    for i in range(n):
+        value = magnitude[i]
+
+        # central moments up to the 4th
+        k = i + 1.0
+        delta = value - mean
+        delta_n = delta / k
+        delta_n2 = delta_n * delta_n
+        term = delta * delta_n * i
+        mean += delta_n
+        m4 += term * delta_n2 * (k * k - 3 * k + 3) + 6 * delta_n2 * m2 - 4 * delta_n * m3
+        m3 += term * delta_n * (k - 2) - 3 * delta_n * m2
+        m2 += term
+
+        squares += value * value
+        if value > maximum:
+            maximum = value
+        if value < minimum:
+            minimum = value
+
+        # first differential
+        if i >= 1:
+            d1 = value - previous
+            delta = d1 - d1_mean
+            d1_mean += delta / i
+            d1_m2 += delta * (d1 - d1_mean)
+            d1_abs += abs(d1)
+
+            # second differential and TKEO of the previous sample
+            if i >= 2:
+                d2 = d1 - previous_d1
+                delta = d2 - d2_mean
+                d2_mean += delta / (i - 1)
+                d2_m2 += delta * (d2 - d2_mean)
+                tkeo += previous * previous + previous_2 * value
+
+            previous_d1 = d1
+
+        previous_2 = previous
+        previous = value
+
+    result[_MEAN] = mean
+    result[_M2] = m2 / n
+    result[_M3] = m3 / n
+    result[_M4] = m4 / n
+    result[_D1_VAR] = d1_m2 / (n - 1)
+    result[_D2_VAR] = d2_m2 / (n - 2)
+    result[_D1_ABS_MEAN] = d1_abs / (n - 1)
+    result[_OUTPUT] = squares / n
+    result[_TKEO] = tkeo / (n - 2.0)
+    result[_MAX] = maximum
+    result[_MIN] = minimum
+    return result
+
+
+def _hjorth_from_moments(moments: np.ndarray) -> np.ndarray:
+    """
+    Hjorth descriptors from the output of _moments
+    :param moments: output of _moments
+    :return: array of activity, mobility, complexity
+    """
+    activity = moments[_M2]
+    mobility = np.sqrt(moments[_D1_VAR] / activity)
+    complexity = np.sqrt(moments[_D2_VAR] / mobility)
+    return np.array([activity, mobility, complexity])
+
+
+def _crest_from_moments(moments: np.ndarray) -> float:
+    """
+    Crest factor from the output of _moments
+    :param moments: output of _moments
+    :return: crest factor float
+    """
+    return np.abs(moments[_MAX]) / np.sqrt(moments[_OUTPUT])
 
 
+@profiled()
 def hjorth_params(magnitude: np.ndarray) -> np.ndarray:
     """
     author: HJORT, Bo
@@ -339,17 +564,10 @@ def hjorth_params(magnitude: np.ndarray) -> np.ndarray:
     :param magnitude: of acceleration
     :return: array of activity, mobility, complexity
     """
-    activity = np.var(magnitude)
-
-    d1 = np.diff(magnitude)
-    mobility = np.sqrt(np.var(d1) / activity)
-
-    d2 = np.diff(d1)
-    complexity = np.sqrt(np.var(d2) / mobility)
-
-    return np.array([activity, mobility, complexity])
+    return _hjorth_from_moments(_moments(magnitude))
 
 
+@profiled()
 def avg_tkeo(magnitude: np.ndarray) -> float:
     """
     author: MARAGOS, P., J.F. KAISER a T.F. QUATIERI
@@ -360,24 +578,88 @@ def avg_tkeo(magnitude: np.ndarray) -> float:
     :param magnitude: 1D acceleration as magnitude
     :return: averaged TKEO as float
     """
-    return np.sum(
-        [
-            np.power(magnitude[i], 2) + (magnitude[i - 1] * magnitude[i + 1])
-            for i in range(1, magnitude.shape[0] - 1)
-        ]
-    ) / (float(magnitude.shape[0]) - 2)
+    return _moments(magnitude)[_TKEO]
 
 
+@profiled()
 def avg_output(magnitude: np.ndarray) -> float:
     """
     Power of 2 for whole input, which is averaged
     :param magnitude: acceleration magnitude
     :return: averaged float
     """
-    return np.mean([np.power(i, 2) for i in magnitude])
+    return _moments(magnitude)[_OUTPUT]
 
 
-def ApEn(magnitude: np.ndarray, m: int, r: float) -> float:
+@njit(cache=True)
+def _template_matches(magnitude: np.ndarray, m: int, r: float, sort_templates: bool):
+    """
+    Counts Chebyshev neighbours of every template of length m and m + 1 in one pass over the pairs of templates.
+    The distance of m + 1 templates is derived from the distance of m templates by checking only the last sample.
+    With sort_templates, templates are visited in order of their first sample, so only templates within r
+    of each other on the first coordinate are compared - sub-quadratic for signals with spread higher than r
+    :param magnitude: 1D array of values
+    :param m: length of compared data
+    :param r: filtering level
+    :param sort_templates: use sorted neighbour search instead of all pairs
+    :return: neighbour counts of m templates, neighbour counts of m + 1 templates (self-matches included),
+    number of matched pairs of m templates, which can be extended to m + 1, number of matched pairs of m + 1 templates
+    """
+    n = magnitude.shape[0]
+    n_m = max(n - m + 1, 0)  # number of templates with length m
+    n_m1 = max(n - m, 0)  # number of templates with length m + 1
+
+    counts_m = np.zeros(n_m)
+    counts_m1 = np.zeros(n_m1)
+    pairs_m = 0
+    pairs_m1 = 0
+
+    # self-match of the template - only templates without NaN / inf match themselves
+    for i in range(n_m):
+        if np.all(np.isfinite(magnitude[i : i + m])):
+            counts_m[i] = 1
+            if i < n_m1 and np.isfinite(magnitude[i + m]):
+                counts_m1[i] = 1
+
+    if sort_templates:
+        order = np.argsort(magnitude[:n_m], kind="mergesort")
+    else:
+        order = np.arange(n_m)
+
+    for a in range(n_m):
+        i = order[a]
+        for b in range(a + 1, n_m):
+            j = order[b]
+
+            # first samples are sorted - no other template can be closer than r
+            if sort_templates and magnitude[j] - magnitude[i] > r:
+                break
+
+            # Chebyshev distance with early exit - "not <=" keeps NaN as a mismatch
+            matched = True
+            for k in range(m):
+                if not abs(magnitude[i + k] - magnitude[j + k]) <= r:
+                    matched = False
+                    break
+            if not matched:
+                continue
+
+            counts_m[i] += 1
+            counts_m[j] += 1
+
+            # reuse of the m template distance for the m + 1 template
+            if i < n_m1 and j < n_m1:
+                pairs_m += 1
+                if abs(magnitude[i + m] - magnitude[j + m]) <= r:
+                    pairs_m1 += 1
+                    counts_m1[i] += 1
+                    counts_m1[j] += 1
+
+    return counts_m, counts_m1, pairs_m, pairs_m1
+
+
+@profiled()
+def ApEn(magnitude: np.ndarray, m: int, r: float, sort_templates=False) -> float:
     """
     An approximate entropy (ApEn) is a technique used to quantify the amount of regularity and the
     unpredictability of fluctuations over time-series data
@@ -385,41 +667,63 @@ def ApEn(magnitude: np.ndarray, m: int, r: float) -> float:
     :param magnitude: 1D array of values
     :param m: length of compared data
     :param r: filtering level
+    :param sort_templates: compares only templates with close first samples - faster for long signals
     :return: entropy as float
     """
-    #
 
-    def __maxdist(x_i, x_j):
-        return np.max([np.abs(ua - va) for ua, va in zip(x_i, x_j)])
-
-    def __phi(m: int):
-        x = [[magnitude[j] for j in range(i, i + m - 1 + 1)] for i in range(N - m + 1)]
-        C = [
-            len([1 for x_j in x if __maxdist(x_i, x_j) <= r]) / (N - m + 1.0)
-            for x_i in x
-        ]
+    def __phi(counts: np.ndarray, m: int):
         nm = N - m
         if nm == 0:
             nm = 1
 
-        return nm ** (-1) * np.sum(np.log(C))
+        return nm ** (-1) * np.sum(np.log(counts / (N - m + 1.0)))
 
     if r <= 0:
         raise ValueError("Must be positive real number")
     N = magnitude.shape[0]
 
-    return np.abs(__phi(m + 1) - __phi(m)) / N
+    counts_m, counts_m1, _, _ = _template_matches(
+        np.ascontiguousarray(magnitude), m, r, sort_templates
+    )
+    return np.abs(__phi(counts_m1, m + 1) - __phi(counts_m, m)) / N
+
+
+@profiled()
+def SampEn(magnitude: np.ndarray, m: int, r: float, sort_templates=False) -> float:
+    """
+    A sample entropy (SampEn) is a modification of ApEn, which does not count self-matches
+    and does not depend on the length of the data
+    Resource: https://en.wikipedia.org/wiki/Sample_entropy
+    :param magnitude: 1D array of values
+    :param m: length of compared data
+    :param r: filtering level
+    :param sort_templates: compares only templates with close first samples - faster for long signals
+    :return: entropy as float - inf if no template of length m + 1 matches
+    """
+    if r <= 0:
+        raise ValueError("Must be positive real number")
+
+    # pairs i < j are counted directly - templates with NaN / inf have no self-match in counts_m1
+    _, _, pairs_m, pairs_m1 = _template_matches(
+        np.ascontiguousarray(magnitude), m, r, sort_templates
+    )
+
+    if pairs_m1 == 0:
+        return np.inf
+    return -np.log(pairs_m1 / pairs_m)
 
 
+@profiled()
 def waveform_length(amplitude: np.ndarray) -> float:
     """
     First differential with absolute value, which is averaged through whole signal
     :param amplitude: 1D array
     :return: waveform length - float
     """
-    return np.average(np.abs(np.diff(amplitude)))
+    return _moments(amplitude)[_D1_ABS_MEAN]
 
 
+@profiled()
 def crest_factor(amplitude: np.ndarray) -> float:
     """
     Peak value / RMS - root mean square - comparison of peak value to RMS
@@ -427,11 +731,10 @@ def crest_factor(amplitude: np.ndarray) -> float:
     :param amplitude: 1D array
     :return: crest factor float
     """
-    return np.abs(np.max(amplitude)) / np.sqrt(
-        np.sum(amplitude ** 2) / amplitude.shape[0]
-    )
+    return _crest_from_moments(_moments(amplitude))
 
 
+@profiled()
 def g_cross_rate(magnitude, threshold=9.25) -> int:
     """
     Number of crosses through specific threshold
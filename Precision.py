@@ -0,0 +1,72 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from contextlib import contextmanager
+
+import numpy as np
+
+# floating types of the sensor values - float32 halves the memory of raw data and magnitude
+DTYPES = [np.dtype(np.float64), np.dtype(np.float32)]
+
+
+class Precision:
+    def __init__(self):
+        """
+        Floating type of the sensor data, magnitude and arrays computed from them - float64 by default.
+        Time is kept in int64 nanoseconds and float64 seconds in both modes, because float32 seconds lose
+        the resolution of the samples after few hours. Accumulators of the numba kernels are float64 in both modes.
+        """
+        self.dtype = DTYPES[0]
+
+    def set(self, dtype):
+        """
+        :param dtype: np.float64 or np.float32
+        """
+        self.dtype = self.resolve(dtype)
+
+    def reset(self):
+        self.dtype = DTYPES[0]
+
+    def resolve(self, dtype=None) -> np.dtype:
+        """
+        :param dtype: type requested for one DataCarrier, None for the global type
+        :return: valid floating type
+        """
+        if dtype is None:
+            return self.dtype
+        dtype = np.dtype(dtype)
+        if dtype not in DTYPES:
+            raise ValueError("Unsupported precision {}".format(dtype))
+        return dtype
+
+    @contextmanager
+    def use(self, dtype):
+        """
+        Global type only within the block - with precision.use(np.float32): ...
+        :param dtype: np.float64 or np.float32
+        """
+        previous = self.dtype
+        self.set(dtype)
+        try:
+            yield self
+        finally:
+            self.dtype = previous
+
+
+# precision shared by the whole project
+precision = Precision()
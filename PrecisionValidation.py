@@ -0,0 +1,164 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Iterable, List, Optional
+
+import argparse
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from DatasetExtraction import STATUS_OK, extract_dataset
+from MeasurementCache import measurement_folders
+
+DEVIATION_COLUMNS = ["feature", "max_abs_deviation", "max_rel_deviation", "path"]
+
+
+def feature_deviations(
+    reference: np.ndarray, reduced: np.ndarray, paths: np.ndarray
+) -> pd.DataFrame:
+    """
+    Deviation of every feature - nan / inf in only one of the modes is infinite deviation, so it is never skipped
+    :param reference: features in float64 (folders x Consts.parameters_names)
+    :param reduced: features in float32 of the same folders
+    :param paths: folder of every row
+    :return: table with DEVIATION_COLUMNS, one row per feature, path of the largest relative deviation
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deviation = np.abs(reference - reduced)
+        relative = deviation / np.abs(reference)
+    # the same non-finite value in both modes is not a deviation
+    same = (reference == reduced) | (np.isnan(reference) & np.isnan(reduced))
+    deviation[same] = 0
+    relative[same] = 0
+    # nan / inf in only one mode - e.g. overflow of float32 - is the failure, which has to be reported
+    mismatched = ~same & ~(np.isfinite(reference) & np.isfinite(reduced))
+    deviation[mismatched] = np.inf
+    relative[mismatched] = np.inf
+
+    rows = []
+    for column, name in enumerate(Consts.parameters_names):
+        column_relative = relative[:, column]
+        if np.all(np.isnan(column_relative)):
+            rows.append([name, np.nan, np.nan, None])
+            continue
+        worst = int(np.nanargmax(column_relative))
+        rows.append(
+            [
+                name,
+                np.nanmax(deviation[:, column]),
+                column_relative[worst],
+                paths[worst],
+            ]
+        )
+    return pd.DataFrame(rows, columns=DEVIATION_COLUMNS)
+
+
+def compare_precision(
+    paths: Iterable[str],
+    model=None,
+    features: Optional[List[str]] = None,
+    processes: Optional[int] = 1,
+) -> dict:
+    """
+    Extracts the dataset in float64 and float32 and compares the results
+    :param paths: paths to folders with the measurements
+    :param model: trained classifier with predict method, e.g. pickled model from Research.ipynb - None for no model
+    :param features: names from Consts.parameters_names in order of the columns of the model - None for all
+    :param processes: number of worker processes for extract_dataset
+    :return: dictionary with
+    deviations - table with DEVIATION_COLUMNS, one row per feature, path of the largest relative deviation,
+    status - folders with different status / detail in both modes,
+    predictions - folders with changed prediction of the model (path, float64, float32), empty without model,
+    compared - number of folders valid in both modes
+    """
+    paths = list(paths)
+    matrix_64, _, status_64 = extract_dataset(paths, processes, dtype=np.float64)
+    matrix_32, _, status_32 = extract_dataset(paths, processes, dtype=np.float32)
+
+    status = status_64.merge(status_32, on="path", suffixes=("_64", "_32"))
+    changed = status[
+        (status["status_64"] != status["status_32"])
+        | (status["detail_64"].fillna("") != status["detail_32"].fillna(""))
+    ]
+
+    valid = status[(status["status_64"] == STATUS_OK) & (status["status_32"] == STATUS_OK)]
+    reference = matrix_64[valid["row_64"].values]
+    reduced = matrix_32[valid["row_32"].values]
+
+    predictions = pd.DataFrame(columns=["path", "float64", "float32"])
+    if model is not None and valid.shape[0]:
+        columns = [
+            Consts.parameters_names.index(name)
+            for name in (features or Consts.parameters_names)
+        ]
+        predicted_64 = model.predict(reference[:, columns])
+        predicted_32 = model.predict(reduced[:, columns])
+        differs = predicted_64 != predicted_32
+        predictions = pd.DataFrame(
+            {
+                "path": valid["path"].values[differs],
+                "float64": predicted_64[differs],
+                "float32": predicted_32[differs],
+            }
+        )
+
+    return {
+        "deviations": feature_deviations(reference, reduced, valid["path"].values),
+        "status": changed[["path", "status_64", "detail_64", "status_32", "detail_32"]],
+        "predictions": predictions,
+        "compared": int(valid.shape[0]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares features and predictions of float64 and float32 processing"
+    )
+    parser.add_argument("paths", nargs="+", help="measurement folders or their roots")
+    parser.add_argument("--model", help="pickled classifier")
+    parser.add_argument(
+        "--features", nargs="+", help="features of the model from Consts.parameters_names"
+    )
+    parser.add_argument("--processes", type=int, default=1, help="worker processes")
+    arguments = parser.parse_args()
+
+    classifier = None
+    if arguments.model is not None:
+        with open(arguments.model, "rb") as file:
+            classifier = pickle.load(file)
+
+    report = compare_precision(
+        measurement_folders(arguments.paths),
+        classifier,
+        arguments.features,
+        arguments.processes,
+    )
+    pd.set_option("display.width", 200)
+    print("Compared folders: {}".format(report["compared"]))
+    print(report["deviations"].to_string(index=False))
+    print("Changed status: {}".format(report["status"].shape[0]))
+    if report["status"].shape[0]:
+        print(report["status"].to_string(index=False))
+    if classifier is not None:
+        print("Changed predictions: {}".format(report["predictions"].shape[0]))
+        if report["predictions"].shape[0]:
+            print(report["predictions"].to_string(index=False))
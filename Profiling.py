@@ -0,0 +1,230 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from functools import wraps
+from typing import Callable, Optional
+
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+class Profiler:
+    def __init__(self):
+        """
+        Collects wall time, number of calls and length of inputs for instrumented functions.
+        Disabled by default - instrumented functions only check the enabled flag then.
+        """
+        self.enabled = False
+        self.trace = False
+        self.stats = {}  # name -> [calls, total time, total length, max time]
+        self.events = []  # (name, start, duration, length, thread) for Chrome trace
+        self.origin = time.perf_counter()
+
+    def enable(self, trace=False):
+        """
+        :param trace: store every call for Chrome trace too - memory grows with number of calls
+        """
+        self.trace = trace
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.stats = {}
+        self.events = []
+        self.origin = time.perf_counter()
+
+    def record(self, name: str, start: float, duration: float, length: Optional[int]):
+        """
+        :param name: name of the measured part
+        :param start: perf_counter at the beginning
+        :param duration: wall time in seconds
+        :param length: length of the input or None
+        """
+        record = self.stats.get(name)
+        if record is None:
+            record = self.stats[name] = [0, 0.0, 0, 0.0]
+        record[0] += 1
+        record[1] += duration
+        record[2] += length or 0
+        record[3] = max(record[3], duration)
+
+        if self.trace:
+            self.events.append(
+                (name, start, duration, length, threading.get_ident())
+            )
+
+    def summary(self) -> pd.DataFrame:
+        """
+        :return: table of measured parts sorted by total time - times are inclusive of nested parts
+        """
+        rows = [
+            [
+                name,
+                calls,
+                total,
+                total / calls * 1000,
+                maximum * 1000,
+                length / calls,
+            ]
+            for name, (calls, total, length, maximum) in self.stats.items()
+        ]
+        return (
+            pd.DataFrame(
+                rows,
+                columns=[
+                    "name",
+                    "calls",
+                    "total_s",
+                    "mean_ms",
+                    "max_ms",
+                    "mean_length",
+                ],
+            )
+            .sort_values("total_s", ascending=False)
+            .reset_index(drop=True)
+        )
+
+    def save_chrome_trace(self, path: str):
+        """
+        Stores the calls in Chrome trace format - open in chrome://tracing or https://ui.perfetto.dev
+        :param path: path to the json file
+        """
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": thread,
+                "args": {"length": length},
+            }
+            for name, start, duration, length, thread in self.events
+        ]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events}, file)
+
+
+# profiler shared by the whole project
+profiler = Profiler()
+
+
+def input_length(value) -> Optional[int]:
+    """
+    Length of the input, which is recorded with the time
+    :param value: numpy array - last dimension (samples), path to file - size in bytes, path to folder - number
+    of files in it (e.g. csv files of the measurement), sized object - length
+    :return: length or None
+    """
+    if hasattr(value, "shape"):
+        return value.shape[-1] if len(value.shape) else 1
+    if isinstance(value, str):
+        if os.path.isfile(value):
+            return os.path.getsize(value)
+        if os.path.isdir(value):
+            return sum(os.path.isfile(os.path.join(value, name)) for name in os.listdir(value))
+        return None
+    if hasattr(value, "__len__"):
+        return len(value)
+    return None
+
+
+def profiled(name: Optional[str] = None, argument=0) -> Callable:
+    """
+    Decorator, which measures the function, when the profiler is enabled
+    Do not use on numba functions - they have to stay callable from other compiled functions, use measure instead
+    :param name: name in the report - name of the function by default
+    :param argument: position of the argument, which length is recorded - e.g. 1 for methods
+    :return: decorated function
+    """
+
+    def decorator(function: Callable) -> Callable:
+        label = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(
+                    label,
+                    start,
+                    time.perf_counter() - start,
+                    input_length(args[argument]) if len(args) > argument else None,
+                )
+
+        return wrapper
+
+    return decorator
+
+
+class _Measurement:
+    def __init__(self, name: str, length: Optional[int]):
+        """
+        Context manager for measuring the part of the code
+        :param name: name in the report
+        :param length: length of the input
+        """
+        self.name = name
+        self.length = length
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler.record(
+            self.name, self.start, time.perf_counter() - self.start, self.length
+        )
+        return False
+
+
+class _NoMeasurement:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_measurement = _NoMeasurement()
+
+
+def measure(name: str, value=None):
+    """
+    Measures the block of code, when the profiler is enabled
+    with measure("ad", acg_xyz):
+        ...
+    :param name: name in the report
+    :param value: input, which length is recorded
+    :return: context manager
+    """
+    if not profiler.enabled:
+        return _no_measurement
+    return _Measurement(name, input_length(value))
@@ -0,0 +1,395 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+
+import numpy as np
+
+# parameters available from RollingParameters - names are same as in Consts.parameters_names
+rolling_parameters_names = [
+    "average",
+    "deviation",
+    "variance",
+    "mobility",
+    "complexity",
+    "average_tkeo",
+    "output",
+    "waveform_length",
+    "min_max",
+    "ratio_3g",
+    "1g_crosses",
+]
+
+
+class MonotonicExtreme:
+    def __init__(self, maximum=True):
+        """
+        Minimum or maximum of the sliding window - monotonic deque with O(1) amortized update
+        :param maximum: True for maximum, False for minimum
+        """
+        self.maximum = maximum
+        self.candidates = deque()  # (index, value) - values are monotonic from the oldest
+
+    def push(self, index: int, value: float):
+        """
+        Adds new sample and removes all the samples, which can not be extreme anymore
+        :param index: index of the sample in stream
+        :param value: value of the sample
+        """
+        if self.maximum:
+            while self.candidates and self.candidates[-1][1] <= value:
+                self.candidates.pop()
+        else:
+            while self.candidates and self.candidates[-1][1] >= value:
+                self.candidates.pop()
+        self.candidates.append((index, value))
+
+    def expire(self, index: int):
+        """
+        Removes the sample, which leaves the window
+        :param index: index of the leaving sample in stream
+        """
+        if self.candidates and self.candidates[0][0] == index:
+            self.candidates.popleft()
+
+    @property
+    def value(self) -> float:
+        return self.candidates[0][1] if self.candidates else np.nan
+
+
+class CrossCounter:
+    def __init__(self, threshold=9.25):
+        """
+        Sliding version of Parameters.g_cross_rate - every sample stores, if it changes the side of threshold.
+        Samples equal to the threshold do not change the side, so they are not stored.
+        :param threshold: to follow
+        """
+        self.threshold = threshold
+        self.sides = deque()  # (index, below threshold, side changed) of the samples in window
+        self.changes = 0
+        self.last_below = False  # g_cross_rate starts above the threshold
+
+    def push(self, index: int, value: float):
+        """
+        :param index: index of the sample in stream
+        :param value: value of the sample
+        """
+        if value < self.threshold:
+            below = True
+        elif value > self.threshold:
+            below = False
+        else:
+            return
+        changed = below != self.last_below
+        self.sides.append((index, below, changed))
+        self.changes += changed
+        self.last_below = below
+
+    def expire(self, index: int):
+        """
+        :param index: index of the leaving sample in stream
+        """
+        if self.sides and self.sides[0][0] == index:
+            self.changes -= self.sides.popleft()[2]
+
+    @property
+    def crosses(self) -> int:
+        if not self.sides:
+            return 0
+        # the first sample in the window is compared to the beginning above threshold, not to its predecessor
+        _, below, changed = self.sides[0]
+        return self.changes - changed + below
+
+
+class SlidingMoments:
+    def __init__(self):
+        """
+        Mean and variance of the window updated by Welford's algorithm - numerically stable without shifting
+        resource:
+        https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Welford's_online_algorithm
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+
+    def add(self, value: float):
+        """
+        Window grows by one sample
+        :param value: new sample
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def replace(self, old: float, new: float):
+        """
+        The oldest sample leaves the window and the new one enters - size of window stays the same
+        :param old: leaving sample
+        :param new: entering sample
+        """
+        if self.count == 1:
+            self.mean = new
+            self.m2 = 0.0
+            return
+        mean = self.mean
+        self.mean += (new - old) / self.count
+        self.m2 += (new - old) * (new - self.mean + old - mean)
+
+    def reset(self, values: np.ndarray):
+        """
+        :param values: all the samples in window
+        """
+        self.count = values.shape[0]
+        self.mean = np.mean(values) if self.count else 0.0
+        self.m2 = np.sum((values - self.mean) ** 2)
+
+    @property
+    def variance(self) -> float:
+        return max(np.float64(self.m2) / self.count, 0.0)
+
+
+class RollingParameters:
+    def __init__(self, window: int, g_threshold=9.25, ratio_threshold=30):
+        """
+        Parameters of the sliding window over the magnitude, which are updated in O(1) per sample.
+        Running sums are recalculated from the window after every "window" updates to stop the drift
+        of the floating point errors, which keeps the update O(1) amortized.
+        Values match the functions from Parameters.py applied on the last "window" samples.
+        :param window: number of samples in window - at least 3
+        :param g_threshold: threshold for the 1g crosses
+        :param ratio_threshold: threshold for the 3g ratio
+        """
+        if window < 3:
+            raise ValueError("Window must have at least 3 samples")
+
+        self.window = window
+        self.buffer = np.zeros(window)  # ring buffer of the samples
+        self.start = 0  # position of the oldest sample in buffer
+        self.count = 0  # number of samples in window
+        self.index = 0  # index of the next sample in stream
+        self.updates_to_sync = window
+
+        # moments of the signal, its first and second differential
+        self.moments = SlidingMoments()
+        self.moments_d1 = SlidingMoments()
+        self.moments_d2 = SlidingMoments()
+
+        self.sum_squares = 0.0
+        self.sum_d1_abs = 0.0
+        self.sum_tkeo = 0.0
+
+        self.ratio_threshold = ratio_threshold
+        self.above_ratio = 0
+        self.below_ratio = 0
+
+        self.maximum = MonotonicExtreme(maximum=True)
+        self.minimum = MonotonicExtreme(maximum=False)
+        self.crosses = CrossCounter(g_threshold)
+
+    def __sample(self, position: int) -> float:
+        """
+        :param position: position in the window - 0 is the oldest, negative from the newest
+        :return: sample
+        """
+        if position < 0:
+            position += self.count
+        return self.buffer[(self.start + position) % self.window]
+
+    def __synchronize(self):
+        """
+        Recalculates the running sums from the samples in window
+        """
+        window = self.values()
+        d1 = np.diff(window)
+        d2 = np.diff(d1)
+
+        self.moments.reset(window)
+        self.moments_d1.reset(d1)
+        self.moments_d2.reset(d2)
+        self.sum_squares = np.sum(window * window)
+        self.sum_d1_abs = np.sum(np.abs(d1))
+        self.sum_tkeo = np.sum(window[1:-1] ** 2 + window[:-2] * window[2:])
+        self.updates_to_sync = self.window
+
+    def update(self, value: float):
+        """
+        Moves the window by one sample
+        :param value: new sample of the magnitude
+        """
+        value = float(value)
+
+        # differentials and TKEO term, which enter the window with the new sample
+        d1 = d2 = None
+        if self.count >= 1:
+            last = self.__sample(-1)
+            d1 = value - last
+            if self.count >= 2:
+                second_last = self.__sample(-2)
+                d2 = d1 - (last - second_last)
+                self.sum_tkeo += last * last + second_last * value
+
+        if self.count == self.window:
+            # the oldest sample with its differentials and TKEO term leaves the window
+            x0, x1, x2 = self.__sample(0), self.__sample(1), self.__sample(2)
+            self.moments.replace(x0, value)
+            self.moments_d1.replace(x1 - x0, d1)
+            self.moments_d2.replace((x2 - x1) - (x1 - x0), d2)
+            self.sum_squares += value * value - x0 * x0
+            self.sum_d1_abs += abs(d1) - abs(x1 - x0)
+            self.sum_tkeo -= x1 * x1 + x0 * x2
+            self.__count_ratio(x0, -1)
+
+            oldest_index = self.index - self.window
+            self.maximum.expire(oldest_index)
+            self.minimum.expire(oldest_index)
+            self.crosses.expire(oldest_index)
+            self.start = (self.start + 1) % self.window
+            self.count -= 1
+        else:
+            self.moments.add(value)
+            self.sum_squares += value * value
+            if d1 is not None:
+                self.moments_d1.add(d1)
+                self.sum_d1_abs += abs(d1)
+            if d2 is not None:
+                self.moments_d2.add(d2)
+
+        self.buffer[(self.start + self.count) % self.window] = value
+        self.count += 1
+        self.__count_ratio(value, 1)
+        self.maximum.push(self.index, value)
+        self.minimum.push(self.index, value)
+        self.crosses.push(self.index, value)
+        self.index += 1
+
+        self.updates_to_sync -= 1
+        if self.updates_to_sync == 0:
+            self.__synchronize()
+
+    def __count_ratio(self, value: float, sign: int):
+        """
+        :param value: sample entering or leaving the window
+        :param sign: 1 for entering, -1 for leaving
+        """
+        if value > self.ratio_threshold:
+            self.above_ratio += sign
+        elif value < self.ratio_threshold:
+            self.below_ratio += sign
+
+    def update_many(self, values: np.ndarray):
+        """
+        :param values: new samples of the magnitude in chronological order
+        """
+        for value in values:
+            self.update(value)
+
+    def values(self) -> np.ndarray:
+        """
+        :return: samples in window from the oldest
+        """
+        return np.roll(self.buffer, -self.start)[: self.count]
+
+    @property
+    def ready(self) -> bool:
+        """
+        :return: window is full
+        """
+        return self.count == self.window
+
+    @property
+    def average(self) -> float:
+        return np.float64(self.moments.mean) if self.count else np.nan
+
+    @property
+    def variance(self) -> float:
+        return self.moments.variance
+
+    @property
+    def deviation(self) -> float:
+        return np.sqrt(self.variance)
+
+    @property
+    def mobility(self) -> float:
+        return np.sqrt(self.moments_d1.variance / self.variance)
+
+    @property
+    def complexity(self) -> float:
+        return np.sqrt(self.moments_d2.variance / self.mobility)
+
+    @property
+    def average_tkeo(self) -> float:
+        return np.float64(self.sum_tkeo) / (self.count - 2.0)
+
+    @property
+    def output(self) -> float:
+        return np.float64(self.sum_squares) / self.count
+
+    @property
+    def waveform_length(self) -> float:
+        return np.float64(self.sum_d1_abs) / (self.count - 1)
+
+    @property
+    def min_max(self) -> float:
+        return self.maximum.value - self.minimum.value
+
+    @property
+    def ratio_3g(self) -> float:
+        return np.float64(self.above_ratio) / self.below_ratio
+
+    @property
+    def g_crosses(self) -> int:
+        return self.crosses.crosses
+
+    def parameters(self) -> np.ndarray:
+        """
+        :return: all parameters in order of rolling_parameters_names
+        """
+        return np.array(
+            [
+                self.average,
+                self.deviation,
+                self.variance,
+                self.mobility,
+                self.complexity,
+                self.average_tkeo,
+                self.output,
+                self.waveform_length,
+                self.min_max,
+                self.ratio_3g,
+                self.g_crosses,
+            ]
+        )
+
+
+def rolling_parameters(magnitude: np.ndarray, window: int, **kwargs) -> np.ndarray:
+    """
+    Parameters of every full window, which slides through the magnitude by one sample - O(N) in total
+    :param magnitude: 1D magnitude of acceleration
+    :param window: number of samples in window
+    :param kwargs: thresholds passed to RollingParameters
+    :return: matrix (N - window + 1) x parameters in order of rolling_parameters_names
+    """
+    rolling = RollingParameters(window, **kwargs)
+    result = np.empty((max(magnitude.shape[0] - window + 1, 0), len(rolling_parameters_names)))
+
+    rolling.update_many(magnitude[: window - 1])
+    for i, value in enumerate(magnitude[window - 1 :]):
+        rolling.update(value)
+        result[i] = rolling.parameters()
+    return result
@@ -0,0 +1,244 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from SensorArchive import is_archive, read_archive
+from SensorCsv import read_sensor_files
+
+
+class SegmentedArray:
+    def __init__(self, segments: List[np.ndarray]):
+        """
+        Segments of one array joined along the last axis (samples) without copying - e.g. sensor split into
+        ACG_1.csv, ACG_2.csv, ... Slices inside one segment are views, slices over the borders copy only
+        the selected samples, whole array is copied only by materialize.
+        :param segments: 1D arrays or matrices axes x samples with the same axes and type
+        """
+        self.segments = [segment for segment in segments if segment.shape[-1]]
+        if not self.segments and segments:
+            self.segments = [segments[0]]
+        if not self.segments:
+            raise ValueError("At least one segment is needed")
+        self.offsets = np.cumsum([0] + [segment.shape[-1] for segment in self.segments])
+
+    @property
+    def shape(self) -> tuple:
+        return self.segments[0].shape[:-1] + (int(self.offsets[-1]),)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.segments[0].dtype
+
+    @property
+    def ndim(self) -> int:
+        return self.segments[0].ndim
+
+    @property
+    def nbytes(self) -> int:
+        return sum(segment.nbytes for segment in self.segments)
+
+    def __len__(self) -> int:
+        """
+        :return: number of samples
+        """
+        return int(self.offsets[-1])
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """
+        :param index: index of the sample
+        :return: index of the segment and of the sample in the segment
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Index {} is out of {} samples".format(index, len(self)))
+        segment = int(np.searchsorted(self.offsets, index, "right")) - 1
+        return segment, index - int(self.offsets[segment])
+
+    def __getitem__(self, item: Union[int, slice, np.ndarray]) -> np.ndarray:
+        """
+        :param item: index, slice, array of indexes or boolean mask of the samples
+        :return: sample or samples - view, if they are in one segment
+        """
+        if isinstance(item, (int, np.integer)):
+            segment, position = self.locate(int(item))
+            return self.segments[segment][..., position]
+
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            if stop <= start:
+                return self.segments[0][..., 0:0]
+
+            first, begin = self.locate(start)
+            last, end = self.locate(stop - 1)
+            if first == last:
+                return self.segments[first][..., begin : end + 1]
+            parts = [self.segments[first][..., begin:]]
+            parts += self.segments[first + 1 : last]
+            parts.append(self.segments[last][..., : end + 1])
+            return np.concatenate(parts, axis=-1)
+
+        return self.take(np.asarray(item))
+
+    def take(self, indexes: np.ndarray) -> np.ndarray:
+        """
+        :param indexes: indexes of the samples or boolean mask of all the samples
+        :return: new array with the samples
+        """
+        indexes = np.asarray(indexes)
+        if indexes.dtype == np.bool_:
+            if indexes.shape != (len(self),):
+                raise IndexError(
+                    "Boolean mask of shape {} does not match {} samples".format(indexes.shape, len(self))
+                )
+            indexes = np.flatnonzero(indexes)
+        elif indexes.size and not np.issubdtype(indexes.dtype, np.integer):
+            raise IndexError("Only integer arrays and boolean masks are valid indexes")
+        indexes = np.where(indexes < 0, indexes + len(self), indexes).astype(np.int64)
+        if indexes.size and (indexes.min() < 0 or indexes.max() >= len(self)):
+            raise IndexError("Indexes are out of {} samples".format(len(self)))
+        result = np.empty(self.shape[:-1] + indexes.shape, dtype=self.dtype)
+        segments = np.searchsorted(self.offsets, indexes, "right") - 1
+        for segment in np.unique(segments):
+            selected = segments == segment
+            result[..., selected] = self.segments[segment][
+                ..., indexes[selected] - self.offsets[segment]
+            ]
+        return result
+
+    def searchsorted(self, value, side="left") -> int:
+        """
+        Binary search in 1D array, which is sorted over all the segments - e.g. time
+        :param value: searched value
+        :param side: same as np.searchsorted
+        :return: index of the sample
+        """
+        firsts = np.array([segment[0] for segment in self.segments])
+        segment = max(int(np.searchsorted(firsts, value, side)) - 1, 0)
+        position = int(np.searchsorted(self.segments[segment], value, side))
+        # value is behind the last sample of the segment
+        if position == self.segments[segment].shape[0] and segment + 1 < len(self.segments):
+            return int(self.offsets[segment + 1])
+        return int(self.offsets[segment]) + position
+
+    def materialize(self) -> np.ndarray:
+        """
+        :return: one contiguous array - the only segment is returned without copy
+        """
+        if len(self.segments) == 1:
+            return self.segments[0]
+        return np.concatenate(self.segments, axis=-1)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        array = self.materialize()
+        return array if dtype is None else array.astype(dtype)
+
+
+class SegmentedSensor:
+    def __init__(
+        self,
+        time: SegmentedArray,
+        data: SegmentedArray,
+        acc: Optional[SegmentedArray],
+    ):
+        """
+        One sensor from the split files as one logical time series
+        :param time: time in nanoseconds
+        :param data: matrix axes x samples
+        :param acc: accuracy of samples, None for sensors without accuracy
+        """
+        self.time = time
+        self.data = data
+        self.acc = acc
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def index_range(self, start: Optional[int] = None, end: Optional[int] = None) -> Tuple[int, int]:
+        """
+        :param start: time in nanoseconds - None from the beginning
+        :param end: time in nanoseconds (included) - None to the end
+        :return: index of the first sample and index after the last sample
+        """
+        begin = 0 if start is None else self.time.searchsorted(start, "left")
+        stop = len(self) if end is None else self.time.searchsorted(end, "right")
+        return begin, max(stop, begin)
+
+    def slice(self, begin: int, end: int) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        :param begin: index of the first sample
+        :param end: index after the last sample
+        :return: time, data and accuracy of the samples - views, if they are in one segment
+        """
+        part = slice(begin, end)
+        return (
+            self.time[part],
+            self.data[part],
+            self.acc[part] if self.acc is not None else None,
+        )
+
+    def slice_time(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        :param start: time in nanoseconds - None from the beginning
+        :param end: time in nanoseconds (included) - None to the end
+        :return: time, data and accuracy of the samples in the range
+        """
+        return self.slice(*self.index_range(start, end))
+
+    def materialize(self) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        :return: time, data and accuracy as contiguous arrays - same as SensorCsv.read_sensor_files
+        """
+        return (
+            self.time.materialize(),
+            self.data.materialize(),
+            self.acc.materialize() if self.acc is not None else None,
+        )
+
+
+def read_segments(files: List[str], dtype=None) -> Optional[SegmentedSensor]:
+    """
+    Every file is parsed into its own arrays, which are not joined - peak memory is the size of the data
+    :param files: csv files / archives of the same sensor in chronological order - DataCarrier.sensor_paths
+    :param dtype: floating type of the data - None for Precision
+    :return: sensor from all the files, None if the files have no sensor values
+    """
+    loaded = []
+    for file_path in files:
+        if is_archive(file_path):
+            segment = read_archive([file_path], dtype=dtype)
+        else:
+            segment = read_sensor_files([file_path], dtype)
+        if segment is not None:
+            loaded.append(segment)
+    if not loaded:
+        return None
+    return SegmentedSensor(
+        SegmentedArray([segment[0] for segment in loaded]),
+        SegmentedArray([segment[1] for segment in loaded]),
+        SegmentedArray([segment[2] for segment in loaded])
+        if loaded[0][2] is not None
+        else None,
+    )
@@ -0,0 +1,483 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Iterator, List, Optional, Tuple, Union
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from Precision import precision
+from SensorCsv import ACCURACY_DTYPE, TIME_DTYPE
+
+# one archive per sensor - <sensor type>.bsa in the folder of the measurement instead of csv files
+# layout: MAGIC, zlib compressed blocks, json index, offset of the index (uint64), MAGIC
+ARCHIVE_EXTENSION = ".bsa"
+TEMPORARY_EXTENSION = ".tmp"  # archive during the writing - not part of the measurement
+MAGIC = b"BSBA"
+ARCHIVE_VERSION = 1
+_FOOTER = struct.Struct("<Q4s")
+
+# samples in one compressed block - the smallest part, which is decoded for a time range
+BLOCK_ROWS = 1 << 14
+
+# encodings of the sensor values
+ENCODING_FLOAT64 = "float64"
+ENCODING_FLOAT32 = "float32"  # lossless for values, which are float32 written as text
+ENCODING_INT16 = "int16"  # quantized with a scale per axis - error is at most half of the scale
+_INT16_MAX = 32767
+
+
+def is_archive(file_path: str) -> bool:
+    """
+    :param file_path: path to file
+    :return: True for the archive of sensor
+    """
+    return file_path.endswith(ARCHIVE_EXTENSION)
+
+
+def _shuffle(array: np.ndarray) -> bytes:
+    """
+    Bytes of the same significance are stored together - zlib compresses the slowly changing high bytes better
+    :param array: 1D or 2D array
+    :return: transposed bytes of the array
+    """
+    array = np.ascontiguousarray(array)
+    return array.reshape(-1).view(np.uint8).reshape(-1, array.itemsize).T.tobytes()
+
+
+def _unshuffle(buffer: bytes, dtype, count: int, offset: int) -> np.ndarray:
+    """
+    :param buffer: buffer with output of _shuffle
+    :param dtype: type of the values
+    :param count: number of values
+    :param offset: position of the values in the buffer
+    :return: 1D array
+    """
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(buffer, dtype=np.uint8, count=count * dtype.itemsize, offset=offset)
+    return np.ascontiguousarray(raw.reshape(dtype.itemsize, count).T).view(dtype).reshape(-1)
+
+
+def _choose_encoding(
+    data: np.ndarray, quantize: Union[None, str, float]
+) -> Tuple[str, Optional[np.ndarray]]:
+    """
+    :param data: matrix axes x samples
+    :param quantize: None for lossless, "auto" for the finest int16 scale of every axis, number for fixed scale
+    :return: encoding and scale of the axes (None for float encodings)
+    """
+    if quantize is None:
+        if np.array_equal(data.astype(np.float32).astype(np.float64), data, equal_nan=True):
+            return ENCODING_FLOAT32, None
+        return ENCODING_FLOAT64, None
+
+    if not np.all(np.isfinite(data)):
+        raise ValueError("Only finite values can be quantized")
+    maximum = np.abs(data).max(axis=1) if data.shape[1] else np.zeros(data.shape[0])
+    if quantize == "auto":
+        scale = np.where(maximum > 0, maximum / _INT16_MAX, 1.0)
+    else:
+        scale = np.full(data.shape[0], float(quantize))
+        if scale[0] <= 0:
+            raise ValueError("Scale must be positive number")
+        if np.any(np.round(maximum / scale) > _INT16_MAX):
+            raise ValueError(
+                "Scale {} is too small for the values up to {}".format(quantize, maximum.max())
+            )
+    return ENCODING_INT16, scale
+
+
+def _encode_block(
+    time: np.ndarray,
+    data: np.ndarray,
+    acc: Optional[np.ndarray],
+    encoding: str,
+    scale: Optional[np.ndarray],
+) -> Tuple[bytes, float]:
+    """
+    :param time: time in nanoseconds
+    :param data: matrix axes x samples
+    :param acc: accuracy or None
+    :param encoding: one of ENCODING_*
+    :param scale: scale of the axes for ENCODING_INT16
+    :return: compressed payload of the block, maximal absolute error of the values
+    """
+    deltas = np.diff(time)
+    small = deltas.shape[0] == 0 or (
+        deltas.min() >= np.iinfo(np.int32).min and deltas.max() <= np.iinfo(np.int32).max
+    )
+    deltas = deltas.astype(np.int32 if small else np.int64)
+
+    error = 0.0
+    if encoding == ENCODING_INT16:
+        values = np.round(data / scale[:, None]).astype(np.int16)
+        if data.shape[1]:
+            error = float(np.abs(values * scale[:, None] - data).max())
+    else:
+        values = data.astype(encoding)
+
+    payload = [bytes([deltas.itemsize]), _shuffle(deltas), _shuffle(values)]
+    if acc is not None:
+        payload.append(acc.astype(ACCURACY_DTYPE).tobytes())
+    return b"".join(payload), error
+
+
+def _decode_block(
+    payload: bytes, first: int, rows: int, index: dict, dtype
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    :param payload: decompressed output of _encode_block
+    :param first: time of the first sample
+    :param rows: number of samples
+    :param index: index of the archive
+    :param dtype: floating type of the data
+    :return: time in nanoseconds, data axes x samples, accuracy or None
+    """
+    delta_size = payload[0]
+    position = 1
+    deltas = _unshuffle(
+        payload, np.int32 if delta_size == 4 else np.int64, rows - 1, position
+    )
+    position += delta_size * (rows - 1)
+
+    time = np.empty(rows, dtype=TIME_DTYPE)
+    time[0] = first
+    np.cumsum(deltas, dtype=TIME_DTYPE, out=time[1:])
+    time[1:] += first
+
+    axes = index["axes"]
+    encoding = np.dtype(index["encoding"])
+    values = _unshuffle(payload, encoding, axes * rows, position).reshape(axes, rows)
+    position += encoding.itemsize * axes * rows
+    if index["encoding"] == ENCODING_INT16:
+        data = values * np.asarray(index["scale"])[:, None]
+        data = data.astype(dtype, copy=False)
+    else:
+        data = values.astype(dtype)
+
+    acc = None
+    if index["with_accuracy"]:
+        acc = np.frombuffer(payload, dtype=ACCURACY_DTYPE, count=rows, offset=position).copy()
+    return time, data, acc
+
+
+def write_archive(
+    file_path: str,
+    time: np.ndarray,
+    data: np.ndarray,
+    acc: Optional[np.ndarray] = None,
+    quantize: Union[None, str, float] = None,
+    block_rows=BLOCK_ROWS,
+    level=6,
+) -> dict:
+    """
+    Stores one sensor into the archive - time is delta encoded, values are stored as float64 / float32 or
+    quantized into int16, every block of samples is compressed separately.
+    The archive is written into temporary file first and replaces the old one at the end.
+    :param file_path: path to the archive
+    :param time: time in nanoseconds
+    :param data: matrix axes x samples
+    :param acc: accuracy of samples, None for sensors without accuracy
+    :param quantize: None for lossless archive, "auto" for int16 with the finest scale for every axis,
+    number for int16 with the fixed scale - values up to +-32767 * scale, e.g. 0.01 m/s^2 for the accelerometer
+    (up to +-327 m/s^2, error at most 0.005 m/s^2)
+    :param block_rows: samples in one block
+    :param level: zlib compression level
+    :return: index of the archive
+    """
+    encoding, scale = _choose_encoding(data, quantize)
+    index = {
+        "version": ARCHIVE_VERSION,
+        "axes": int(data.shape[0]),
+        "with_accuracy": acc is not None,
+        "encoding": encoding,
+        "scale": scale.tolist() if scale is not None else None,
+        "samples": int(time.shape[0]),
+        "max_error": 0.0,
+        "blocks": [],  # [first time, last time, rows, offset, length]
+    }
+
+    temporary = file_path + TEMPORARY_EXTENSION
+    try:
+        with open(temporary, "wb") as file:
+            file.write(MAGIC)
+            for begin in range(0, time.shape[0], block_rows):
+                end = min(begin + block_rows, time.shape[0])
+                payload, error = _encode_block(
+                    time[begin:end],
+                    data[:, begin:end],
+                    acc[begin:end] if acc is not None else None,
+                    encoding,
+                    scale,
+                )
+                compressed = zlib.compress(payload, level)
+                index["blocks"].append(
+                    [int(time[begin]), int(time[end - 1]), end - begin, file.tell(), len(compressed)]
+                )
+                index["max_error"] = max(index["max_error"], error)
+                file.write(compressed)
+
+            offset = file.tell()
+            file.write(json.dumps(index).encode("utf-8"))
+            file.write(_FOOTER.pack(offset, MAGIC))
+        os.replace(temporary, file_path)
+    except BaseException:
+        # the temporary file may be missing - e.g. failed open or already replaced
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+    return index
+
+
+def read_index(file_path: str) -> dict:
+    """
+    :param file_path: path to the archive
+    :return: index of the archive - encoding, scale, number of samples, maximal error and blocks
+    """
+    with open(file_path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an archive".format(file_path))
+        size = file.seek(-_FOOTER.size, os.SEEK_END)
+        offset, magic = _FOOTER.unpack(file.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not complete".format(file_path))
+        file.seek(offset)
+        index = json.loads(file.read(size - offset).decode("utf-8"))
+    if index["version"] != ARCHIVE_VERSION:
+        raise ValueError("Unsupported version of {}".format(file_path))
+    return index
+
+
+def iterate_blocks(
+    files: List[str], start: Optional[int] = None, end: Optional[int] = None, dtype=None
+) -> Iterator[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Decodes only the blocks, which overlap the time range - blocks are not trimmed
+    :param files: archives of the same sensor in chronological order
+    :param start: time in nanoseconds - None from the beginning
+    :param end: time in nanoseconds (included) - None to the end
+    :param dtype: floating type of the data - None for Precision
+    :return: generator of time in nanoseconds, data axes x rows and accuracy (None without accuracy)
+    """
+    dtype = precision.resolve(dtype)
+    for file_path in files:
+        index = read_index(file_path)
+        with open(file_path, "rb") as file:
+            for first, last, rows, offset, length in index["blocks"]:
+                if (start is not None and last < start) or (end is not None and first > end):
+                    continue
+                file.seek(offset)
+                payload = zlib.decompress(file.read(length))
+                yield _decode_block(payload, first, rows, index, dtype)
+
+
+def read_archive(
+    files: List[str], start: Optional[int] = None, end: Optional[int] = None, dtype=None
+) -> Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Same output as SensorCsv.read_sensor_files - decoded blocks are copied into preallocated arrays
+    :param files: archives of the same sensor in chronological order
+    :param start: time in nanoseconds - None from the beginning
+    :param end: time in nanoseconds (included) - None to the end
+    :param dtype: floating type of the data - None for Precision
+    :return: time in nanoseconds (int64), data axes x samples, accuracy (int8) or None for sensors without accuracy -
+    None for the archive without samples
+    """
+    dtype = precision.resolve(dtype)
+    indexes = [read_index(file_path) for file_path in files]
+    if not sum(index["samples"] for index in indexes):
+        return None
+    capacity = sum(
+        rows
+        for index in indexes
+        for first, last, rows, _, _ in index["blocks"]
+        if not ((start is not None and last < start) or (end is not None and first > end))
+    )
+    with_accuracy = indexes[0]["with_accuracy"]
+    time = np.empty(capacity, dtype=TIME_DTYPE)
+    data = np.empty((indexes[0]["axes"], capacity), dtype=dtype)
+    acc = np.empty(capacity, dtype=ACCURACY_DTYPE) if with_accuracy else None
+
+    filled = 0
+    for block_time, block_data, block_acc in iterate_blocks(files, start, end, dtype):
+        rows = block_time.shape[0]
+        time[filled : filled + rows] = block_time
+        data[:, filled : filled + rows] = block_data
+        if with_accuracy:
+            acc[filled : filled + rows] = block_acc
+        filled += rows
+
+    # only the first and the last block can exceed the range
+    begin = 0 if start is None else int(np.searchsorted(time, start, "left"))
+    stop = capacity if end is None else int(np.searchsorted(time, end, "right"))
+    if begin > 0 or stop < capacity:
+        time = time[begin:stop].copy()
+        data = data[:, begin:stop].copy()
+        acc = acc[begin:stop].copy() if with_accuracy else None
+    return time, data, acc
+
+
+def archive_time_range(files: List[str]) -> Optional[Tuple[int, int]]:
+    """
+    :param files: archives of the same sensor in chronological order
+    :return: time of the first and the last sample in nanoseconds from the index, None if there are no samples
+    """
+    blocks = [block for file_path in files for block in read_index(file_path)["blocks"]]
+    if not blocks:
+        return None
+    return blocks[0][0], blocks[-1][1]
+
+
+def archive_folder(
+    path: str, output: str, quantize: Union[None, str, float] = None, block_rows=BLOCK_ROWS
+) -> str:
+    """
+    Converts the measurement folder into a folder with archives - one per sensor. Other files (extra.txt,
+    changes.txt, GPS, confidence) are copied, so DataCarrier opens the new folder as the original one.
+    :param path: path to folder with the measurements
+    :param output: folder, where the folder with the same name is created
+    :param quantize: see write_archive
+    :param block_rows: samples in one block
+    :return: path to the new folder
+    """
+    from DataCarrier import DataCarrier
+
+    data_carrier = DataCarrier(path, use_cache=False, dtype=np.float64)
+    target = os.path.join(output, os.path.basename(os.path.normpath(path)))
+    os.makedirs(target, exist_ok=True)
+
+    sensor_files = {
+        name for names in data_carrier.sensor_files.values() for name in names
+    }
+    for name in os.listdir(path):
+        file_path = os.path.join(path, name)
+        if name not in sensor_files and os.path.isfile(file_path):
+            shutil.copy2(file_path, os.path.join(target, name))
+
+    for sensor_type, sensor in data_carrier.sensor_data.items():
+        write_archive(
+            os.path.join(target, sensor_type + ARCHIVE_EXTENSION),
+            sensor.time,
+            sensor.data,
+            sensor.acc,
+            quantize,
+            block_rows,
+        )
+    return target
+
+
+def verify_folder(path: str, archived: str) -> pd.DataFrame:
+    """
+    Round-trip check - the archived folder is read by DataCarrier and compared with the original csv files
+    :param path: original folder with the measurements
+    :param archived: folder created by archive_folder
+    :return: table with sensor, samples, equal time, equal accuracy, maximal error, allowed error and result
+    """
+    from DataCarrier import DataCarrier
+
+    original = DataCarrier(path, use_cache=False, dtype=np.float64)
+    restored = DataCarrier(archived, use_cache=False, dtype=np.float64)
+
+    rows = []
+    for sensor_type in sorted(set(original.sensor_data.available) | set(restored.sensor_data.available)):
+        source = original.sensor_data.get(sensor_type)
+        copy = restored.sensor_data.get(sensor_type)
+        if source is None or copy is None or source.time.shape != copy.time.shape:
+            rows.append([sensor_type, None, False, False, np.inf, 0.0, False])
+            continue
+
+        index = read_index(restored.sensor_paths(sensor_type)[0])
+        allowed = max(index["scale"]) / 2 if index["scale"] is not None else 0.0
+        time_equal = np.array_equal(source.time, copy.time)
+        acc_equal = (source.acc is None and copy.acc is None) or np.array_equal(source.acc, copy.acc)
+        error = float(np.abs(source.data - copy.data).max()) if source.data.size else 0.0
+        rows.append(
+            [
+                sensor_type,
+                source.time.shape[0],
+                time_equal,
+                acc_equal,
+                error,
+                allowed,
+                time_equal and acc_equal and error <= allowed * (1 + 1e-9),
+            ]
+        )
+    return pd.DataFrame(
+        rows, columns=["sensor", "samples", "time", "accuracy", "max_error", "allowed_error", "ok"]
+    )
+
+
+def _folder_size(path: str, extensions: Tuple[str, ...]) -> int:
+    """
+    :param path: folder
+    :param extensions: counted files
+    :return: bytes of the files
+    """
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in os.listdir(path)
+        if name.endswith(extensions)
+    )
+
+
+if __name__ == "__main__":
+    from MeasurementCache import measurement_folders
+
+    parser = argparse.ArgumentParser(description="Archives of SensorBox measurements")
+    parser.add_argument("command", choices=["archive", "verify", "info"])
+    parser.add_argument("paths", nargs="+", help="measurement folders or their roots")
+    parser.add_argument("--output", help="folder for the archived measurements")
+    parser.add_argument(
+        "--quantize", help='"auto" or scale of int16 values (e.g. 0.01), lossless without it'
+    )
+    arguments = parser.parse_args()
+
+    quantization = arguments.quantize
+    if quantization is not None and quantization != "auto":
+        quantization = float(quantization)
+
+    for measurement in measurement_folders(arguments.paths):
+        if arguments.command == "info":
+            for name in sorted(os.listdir(measurement)):
+                if is_archive(name):
+                    description = read_index(os.path.join(measurement, name))
+                    description.pop("blocks")
+                    print(measurement, name, description)
+            continue
+
+        if arguments.output is None:
+            parser.error("--output is required for {}".format(arguments.command))
+        destination = os.path.join(arguments.output, os.path.basename(os.path.normpath(measurement)))
+        if arguments.command == "archive":
+            destination = archive_folder(measurement, arguments.output, quantization)
+            print(
+                "{} - csv {} B, archive {} B".format(
+                    measurement,
+                    _folder_size(measurement, (".csv",)),
+                    _folder_size(destination, (ARCHIVE_EXTENSION,)),
+                )
+            )
+        print(verify_folder(measurement, destination).to_string(index=False))
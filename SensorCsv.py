@@ -0,0 +1,556 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numba import njit
+
+from Precision import precision
+
+# columns of the sensor data in SensorBox csv files - rotation has 4 axis, pressure only one
+AXES_COLUMNS = ["x", "y", "z", "0"]
+TIME_COLUMN = "t"
+ACCURACY_COLUMN = "a"
+
+TIME_DTYPE = np.int64  # nanoseconds of Android system time
+ACCURACY_DTYPE = np.int8  # accuracy from 0 to 3
+
+# rows parsed at once - bounds the memory of the parser for long recordings
+CHUNK_ROWS = 1 << 18
+
+# bytes read at once by the compiled parser of read_sensor_files
+PARSE_BYTES = 1 << 22
+
+# targets of the columns in the compiled parser - axes are stored under their index
+_IGNORED = -1
+_TIME = -2
+_ACCURACY = -3
+
+# powers of ten of the precise float converter of pandas - the same table gives the same rounding
+_POWERS = np.array([float("1e{}".format(exponent)) for exponent in range(309)])
+_MAX_DIGITS = 17
+_EXACT_MANTISSA = 1 << 53
+
+
+def read_header(file_path: str) -> List[str]:
+    """
+    :param file_path: path to csv file of SensorBox
+    :return: names of the columns, empty list for empty file
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        header = file.readline().strip()
+    return header.split(";") if header else []
+
+
+def count_rows(file_path: str, block_size=1 << 22) -> int:
+    """
+    Upper estimate of the number of samples - number of lines without header, counted on raw bytes
+    :param file_path: path to csv file
+    :param block_size: bytes read at once
+    :return: number of lines after the header
+    """
+    lines = 0
+    last = b"\n"
+    with open(file_path, "rb") as file:
+        block = file.read(block_size)
+        while block:
+            lines += block.count(b"\n")
+            last = block[-1:]
+            block = file.read(block_size)
+    if last != b"\n":
+        lines += 1  # last line without line ending
+    return max(lines - 1, 0)
+
+
+def sensor_columns(header: List[str]) -> Optional[Tuple[List[str], bool]]:
+    """
+    :param header: names of the columns of the file
+    :return: names of the axes and presence of the accuracy, None if the file has no sensor values
+    """
+    axes = []
+    for column in AXES_COLUMNS:
+        if column not in header:
+            break
+        axes.append(column)
+    if not axes or TIME_COLUMN not in header:
+        return None
+    return axes, ACCURACY_COLUMN in header
+
+
+def iterate_chunks(
+    files: List[str],
+    axes: List[str],
+    with_accuracy: bool,
+    chunk_rows=CHUNK_ROWS,
+    dtype=None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Parses the files of one sensor chunk by chunk - only needed columns with fixed types
+    :param files: csv files of the same sensor in chronological order - all of them must have same columns
+    :param axes: names of the axes from sensor_columns
+    :param with_accuracy: parse also the accuracy
+    :param chunk_rows: maximal number of rows in chunk - chunks do not cross the borders of the files
+    :param dtype: floating type of the data - None for Precision
+    :return: generator of time in nanoseconds, data axes x rows and accuracy (None without accuracy)
+    """
+    dtype = precision.resolve(dtype)
+    columns = [TIME_COLUMN] + axes + ([ACCURACY_COLUMN] if with_accuracy else [])
+    dtypes = {column: dtype for column in axes}
+    dtypes[TIME_COLUMN] = TIME_DTYPE
+    if with_accuracy:
+        dtypes[ACCURACY_COLUMN] = ACCURACY_DTYPE
+
+    for file in files:
+        for chunk in pd.read_csv(
+            file,
+            delimiter=";",
+            usecols=columns,
+            dtype=dtypes,
+            engine="c",
+            na_filter=False,  # SensorBox does not write missing values
+            chunksize=chunk_rows,
+        ):
+            data = np.empty((len(axes), chunk.shape[0]), dtype=dtype)
+            for axis, column in enumerate(axes):
+                data[axis] = chunk[column].values
+            yield (
+                chunk[TIME_COLUMN].values,
+                data,
+                chunk[ACCURACY_COLUMN].values if with_accuracy else None,
+            )
+
+
+@njit(cache=True)
+def _parse_float(buffer, position, end, powers):
+    """
+    Same steps as the precise float converter of pandas - up to 17 digits are accumulated in double
+    and scaled by one power of ten, so the values are equal to bit. The digits are accumulated as integer,
+    which is the same as the accumulation in double up to 2 ** 53.
+    :param buffer: bytes of the file
+    :param position: index of the first byte of the value
+    :param end: index after the last byte of the parsed rows
+    :param powers: _POWERS
+    :return: value, index after the value and success - False for empty values, nan, inf and large exponents
+    """
+    negative = False
+    if position < end and (buffer[position] == 45 or buffer[position] == 43):  # - +
+        negative = buffer[position] == 45
+        position += 1
+
+    mantissa = 0
+    exponent = 0
+    digits = 0
+    while position < end and 48 <= buffer[position] <= 57:
+        if digits < _MAX_DIGITS:
+            mantissa = mantissa * 10 + (buffer[position] - 48)
+            digits += 1
+        else:
+            exponent += 1
+        position += 1
+    if position < end and buffer[position] == 46:  # .
+        position += 1
+        decimals = 0
+        while position < end and digits < _MAX_DIGITS and 48 <= buffer[position] <= 57:
+            mantissa = mantissa * 10 + (buffer[position] - 48)
+            digits += 1
+            decimals += 1
+            position += 1
+        while position < end and 48 <= buffer[position] <= 57:
+            position += 1
+        exponent -= decimals
+    if digits == 0:
+        return 0.0, position, False
+
+    if mantissa <= _EXACT_MANTISSA:
+        number = float(mantissa)
+    else:
+        # rounding of the last one or two digits in double - the first 15 digits are always exact
+        if digits == 16:
+            number = float(mantissa // 10) * 10.0 + mantissa % 10
+        else:
+            number = (float(mantissa // 100) * 10.0 + (mantissa // 10) % 10) * 10.0 + mantissa % 10
+    if negative:
+        number = -number
+
+    if position < end and (buffer[position] == 101 or buffer[position] == 69):  # e E
+        position += 1
+        negative_exponent = False
+        if position < end and (buffer[position] == 45 or buffer[position] == 43):
+            negative_exponent = buffer[position] == 45
+            position += 1
+        value = 0
+        exponent_digits = 0
+        while position < end and exponent_digits < _MAX_DIGITS and 48 <= buffer[position] <= 57:
+            value = value * 10 + (buffer[position] - 48)
+            exponent_digits += 1
+            position += 1
+        if exponent_digits == 0:
+            return 0.0, position, False
+        exponent += -value if negative_exponent else value
+
+    if exponent > 308 or exponent < -308:
+        return 0.0, position, False
+    if exponent > 0:
+        number *= powers[exponent]
+    else:
+        number /= powers[-exponent]
+    return number, position, np.isfinite(number)
+
+
+@njit(cache=True)
+def _parse_integer(buffer, position, end):
+    """
+    :param buffer: bytes of the file
+    :param position: index of the first byte of the value
+    :param end: index after the last byte of the parsed rows
+    :return: value, index after the value and success - False for empty values and more than 18 digits
+    """
+    negative = False
+    if position < end and (buffer[position] == 45 or buffer[position] == 43):  # - +
+        negative = buffer[position] == 45
+        position += 1
+    value = 0
+    digits = 0
+    while position < end and 48 <= buffer[position] <= 57:
+        value = value * 10 + (buffer[position] - 48)
+        digits += 1
+        position += 1
+    if digits == 0 or digits > 18:
+        return 0, position, False
+    return -value if negative else value, position, True
+
+
+@njit(cache=True)
+def _parse_rows(buffer, size, final, targets, powers, time, data, accuracy, filled):
+    """
+    Parses the complete rows of the buffer into the preallocated arrays - the values are written straight into
+    their place, without tokens, columns and data frames of the csv parser of pandas
+    :param buffer: bytes of the file after the header
+    :param size: number of valid bytes in the buffer
+    :param final: the buffer ends with the end of the file - the last row may miss the line ending
+    :param targets: target of every column of the file - index of axis, _TIME, _ACCURACY or _IGNORED
+    :param powers: _POWERS
+    :param time: preallocated time
+    :param data: preallocated data axes x samples
+    :param accuracy: preallocated accuracy, empty for sensors without accuracy
+    :param filled: number of already filled samples
+    :return: number of filled samples (-1 for values, which are not written by SensorBox) and parsed bytes
+    """
+    end = size
+    if not final:
+        while end > 0 and buffer[end - 1] != 10:  # only complete lines
+            end -= 1
+
+    columns = targets.shape[0]
+    position = 0
+    while position < end:
+        # blank lines are skipped as by pandas
+        if buffer[position] == 10:
+            position += 1
+            continue
+        if buffer[position] == 13 and position + 1 < end and buffer[position + 1] == 10:
+            position += 2
+            continue
+        if filled == time.shape[0]:
+            return -1, position
+
+        for column in range(columns):
+            target = targets[column]
+            if target == _IGNORED:
+                while position < end and buffer[position] != 59 and buffer[position] != 10 \
+                        and buffer[position] != 13:
+                    if buffer[position] == 34:  # quoted values may contain delimiters
+                        return -1, position
+                    position += 1
+            elif target == _TIME or target == _ACCURACY:
+                value, position, valid = _parse_integer(buffer, position, end)
+                if not valid:
+                    return -1, position
+                if target == _TIME:
+                    time[filled] = value
+                elif -128 <= value <= 127:
+                    accuracy[filled] = value
+                else:
+                    return -1, position
+            else:
+                number, position, valid = _parse_float(buffer, position, end, powers)
+                if not valid:
+                    return -1, position
+                data[target, filled] = number
+
+            # delimiter between the columns, line ending after the last one
+            if column < columns - 1:
+                if position >= end or buffer[position] != 59:  # ;
+                    return -1, position
+                position += 1
+            elif position < end:
+                if buffer[position] == 13 and position + 1 < end and buffer[position + 1] == 10:
+                    position += 2
+                elif buffer[position] == 10:
+                    position += 1
+                else:
+                    return -1, position
+        filled += 1
+
+    return filled, end
+
+
+def _column_targets(header: List[str], axes: List[str], with_accuracy: bool) -> Optional[np.ndarray]:
+    """
+    :param header: names of the columns of the file
+    :param axes: names of the axes from sensor_columns
+    :param with_accuracy: parse also the accuracy
+    :return: target of every column for _parse_rows, None if the file misses any of the columns
+    """
+    names = [TIME_COLUMN] + axes + ([ACCURACY_COLUMN] if with_accuracy else [])
+    destinations = [_TIME] + list(range(len(axes))) + ([_ACCURACY] if with_accuracy else [])
+    targets = np.full(len(header), _IGNORED, dtype=np.int64)
+    for name, destination in zip(names, destinations):
+        if name not in header:
+            return None
+        targets[header.index(name)] = destination
+    return targets
+
+
+def _parse_files(
+    files: List[str],
+    axes: List[str],
+    with_accuracy: bool,
+    time: np.ndarray,
+    data: np.ndarray,
+    accuracy: Optional[np.ndarray],
+) -> int:
+    """
+    Compiled parser of the plain SensorBox format - files are read by blocks of PARSE_BYTES
+    :param files: csv files of the same sensor in chronological order
+    :param axes: names of the axes from sensor_columns
+    :param with_accuracy: parse also the accuracy
+    :param time: preallocated time
+    :param data: preallocated data axes x samples
+    :param accuracy: preallocated accuracy, None without accuracy
+    :return: number of filled samples, -1 if the files contain anything else than plain numbers
+    """
+    if accuracy is None:
+        accuracy = np.empty(0, dtype=ACCURACY_DTYPE)
+    filled = 0
+    buffer = np.empty(PARSE_BYTES, dtype=np.uint8)
+    for file_path in files:
+        with open(file_path, "rb") as file:
+            header = file.readline().decode("utf-8", "replace").strip()
+            targets = _column_targets(header.split(";"), axes, with_accuracy)
+            if targets is None:
+                return -1
+
+            size = 0
+            while True:
+                if size == buffer.shape[0]:  # line longer than the buffer
+                    buffer = np.concatenate((buffer, np.empty_like(buffer)))
+                read = file.readinto(memoryview(buffer)[size:])
+                size += read
+                filled, parsed = _parse_rows(
+                    buffer, size, read == 0, targets, _POWERS, time, data, accuracy, filled
+                )
+                if filled < 0:
+                    return -1
+                # the incomplete last line is moved to the beginning of the buffer
+                buffer[: size - parsed] = buffer[parsed:size]
+                size -= parsed
+                if read == 0:
+                    break
+    return filled
+
+
+def read_sensor_files(
+    files: List[str], dtype=None
+) -> Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Loads one sensor split into multiple ;-delimited files into preallocated arrays - only needed columns are parsed
+    with fixed types straight into their place by the compiled parser. Files with anything else than plain numbers
+    (quotes, spaces, nan) are parsed by pandas chunk by chunk instead. There is no concatenation of data frames
+    and no stacking of the axes, so the peak memory is the result plus one block of bytes / one chunk.
+    :param files: csv files of the same sensor in chronological order - all of them must have same columns
+    :param dtype: floating type of the data - None for Precision
+    :return: time in nanoseconds (int64), data axes x samples (float64 / float32), accuracy (int8) or None for sensors
+    without accuracy - None if the files have no sensor values
+    """
+    dtype = precision.resolve(dtype)
+    columns = sensor_columns(read_header(files[0]))
+    if columns is None:
+        return None
+    axes, with_accuracy = columns
+
+    capacity = sum(count_rows(file) for file in files)
+    time = np.empty(capacity, dtype=TIME_DTYPE)
+    data = np.empty((len(axes), capacity), dtype=dtype)
+    accuracy = np.empty(capacity, dtype=ACCURACY_DTYPE) if with_accuracy else None
+
+    filled = _parse_files(files, axes, with_accuracy, time, data, accuracy)
+    if filled < 0:
+        filled = 0
+        for chunk_time, chunk_data, chunk_accuracy in iterate_chunks(
+            files, axes, with_accuracy, dtype=dtype
+        ):
+            rows = chunk_time.shape[0]
+            time[filled : filled + rows] = chunk_time
+            data[:, filled : filled + rows] = chunk_data
+            if with_accuracy:
+                accuracy[filled : filled + rows] = chunk_accuracy
+            filled += rows
+
+    # blank lines are counted, but not parsed
+    if filled < capacity:
+        time = time[:filled].copy()
+        data = data[:, :filled].copy()
+        accuracy = accuracy[:filled].copy() if with_accuracy else None
+
+    return time, data, accuracy
+
+
+@njit(cache=True)
+def _count_complete_rows(buffer, size, final, columns):
+    """
+    :param buffer: bytes of the file after the header
+    :param size: number of valid bytes in the buffer
+    :param final: the buffer ends with the end of the file - the last row may miss the line ending
+    :param columns: number of columns of the header
+    :return: number of rows with all the columns filled and counted bytes
+    """
+    end = size
+    if not final:
+        while end > 0 and buffer[end - 1] != 10:  # only complete lines
+            end -= 1
+
+    rows = 0
+    fields = 1
+    length = 0  # bytes of the current field
+    complete = True  # no empty field so far
+    for position in range(end):
+        byte = buffer[position]
+        if byte == 10:  # \n
+            if length > 0 and complete and fields == columns:
+                rows += 1
+            fields = 1
+            length = 0
+            complete = True
+        elif byte == 59:  # ;
+            complete = complete and length > 0
+            fields += 1
+            length = 0
+        elif byte != 13:  # \r
+            length += 1
+    if final and end == size and length > 0 and complete and fields == columns:
+        rows += 1
+    return rows, end
+
+
+def count_samples(file_path: str) -> int:
+    """
+    Exact number of samples without parsing the values - rows with all the columns filled. Unlike count_rows,
+    the row cut off at the end of the interrupted recording, blank and garbage lines are not counted.
+    :param file_path: path to csv file
+    :return: number of complete rows after the header
+    """
+    columns = len(read_header(file_path))
+    samples = 0
+    buffer = np.empty(PARSE_BYTES, dtype=np.uint8)
+    with open(file_path, "rb") as file:
+        file.readline()  # header
+        size = 0
+        while True:
+            if size == buffer.shape[0]:  # line longer than the buffer
+                buffer = np.concatenate((buffer, np.empty_like(buffer)))
+            read = file.readinto(memoryview(buffer)[size:])
+            size += read
+            rows, counted = _count_complete_rows(buffer, size, read == 0, columns)
+            samples += rows
+            buffer[: size - counted] = buffer[counted:size]
+            size -= counted
+            if read == 0:
+                break
+    return samples
+
+
+def _row_time(row: bytes, columns: int, time_column: int) -> Optional[int]:
+    """
+    :param row: line of csv file
+    :param columns: number of columns of the header
+    :param time_column: position of the time in the row
+    :return: time of the row, None for row cut off at the end of the recording, blank or garbage line
+    """
+    fields = row.strip().split(b";")
+    if len(fields) != columns or not all(fields):
+        return None
+    try:
+        return int(fields[time_column])
+    except ValueError:
+        return None
+
+
+def read_time_range(files: List[str], tail=1024) -> Optional[Tuple[int, int]]:
+    """
+    Time of the first and the last sample without parsing the whole sensor - reads the first rows and the end of file.
+    Only rows with all the columns count - the last row of the interrupted recording is often cut off, and the last
+    time has to be after the first one.
+    :param files: csv files of the same sensor in chronological order
+    :param tail: bytes read from the end of file at first - more are read, if there is no complete row
+    :return: time of the first and the last sample in nanoseconds, None if there are no samples
+    """
+    first = last = None
+    for file_path in files:
+        header = read_header(file_path)
+        if TIME_COLUMN not in header:
+            continue
+        columns, time_column = len(header), header.index(TIME_COLUMN)
+        with open(file_path, "rb") as file:
+            file.readline()  # header
+            file_first = None
+            for row in file:
+                file_first = _row_time(row, columns, time_column)
+                if file_first is not None:
+                    break
+            if file_first is None:
+                continue
+
+            size = file.seek(0, 2)
+            file_last = None
+            length = tail
+            while file_last is None:
+                begin = max(size - length, 0)
+                file.seek(begin)
+                rows = file.read().split(b"\n")
+                if begin > 0:
+                    rows = rows[1:]  # the first line may be cut by the beginning of the read
+                for row in reversed(rows):
+                    time = _row_time(row, columns, time_column)
+                    if time is not None and time >= file_first:
+                        file_last = time
+                        break
+                if begin == 0:
+                    break
+                length *= 16
+
+        if first is None:
+            first = file_first
+        if file_last is not None:
+            last = file_last
+
+    if first is None:
+        return None
+    return first, last
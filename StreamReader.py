@@ -0,0 +1,290 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Iterator, List, Optional, Tuple
+
+import argparse
+
+import numpy as np
+
+from DataCarrier import DataCarrier, SensorData
+from EventChecker import _scan_chunk, pick_windows
+from Precision import precision
+from SensorArchive import is_archive, iterate_blocks, read_index
+from SensorCsv import iterate_chunks, read_header, sensor_columns
+
+# samples of the core of one chunk and rows parsed at once - about 5 minutes of accelerometer at 100 Hz
+# most of the memory is taken by the csv parser, so smaller blocks than in SensorCsv keep the workers small
+STREAM_ROWS = 1 << 15
+
+# overlap of the chunks in seconds - pick_array_of_interest needs the signal before and after the peak
+# the history is the window of scan_triggers, so stream_events finds the same events as find_events
+HISTORY_SECONDS = 10.0
+FUTURE_SECONDS = 1.0
+
+
+class StreamChunk:
+    def __init__(
+        self,
+        time: np.ndarray,
+        data: np.ndarray,
+        acc: Optional[np.ndarray],
+        start: int,
+        core_begin: int,
+        core_end: int,
+        origin: int,
+    ):
+        """
+        Part of the recording - the core of the chunk is surrounded by history and future of the neighbouring chunks.
+        Cores of the consecutive chunks follow each other without gaps and overlaps.
+        :param time: time in nanoseconds
+        :param data: matrix axes x samples
+        :param acc: accuracy of samples, None for sensors without accuracy
+        :param start: index of the first sample of the chunk in the whole recording
+        :param core_begin: index of the first sample of the core in the chunk
+        :param core_end: index after the last sample of the core in the chunk
+        :param origin: time of the first sample of the recording in nanoseconds
+        """
+        self.time = time
+        self.data = data
+        self.acc = acc
+        self.start = start
+        self.core_begin = core_begin
+        self.core_end = core_end
+        self.origin = origin
+
+    @property
+    def time_seconds(self) -> np.ndarray:
+        """
+        :return: time in seconds from the beginning of the recording - same as Consts.TIME_SECONDS of whole DataCarrier
+        """
+        return (self.time - self.origin) * (10 ** -9)
+
+    @property
+    def magnitude(self) -> np.ndarray:
+        return SensorData(self.time, self.data, self.acc).magnitude
+
+    @property
+    def core(self) -> slice:
+        return slice(self.core_begin, self.core_end)
+
+    def in_core(self, index: int) -> bool:
+        """
+        Events found in the overlap are found again by the neighbouring chunk - keep only the ones with peak in the core.
+        The indication of the fall can last longer than any overlap, use stream_events for the same events as
+        find_events over the whole recording.
+        :param index: index of the sample in the chunk
+        :return: True, if the sample belongs to the core
+        """
+        return self.core_begin <= index < self.core_end
+
+    def sensor_data(self) -> SensorData:
+        """
+        :return: chunk as SensorData with time in seconds from the beginning of the recording, which can be passed
+        to the EventChecker - magnitude is computed at the first access
+        """
+        sensor = SensorData(self.time, self.data, self.acc)
+        sensor.modified[Consts.TIME_SECONDS] = self.time_seconds
+        return sensor
+
+
+def stream_sensor(
+    files: List[str],
+    chunk_rows=STREAM_ROWS,
+    history=HISTORY_SECONDS,
+    future=FUTURE_SECONDS,
+    block_rows=STREAM_ROWS,
+    dtype=None,
+) -> Iterator[StreamChunk]:
+    """
+    Reads one sensor in chunks with bounded memory - only the core, the overlap and one parsed block of rows
+    are held at once, regardless of the length of the recording. Split files are read one after another,
+    so the chunks continue over the borders of the files.
+    :param files: csv files / archives of the same sensor in chronological order - DataCarrier.sensor_paths
+    :param chunk_rows: number of samples in the core of the chunk
+    :param history: seconds before the core added to the chunk - the last sample older than the history is added
+    too, as scan_triggers starts its window there
+    :param future: seconds after the core added to the chunk
+    :param block_rows: rows parsed from csv at once - archives are decoded by their blocks
+    :param dtype: floating type of the data - None for Precision
+    :return: generator of chunks
+    """
+    if not files:
+        return
+    dtype = precision.resolve(dtype)
+    if is_archive(files[0]):
+        index = read_index(files[0])
+        axes, with_accuracy = index["axes"], index["with_accuracy"]
+        blocks = iterate_blocks(files, dtype=dtype)
+    else:
+        columns = sensor_columns(read_header(files[0]))
+        if columns is None:
+            return
+        names, with_accuracy = columns
+        axes = len(names)
+        blocks = iterate_chunks(files, names, with_accuracy, block_rows, dtype)
+    history_nanos = int(history * 10 ** 9)
+    future_nanos = int(future * 10 ** 9)
+
+    time = np.empty(0, dtype=np.int64)
+    data = np.empty((axes, 0), dtype=dtype)
+    acc = np.empty(0, dtype=np.int8) if with_accuracy else None
+    offset = 0  # index of the first buffered sample in the recording
+    core_start = 0  # index of the first sample of the next core in the buffer
+    origin = None
+    exhausted = False
+
+    def enough(rows: int) -> bool:
+        """
+        :param rows: samples of the core in the buffer
+        :return: True, if the buffer holds the full core and its future
+        """
+        if rows < chunk_rows:
+            return False
+        return time[-1] >= time[core_start + chunk_rows - 1] + future_nanos
+
+    while True:
+        while not exhausted and not enough(time.shape[0] - core_start):
+            block = next(blocks, None)
+            if block is None:
+                exhausted = True
+                break
+            block_time, block_data, block_acc = block
+            if not block_time.shape[0]:
+                continue
+            if origin is None:
+                origin = block_time.item(0)
+            time = np.concatenate((time, block_time))
+            data = np.concatenate((data, block_data), axis=1)
+            if with_accuracy:
+                acc = np.concatenate((acc, block_acc))
+
+        if core_start >= time.shape[0]:
+            return
+
+        core_end = min(core_start + chunk_rows, time.shape[0])
+        begin = max(np.searchsorted(time, time[core_start] - history_nanos, "left") - 1, 0)
+        end = np.searchsorted(time, time[core_end - 1] + future_nanos, "right")
+        yield StreamChunk(
+            time[begin:end],
+            data[:, begin:end],
+            acc[begin:end] if with_accuracy else None,
+            offset + begin,
+            core_start - begin,
+            core_end - begin,
+            origin,
+        )
+
+        # drops everything before the history of the next core
+        # the next core starts after the last buffered sample, if the buffer ends with the core
+        core_start = core_end
+        next_time = time[core_start] if core_start < time.shape[0] else time[-1]
+        drop = max(np.searchsorted(time, next_time - history_nanos, "left") - 1, 0)
+        time = time[drop:]
+        data = data[:, drop:]
+        if with_accuracy:
+            acc = acc[drop:]
+        offset += drop
+        core_start -= drop
+
+
+def stream_events(
+    files: List[str],
+    chunk_rows=STREAM_ROWS,
+    threshold=30.0,
+    refractory=0.75,
+    delay=5.0,
+    window=10.0,
+    threshold_ending=15,
+    begin_max=0.3,
+    end_max=0.7,
+    block_rows=STREAM_ROWS,
+    dtype=None,
+) -> Iterator[Tuple[StreamChunk, np.ndarray]]:
+    """
+    find_events of long recording chunk by chunk - the indication of scan_triggers continues from chunk to chunk,
+    so the events are the same as of find_events over the whole recording. The window ends at the firing sample
+    in the core and the history of the chunk covers the window, so no future is needed.
+    :param files: csv files / archives of the accelerometer in chronological order - DataCarrier.sensor_paths
+    :param chunk_rows: number of samples in the core of the chunk
+    :param threshold: magnitude, which starts the indication
+    :param refractory: seconds after the indication, when the fall proceeds
+    :param delay: seconds after the last indication, when the window is cut
+    :param window: length of the window in seconds
+    :param threshold_ending: at end, minimal value of ending
+    :param begin_max: max time to middle
+    :param end_max: max end time of event
+    :param block_rows: rows parsed from csv at once
+    :param dtype: floating type of the data - None for Precision
+    :return: generator of chunks with the events fired in their core - matrix events x BOUNDARY_COLUMNS with
+    indexes into the chunk, chunk.start is added for indexes into the recording
+    """
+    state = np.zeros(2)
+    for chunk in stream_sensor(files, chunk_rows, window, 0.0, block_rows, dtype):
+        time_seconds = chunk.time_seconds
+        magnitude = chunk.magnitude
+        window_begins, window_ends = _scan_chunk(
+            time_seconds,
+            magnitude,
+            chunk.core_begin,
+            chunk.core_end,
+            state,
+            threshold,
+            refractory,
+            delay,
+            window,
+        )
+        yield chunk, pick_windows(
+            time_seconds,
+            magnitude,
+            window_begins,
+            window_ends,
+            threshold_ending,
+            begin_max,
+            end_max,
+        )
+
+
+def stream_acceleration(path: str, **kwargs) -> Iterator[StreamChunk]:
+    """
+    :param path: path to folder with the measurements
+    :param kwargs: arguments of stream_sensor
+    :return: generator of chunks of the accelerometer, nothing for folders without accelerometer
+    """
+    return stream_sensor(DataCarrier(path, use_cache=False).sensor_paths(Consts.ACG), **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streams accelerometer of the measurement in chunks")
+    parser.add_argument("path", help="measurement folder")
+    parser.add_argument("--rows", type=int, default=STREAM_ROWS, help="samples in the core of the chunk")
+    arguments = parser.parse_args()
+
+    for chunk in stream_acceleration(arguments.path, chunk_rows=arguments.rows):
+        seconds = chunk.time_seconds
+        print(
+            "samples {} - {}, {:.1f} - {:.1f} s, max magnitude {:.2f}".format(
+                chunk.start + chunk.core_begin,
+                chunk.start + chunk.core_end,
+                seconds[chunk.core_begin],
+                seconds[chunk.core_end - 1],
+                chunk.magnitude[chunk.core].max(),
+            )
+        )
@@ -0,0 +1,138 @@
+"""
+ This file is part of BeSafeBox Android application.
+ Copyright (C) 2019  Tomáš Repčík
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from Consts import Consts
+
+from typing import Iterable, Optional, Tuple
+
+import os
+import numpy as np
+
+GRAVITY = 9.81
+
+
+def _orientation(rng: np.random.Generator) -> np.ndarray:
+    """
+    :param rng: random generator
+    :return: random unit vector - direction of the gravity in the phone
+    """
+    vector = rng.normal(size=3)
+    return vector / np.linalg.norm(vector)
+
+
+def generate_acceleration(
+    sample_rate=100,
+    seconds=12.0,
+    fall_times: Optional[Iterable[float]] = None,
+    seed=0,
+    noise=0.3,
+    start_nanos=10 ** 9,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Deterministic synthetic recording of the accelerometer, which resembles SensorBox data.
+    The phone lies in a pocket with 1g baseline and noise. Every fall consists of a free-fall dip below 0.9g,
+    an impact peak above 3g with damped oscillations and a rest with a new orientation of the phone.
+    :param sample_rate: samples per second
+    :param seconds: length of the recording
+    :param fall_times: times of the impacts in seconds - one fall in the middle by default
+    :param seed: seed of the generator - same seed gives same recording
+    :param noise: standard deviation of the noise in m/s2
+    :param start_nanos: time of the first sample in nanoseconds (Android system time)
+    :return: time in nanoseconds (int64), acceleration 3 x samples
+    """
+    rng = np.random.default_rng(seed)
+    n = int(round(sample_rate * seconds))
+    time = start_nanos + np.round(np.arange(n) * (1e9 / sample_rate)).astype(np.int64)
+    time_seconds = np.arange(n) / sample_rate
+
+    if fall_times is None:
+        fall_times = [seconds / 2]
+
+    # gravity direction changes after every fall - the phone lands in a different position
+    direction = np.empty((3, n))
+    direction[:] = _orientation(rng)[:, None]
+    magnitude = np.full(n, GRAVITY)
+
+    for fall_time in sorted(fall_times):
+        impact = int(round(fall_time * sample_rate))
+        if not 0 <= impact < n:
+            continue
+
+        # free fall - magnitude drops close to 0g
+        free_fall = int(round(rng.uniform(0.2, 0.35) * sample_rate))
+        begin = max(impact - free_fall, 0)
+        magnitude[begin:impact] = rng.uniform(0.5, 4.0)
+
+        # impact with damped oscillation, the peak is always above 3g
+        peak = rng.uniform(3.5, 6.0) * GRAVITY
+        oscillation = np.arange(n - impact) / sample_rate
+        magnitude[impact:] += (
+            (peak - GRAVITY)
+            * np.exp(-oscillation * rng.uniform(8, 14))
+            * np.cos(2 * np.pi * rng.uniform(4, 8) * oscillation)
+        )
+        direction[:, impact:] = _orientation(rng)[:, None]
+
+    xyz = direction * magnitude + rng.normal(0, noise, (3, n))
+    return time, xyz
+
+
+def write_measurement(
+    folder: str,
+    time: np.ndarray,
+    acg_xyz: np.ndarray,
+    split=1,
+    hold="Pocket",
+    environment="Walk",
+):
+    """
+    Writes the recording as a SensorBox measurement folder readable by DataCarrier -
+    name of the folder should contain the activity, e.g. FALL_1
+    :param folder: path to the folder - created, if it does not exist
+    :param time: time in nanoseconds
+    :param acg_xyz: acceleration 3 x samples
+    :param split: number of ACG files - older versions of SensorBox split the sensor into ACG_1.csv, ACG_2.csv, ...
+    :param hold: placement of the phone for extra.txt
+    :param environment: activity of the person for extra.txt
+    """
+    os.makedirs(folder, exist_ok=True)
+
+    parts = np.array_split(np.arange(time.shape[0]), split)
+    for number, part in enumerate(parts, start=1):
+        name = "{}.csv".format(Consts.ACG) if split == 1 else "{}_{}.csv".format(
+            Consts.ACG, number
+        )
+        with open(os.path.join(folder, name), "w", encoding="utf-8") as file:
+            file.write("t;x;y;z;a\n")
+            for i in part:
+                file.write(
+                    "{};{!r};{!r};{!r};3\n".format(
+                        time[i],
+                        float(acg_xyz[0, i]),
+                        float(acg_xyz[1, i]),
+                        float(acg_xyz[2, i]),
+                    )
+                )
+
+    with open(os.path.join(folder, "extra.txt"), "w", encoding="utf-8") as file:
+        file.write(
+            ">HOLD\n{}\n>ENVIRONMENT\n{}\n>MAXVALUES\n{}:78.4532\n"
+            ">Millis\nMillis:1600000000000\n>Nanos\nNanos:{}\nt;c\nx;x\n".format(
+                hold, environment, Consts.ACG, time[0]
+            )
+        )
@@ -0,0 +1,63 @@
+import numpy as np
+
+from Consts import Consts
+from PrecisionValidation import DEVIATION_COLUMNS, feature_deviations
+
+PATHS = np.array(["FALL_1", "SIT_2", "WALK_3"])
+
+
+def _matrices():
+    reference = np.ones((PATHS.shape[0], len(Consts.parameters_names)))
+    return reference, reference.copy()
+
+
+def _row(deviations, feature):
+    return deviations[deviations["feature"] == feature].iloc[0]
+
+
+def test_equal_features_have_no_deviation():
+    reference, reduced = _matrices()
+    deviations = feature_deviations(reference, reduced, PATHS)
+    assert list(deviations.columns) == DEVIATION_COLUMNS
+    assert (deviations["max_abs_deviation"] == 0).all()
+    assert (deviations["max_rel_deviation"] == 0).all()
+
+
+def test_nan_in_both_modes_is_not_deviation():
+    reference, reduced = _matrices()
+    column = Consts.parameters_names.index("mobility")
+    reference[1, column] = reduced[1, column] = np.nan
+    row = _row(feature_deviations(reference, reduced, PATHS), "mobility")
+    assert row["max_abs_deviation"] == 0
+    assert row["max_rel_deviation"] == 0
+
+
+def test_nan_in_one_mode_is_reported():
+    reference, reduced = _matrices()
+    column = Consts.parameters_names.index("mobility")
+    reduced[1, column] = np.nan
+    reduced[2, column] = 1.5  # finite deviation does not hide the nan
+    row = _row(feature_deviations(reference, reduced, PATHS), "mobility")
+    assert row["max_abs_deviation"] == np.inf
+    assert row["max_rel_deviation"] == np.inf
+    assert row["path"] == "SIT_2"
+
+
+def test_overflow_in_one_mode_is_reported():
+    reference, reduced = _matrices()
+    column = Consts.parameters_names.index("mobility")
+    reduced[0, column] = np.inf
+    row = _row(feature_deviations(reference, reduced, PATHS), "mobility")
+    assert row["max_rel_deviation"] == np.inf
+    assert row["path"] == "FALL_1"
+
+
+def test_relative_deviation():
+    reference, reduced = _matrices()
+    column = Consts.parameters_names.index("mobility")
+    reference[2, column] = 4.0
+    reduced[2, column] = 3.0
+    row = _row(feature_deviations(reference, reduced, PATHS), "mobility")
+    assert row["max_abs_deviation"] == 1.0
+    assert row["max_rel_deviation"] == 0.25
+    assert row["path"] == "WALK_3"
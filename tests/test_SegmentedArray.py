@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from SegmentedArray import SegmentedArray, SegmentedSensor
+
+
+def _split(array: np.ndarray, rng: np.random.Generator) -> SegmentedArray:
+    """
+    :return: array split into random segments, empty segments included
+    """
+    borders = np.sort(rng.integers(0, array.shape[-1] + 1, rng.integers(0, 5)))
+    return SegmentedArray(np.split(array, borders, axis=-1))
+
+
+@pytest.fixture(params=[1, 2], ids=["vector", "matrix"])
+def arrays(request):
+    rng = np.random.default_rng(request.param)
+    cases = []
+    for _ in range(200):
+        samples = int(rng.integers(1, 40))
+        array = rng.normal(size=samples if request.param == 1 else (3, samples))
+        cases.append((array, _split(array, rng), rng))
+    return cases
+
+
+def test_properties(arrays):
+    for array, segmented, _ in arrays:
+        assert segmented.shape == array.shape
+        assert segmented.ndim == array.ndim
+        assert segmented.dtype == array.dtype
+        assert len(segmented) == array.shape[-1]
+        np.testing.assert_array_equal(segmented.materialize(), array)
+        np.testing.assert_array_equal(np.asarray(segmented), array)
+
+
+def test_index(arrays):
+    for array, segmented, _ in arrays:
+        for index in range(-array.shape[-1], array.shape[-1]):
+            np.testing.assert_array_equal(segmented[index], array[..., index])
+        with pytest.raises(IndexError):
+            segmented[array.shape[-1]]
+
+
+def test_slice(arrays):
+    for array, segmented, rng in arrays:
+        samples = array.shape[-1]
+        for _ in range(20):
+            start, stop = rng.integers(-samples - 2, samples + 2, 2)
+            step = int(rng.choice([1, 1, 2, 3, -1, -2]))
+            item = slice(int(start), int(stop), step)
+            np.testing.assert_array_equal(segmented[item], array[..., item])
+        np.testing.assert_array_equal(segmented[:], array)
+
+
+def test_slice_in_one_segment_is_view():
+    first, second = np.arange(5.0), np.arange(5.0, 10.0)
+    segmented = SegmentedArray([first, second])
+    assert np.shares_memory(segmented[6:9], second)
+    np.testing.assert_array_equal(segmented[3:7], np.arange(3.0, 7.0))
+
+
+def test_take(arrays):
+    for array, segmented, rng in arrays:
+        samples = array.shape[-1]
+        indexes = rng.integers(-samples, samples, rng.integers(0, 30))
+        np.testing.assert_array_equal(segmented[indexes], array[..., indexes])
+        np.testing.assert_array_equal(segmented.take(indexes), array[..., indexes])
+        with pytest.raises(IndexError):
+            segmented[np.array([samples])]
+
+
+def test_boolean_mask(arrays):
+    for array, segmented, rng in arrays:
+        mask = rng.random(array.shape[-1]) < 0.5
+        np.testing.assert_array_equal(segmented[mask], array[..., mask])
+        np.testing.assert_array_equal(segmented.take(mask), array[..., mask])
+        with pytest.raises(IndexError):
+            segmented[np.ones(array.shape[-1] + 1, dtype=bool)]
+
+
+def test_boolean_mask_is_not_read_as_indexes():
+    segmented = SegmentedArray([np.arange(3), np.arange(3, 6)])
+    mask = np.array([True, False, True, False, True, False])
+    np.testing.assert_array_equal(segmented[mask], [0, 2, 4])
+    np.testing.assert_array_equal(segmented[list(mask)], [0, 2, 4])
+
+
+def test_float_indexes_are_rejected():
+    segmented = SegmentedArray([np.arange(3), np.arange(3, 6)])
+    with pytest.raises(IndexError):
+        segmented[np.array([1.0, 2.0])]
+
+
+def test_searchsorted():
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        time = np.sort(rng.integers(0, 50, rng.integers(1, 40)))
+        segmented = _split(time, rng)
+        for value in range(-2, 53):
+            for side in ["left", "right"]:
+                assert segmented.searchsorted(value, side) == np.searchsorted(time, value, side)
+
+
+def test_empty_segments():
+    segmented = SegmentedArray([np.empty(0), np.arange(3.0), np.empty(0)])
+    assert len(segmented) == 3
+    np.testing.assert_array_equal(segmented[1:], [1.0, 2.0])
+    assert len(SegmentedArray([np.empty(0)])) == 0
+    with pytest.raises(ValueError):
+        SegmentedArray([])
+
+
+def test_sensor_slice_time():
+    time = np.arange(0, 100, 10, dtype=np.int64)
+    data = np.arange(30.0).reshape(3, 10)
+    sensor = SegmentedSensor(
+        SegmentedArray([time[:4], time[4:]]),
+        SegmentedArray([data[:, :4], data[:, 4:]]),
+        None,
+    )
+    part_time, part_data, part_acc = sensor.slice_time(25, 60)
+    np.testing.assert_array_equal(part_time, [30, 40, 50, 60])
+    np.testing.assert_array_equal(part_data, data[:, 3:7])
+    assert part_acc is None